@@ -0,0 +1,112 @@
+from collections import deque
+from time import monotonic
+import numpy as np
+import cv2
+
+# Motion trigger for the continuous camera loops: frames are differenced
+# against a running background on a small grayscale copy, and full inference
+# only runs while there has been motion within the cooldown window.
+
+
+class MotionTrigger:
+	# sensitivity is the fraction of pixels that must change; threshold is the
+	# per-pixel gray-level difference that counts as a change
+	def __init__(self, sensitivity=0.02, threshold=25, cooldown=10.0, width=80, alpha=0.05):
+		self.sensitivity = sensitivity
+		self.threshold = threshold
+		self.cooldown = cooldown
+		self.width = width
+		self.alpha = alpha
+		self.shape = None
+		self.small = None
+		self.gray = None
+		self.grayf = None
+		self.background = None
+		self.diff = None
+		self.mask = None
+		self.last_motion = None
+		self.frames = 0
+		self.motion_frames = 0
+		self.inferences = deque()
+
+	def _allocate(self, frame):
+		self.shape = frame.shape[:2]
+		h, w = self.shape
+		sw = min(self.width, w)
+		sh = max(1, h * sw // w)
+		self.small = np.empty((sh, sw, 3), dtype=np.uint8)
+		self.gray = np.empty((sh, sw), dtype=np.uint8)
+		self.grayf = np.empty((sh, sw), dtype=np.float32)
+		self.diff = np.empty((sh, sw), dtype=np.float32)
+		self.mask = np.empty((sh, sw), dtype=bool)
+		self.background = None
+
+	# Fraction of pixels that moved relative to the background
+	def update(self, frame):
+		if frame.shape[:2] != self.shape:
+			self._allocate(frame)
+		sh, sw = self.gray.shape
+		cv2.resize(frame, (sw, sh), dst=self.small, interpolation=cv2.INTER_AREA)
+		cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+		cv2.GaussianBlur(self.gray, (5, 5), 0, dst=self.gray)
+		np.copyto(self.grayf, self.gray)
+		self.frames += 1
+		if self.background is None:
+			self.background = self.grayf.copy()
+			return 0.0
+		np.subtract(self.grayf, self.background, out=self.diff)
+		np.abs(self.diff, out=self.diff)
+		np.greater(self.diff, self.threshold, out=self.mask)
+		changed = np.count_nonzero(self.mask) / self.mask.size
+		cv2.accumulateWeighted(self.grayf, self.background, self.alpha)
+		return changed
+
+	def should_infer(self, frame, now=None):
+		now = monotonic() if now is None else now
+		if frame is not None and self.update(frame) >= self.sensitivity:
+			self.motion_frames += 1
+			self.last_motion = now
+		return self.last_motion is not None and now - self.last_motion <= self.cooldown
+
+	# Motion seen elsewhere (another frame source) counts as this trigger's
+	def note_motion(self, now=None):
+		self.last_motion = monotonic() if now is None else now
+
+	def record_inference(self, now=None):
+		now = monotonic() if now is None else now
+		self.inferences.append(now)
+		while self.inferences and now - self.inferences[0] > 60:
+			self.inferences.popleft()
+
+	def inferences_per_minute(self, now=None):
+		now = monotonic() if now is None else now
+		while self.inferences and now - self.inferences[0] > 60:
+			self.inferences.popleft()
+		return len(self.inferences)
+
+
+def main():
+	from time import perf_counter
+	scene = np.tile(np.linspace(60, 200, 640, dtype=np.uint8)[None, :, None], (480, 1, 3))
+	person = scene.copy()
+	person[100:400, 200:450] = 30
+	trigger = MotionTrigger(cooldown=5.0)
+
+	# 10 minutes at 2 fps: empty scene, someone walks in at 5 min and stays 30 s
+	t = 0.0
+	inferred = 0
+	start = perf_counter()
+	for i in range(1200):
+		frame = person if 600 <= i < 660 else scene
+		if trigger.should_infer(frame, now=t):
+			trigger.record_inference(now=t)
+			inferred += 1
+		t += 0.5
+	per_frame = (perf_counter() - start) / 1200
+	print(f"{inferred} of 1200 frames sent to inference ({trigger.motion_frames} with motion), "
+		f"trigger cost {per_frame * 1000:.3f} ms/frame")
+	print(f"Every-other-frame baseline would run 600 inferences")
+
+
+if __name__ == "__main__":
+	main()
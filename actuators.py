@@ -0,0 +1,299 @@
+import threading
+from collections import deque
+from time import sleep, monotonic
+
+from motion import MovePlan
+
+# Actuator service: buzzer, LED and motor patterns are declared up front as
+# timed events and played by one background thread, so callers start an alert
+# or a dispense and carry on (capture, classify) instead of sleeping through
+# it. Each pattern claims the devices it touches. A new pattern preempts any
+# running one on the same devices with equal or lower priority (which is
+# switched off and cancelled); against a higher priority one it waits, or is
+# dropped when queue=False.
+
+
+class Pattern:
+	# events are (offset_s, device, value): True/False switches a gpiozero
+	# style device on or off, a MovePlan is handed to a MotionController
+	def __init__(self, name, events, priority=0):
+		self.name = name
+		self.events = sorted(events, key=lambda event: event[0])
+		self.priority = priority
+		self.devices = {device for _, device, _ in self.events}
+
+	@property
+	def duration(self):
+		return max((t + (value.duration if isinstance(value, MovePlan) else 0) for t, _, value in self.events), default=0.0)
+
+	# This pattern followed by other, gap seconds after it ends
+	def then(self, other, gap=0.0):
+		shift = self.duration + gap
+		events = self.events + [(t + shift, device, value) for t, device, value in other.events]
+		return Pattern(self.name, events, max(self.priority, other.priority))
+
+	def __repr__(self):
+		return f"Pattern({self.name!r}, {len(self.events)} events, {self.duration:.2f} s, priority {self.priority})"
+
+
+# The trailing off period is part of the pattern, so it still claims the
+# device until the last gap has passed
+def pulses(device, count=1, on=0.2, off=0.2, name="pulses", priority=0):
+	events = []
+	for i in range(count):
+		t = i * (on + off)
+		events += [(t, device, True), (t + on, device, False)]
+	if count and off:
+		events.append((count * (on + off), device, False))
+	return Pattern(name, events, priority)
+
+
+def hold(device, seconds, name="hold", priority=0):
+	return Pattern(name, [(0.0, device, True), (seconds, device, False)], priority)
+
+
+def move(controller, plan, name="move", priority=0):
+	return Pattern(name, [(0.0, controller, plan)], priority)
+
+
+class Playback:
+	def __init__(self, pattern, service):
+		self.pattern = pattern
+		self.service = service
+		self.index = 0
+		self.moves = []
+		self.started = None
+		self.finished = None
+		self.status = "waiting"
+		self.done = threading.Event()
+
+	def cancel(self):
+		self.service.cancel(self)
+
+	def wait(self, timeout=None):
+		return self.done.wait(timeout)
+
+	def __repr__(self):
+		return f"Playback({self.pattern.name!r}, {self.status})"
+
+
+class Actuators:
+	def __init__(self):
+		self.cond = threading.Condition()
+		self.active = []
+		self.waiting = []
+		self.played = 0
+		self.preempted = 0
+		self.dropped = 0
+		self.lateness = deque(maxlen=1000)
+		self.changed = False
+		self.running = True
+		self.thread = threading.Thread(target=self._run, name="actuators", daemon=True)
+		self.thread.start()
+
+	def play(self, pattern, queue=True):
+		playback = Playback(pattern, self)
+		with self.cond:
+			busy = [p for p in self.active if p.pattern.devices & pattern.devices]
+			if any(p.pattern.priority > pattern.priority for p in busy):
+				if queue:
+					self.waiting.append(playback)
+				else:
+					self.dropped += 1
+					playback.status = "dropped"
+					playback.done.set()
+			else:
+				# Claim the devices before anything waiting can be promoted onto them
+				for p in busy:
+					self._stop(p, "preempted", promote=False)
+					self.preempted += 1
+				self._start(playback)
+				self._promote()
+			self.cond.notify()
+		return playback
+
+	# A playback, or every playback of the pattern with that name
+	def cancel(self, target):
+		with self.cond:
+			for p in list(self.active) + list(self.waiting):
+				if p is target or p.pattern.name == target:
+					self._stop(p, "cancelled")
+			self.cond.notify()
+
+	def busy(self, name=None):
+		with self.cond:
+			return any(name is None or p.pattern.name == name for p in self.active)
+
+	def close(self):
+		with self.cond:
+			for p in list(self.active) + list(self.waiting):
+				self._stop(p, "cancelled")
+			self.running = False
+			self.cond.notify()
+		self.thread.join(timeout=2)
+
+	def _start(self, playback):
+		playback.started = monotonic()
+		playback.status = "playing"
+		self.active.append(playback)
+		self.changed = True
+
+	# Switch off what the playback touched and release its devices
+	def _stop(self, playback, status, promote=True):
+		if playback in self.waiting:
+			self.waiting.remove(playback)
+		elif playback in self.active:
+			for move in playback.moves:
+				move.cancel()
+			for device in playback.pattern.devices:
+				if not hasattr(device, "move"):
+					device.off()
+		self._finish(playback, status, promote)
+
+	def _finish(self, playback, status, promote=True):
+		if playback in self.active:
+			self.active.remove(playback)
+		playback.status = status
+		playback.finished = monotonic()
+		playback.done.set()
+		if promote:
+			self._promote()
+
+	# Start waiting playbacks whose devices are free, highest priority first,
+	# then oldest
+	def _promote(self):
+		for p in sorted(self.waiting, key=lambda p: -p.pattern.priority):
+			if not any(a.pattern.devices & p.pattern.devices for a in self.active):
+				self.waiting.remove(p)
+				self._start(p)
+
+	def _apply(self, playback, device, value):
+		if isinstance(value, MovePlan):
+			playback.moves.append(device.move(value))
+		elif value:
+			device.on()
+		else:
+			device.off()
+
+	def _run(self):
+		with self.cond:
+			while self.running:
+				now = monotonic()
+				wake = None
+				self.changed = False
+				for p in list(self.active):
+					events = p.pattern.events
+					while p.index < len(events) and p.started + events[p.index][0] <= now:
+						offset, device, value = events[p.index]
+						self.lateness.append(now - (p.started + offset))
+						try:
+							self._apply(p, device, value)
+						except Exception as e:
+							print(f"Actuator pattern {p.pattern.name} failed: {e}")
+						p.index += 1
+					if p.index < len(events):
+						at = p.started + events[p.index][0]
+					elif all(m.done.is_set() for m in p.moves):
+						self.played += 1
+						self._finish(p, "done")
+						continue
+					else:
+						# Motor still moving; its own thread keeps the timing
+						at = now + 0.01
+					wake = at if wake is None else min(wake, at)
+				if self.changed:
+					# Something was promoted from the waiting list this pass
+					continue
+				self.cond.wait(None if wake is None else max(0.0, wake - monotonic()))
+
+	def stats(self):
+		with self.cond:
+			late = sorted(self.lateness)
+			active = [p.pattern.name for p in self.active]
+			waiting = [p.pattern.name for p in self.waiting]
+
+		def pct(q):
+			return round(late[min(len(late) - 1, int(len(late) * q))] * 1000, 2) if late else None
+		return {
+			"played": self.played,
+			"preempted": self.preempted,
+			"dropped": self.dropped,
+			"active": active,
+			"waiting": waiting,
+			"late_p50_ms": pct(0.5),
+			"late_p99_ms": pct(0.99),
+		}
+
+
+class MockDevice:
+	def __init__(self, name):
+		self.name = name
+		self.value = 0
+		self.log = []
+
+	def on(self):
+		self.value = 1
+		self.log.append((monotonic(), 1))
+
+	def off(self):
+		self.value = 0
+		self.log.append((monotonic(), 0))
+
+
+def main():
+	from motion import MotionController, MockPin, plan_angle
+	buzzer, led = MockDevice("buzzer"), MockDevice("led")
+	motion = MotionController([MockPin() for _ in range(4)])
+	actuators = Actuators()
+
+	# Dose cycle with the stand-in recognition time of a 5-frame burst
+	recognize = 1.5
+	alert = pulses(buzzer, count=2, on=2, off=2, name="alert", priority=1)
+
+	def dispense():
+		plan = plan_angle(60, 1, rpm=10)
+		return Pattern("dispense", [(0, buzzer, False), (0, led, True), (0, motion, plan), (plan.duration, led, False)], priority=2)
+
+	t0 = monotonic()
+	actuators.play(alert).wait()
+	sleep(recognize)
+	actuators.play(dispense()).wait()
+	blocking = monotonic() - t0
+
+	t0 = monotonic()
+	playing = actuators.play(alert)
+	sleep(recognize)
+	actuators.play(dispense()).wait()
+	overlapped = monotonic() - t0
+	print(f"Dose cycle: {blocking:.2f} s with a blocking alert, {overlapped:.2f} s overlapped "
+		f"(alert {playing.status} after {playing.finished - playing.started:.2f} s)")
+
+	# Timing accuracy while three patterns share the thread
+	actuators.lateness.clear()
+	a = actuators.play(pulses(buzzer, count=50, on=0.01, off=0.01))
+	b = actuators.play(pulses(led, count=40, on=0.013, off=0.012))
+	a.wait()
+	b.wait()
+	print(f"Event lateness: {actuators.stats()}")
+
+	low = actuators.play(hold(led, 0.5, name="low"))
+	high = actuators.play(hold(led, 0.2, name="high", priority=5))
+	queued = actuators.play(hold(led, 0.1, name="queued"))
+	dropped = actuators.play(hold(led, 0.1, name="dropped"), queue=False)
+	queued.wait()
+	print(f"Priorities: {low}, {high}, {queued}, {dropped}")
+
+	# Preempting the pattern a queued one waits behind must not start both
+	# the queued one and the preempting one on the same device
+	alert = actuators.play(pulses(buzzer, count=5, name="alert", priority=1))
+	queued = actuators.play(hold(buzzer, 0.1, name="queued").then(hold(led, 0.1)))
+	dispense = actuators.play(hold(led, 0.3, name="dispense", priority=2).then(hold(buzzer, 0.1)))
+	assert (alert.status, queued.status, dispense.status) == ("preempted", "waiting", "playing"), (alert, queued, dispense)
+	queued.wait(2)
+	assert queued.started >= dispense.finished, "queued pattern ran alongside the preempting one"
+	actuators.close()
+	motion.close()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,146 @@
+from time import monotonic
+import numpy as np
+
+# Streaming aggregation for sensor readings: each metric keeps a fixed-size
+# NumPy ring of (timestamp, value) and windowed min/max/mean/stddev are
+# computed vectorized over it. Only window summaries and threshold crossings
+# are emitted, not every raw reading. A ring that would overwrite a sample
+# still inside the longest window doubles instead, so a fast sensor or the
+# framed protocol does not quietly shorten the window.
+
+
+class MetricRing:
+	# span is the longest window asked of the ring, None for a fixed size
+	def __init__(self, capacity=1024, span=None, max_capacity=65536):
+		self.times = np.full(capacity, -np.inf)
+		self.values = np.zeros(capacity)
+		self.capacity = capacity
+		self.span = span
+		self.max_capacity = max_capacity
+		self.head = 0
+		self.count = 0
+		self.short = False
+
+	def append(self, t, value):
+		if self.span is not None and self.times[self.head] >= t - self.span:
+			if self.capacity < self.max_capacity:
+				self._grow()
+			elif not self.short:
+				self.short = True
+				print(f"Sensor ring full at {self.capacity} samples, windows cover less than {self.span} s")
+		self.times[self.head] = t
+		self.values[self.head] = value
+		self.head = (self.head + 1) % self.capacity
+		self.count += 1
+
+	# Oldest first into a ring twice the size, writing on after the newest
+	def _grow(self):
+		capacity = min(self.capacity * 2, self.max_capacity)
+		times = np.full(capacity, -np.inf)
+		values = np.zeros(capacity)
+		times[:self.capacity] = np.roll(self.times, -self.head)
+		values[:self.capacity] = np.roll(self.values, -self.head)
+		self.times, self.values = times, values
+		self.head = self.capacity
+		self.capacity = capacity
+
+	def window(self, now, seconds):
+		mask = self.times >= now - seconds
+		return self.values[mask]
+
+	def stats(self, now, seconds):
+		values = self.window(now, seconds)
+		if not len(values):
+			return None
+		return {
+			"count": int(len(values)),
+			"min": float(values.min()),
+			"max": float(values.max()),
+			"mean": float(values.mean()),
+			"std": float(values.std()),
+		}
+
+
+class SensorAggregator:
+	# windows are in seconds; thresholds map metric -> (low, high), either may be None
+	def __init__(self, metrics=("temperature", "humidity"), windows=(60, 300), emit_every=60,
+		thresholds=None, capacity=1024):
+		self.rings = {name: MetricRing(capacity, span=max(windows)) for name in metrics}
+		self.windows = windows
+		self.emit_every = emit_every
+		self.thresholds = thresholds or {}
+		self.state = {name: "ok" for name in metrics}
+		self.last_emit = None
+		self.readings = 0
+		self.emitted = 0
+
+	# Returns a list of events to publish: threshold crossings and, once every
+	# emit_every seconds, a window summary
+	def add(self, now=None, **values):
+		now = monotonic() if now is None else now
+		if self.last_emit is None:
+			self.last_emit = now
+		events = []
+		for name, value in values.items():
+			if value is None or name not in self.rings:
+				continue
+			self.rings[name].append(now, value)
+			crossing = self._check(name, value)
+			if crossing:
+				events.append(crossing)
+		self.readings += 1
+		if now - self.last_emit >= self.emit_every:
+			events.append(self.summary(now))
+			self.last_emit = now
+		self.emitted += len(events)
+		return events
+
+	def _check(self, name, value):
+		low, high = self.thresholds.get(name, (None, None))
+		if low is not None and value < low:
+			state = "low"
+		elif high is not None and value > high:
+			state = "high"
+		else:
+			state = "ok"
+		if state == self.state[name]:
+			return None
+		self.state[name] = state
+		return {"type": "threshold", "metric": name, "state": state, "value": value}
+
+	def summary(self, now=None):
+		now = monotonic() if now is None else now
+		out = {"type": "summary"}
+		for name, ring in self.rings.items():
+			out[name] = {f"{w}s": ring.stats(now, w) for w in self.windows}
+		return out
+
+
+def main():
+	from time import perf_counter
+	rng = np.random.default_rng(0)
+	agg = SensorAggregator(thresholds={"temperature": (15, 30), "humidity": (20, 70)})
+	# A day of readings every 2 s, with an afternoon heat spike
+	n = 43200
+	temperature = 22 + np.cumsum(rng.normal(0, 0.02, n))
+	temperature[25000:26000] += 10
+	humidity = 45 + np.cumsum(rng.normal(0, 0.05, n))
+	t0 = perf_counter()
+	for i in range(n):
+		agg.add(now=i * 2.0, temperature=temperature[i], humidity=humidity[i])
+	elapsed = perf_counter() - t0
+	print(f"{agg.readings} readings -> {agg.emitted} messages ({agg.readings / max(agg.emitted, 1):.0f}x fewer), "
+		f"{elapsed / n * 1e6:.1f} us/reading")
+	print(agg.summary(now=n * 2.0)["temperature"])
+
+	# 20 readings/s: the 300 s window must hold 300 s of them, not 1024
+	fast = SensorAggregator(windows=(60, 300))
+	for i in range(20 * 600):
+		fast.add(now=i / 20, temperature=22.0)
+	stats = fast.summary(now=600)["temperature"]["300s"]
+	assert stats["count"] >= 20 * 300, stats
+	print(f"20 readings/s: 300 s window holds {stats['count']} readings, ring grew to {fast.rings['temperature'].capacity}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,279 @@
+import os
+import json
+import queue
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime
+from time import perf_counter, time
+import numpy as np
+import cv2
+
+# Audit trail for recognition attempts. The dose loop hands over each
+# attempt's frames, per-frame scores, sensor context and decision; a writer
+# thread JPEG-encodes the frames, writes them under root/YYYY-MM-DD/ and adds
+# one index row, so the caller never waits on disk. A full queue drops the
+# attempt (and counts it) rather than blocking. Once the JPEGs plus the index
+# (with its WAL and shared-memory files) pass max_bytes the oldest attempts
+# are deleted first, and day directories they leave empty go with them. The
+# index is SQLite in WAL mode like the dispense ledger, looked up by time and
+# by person.
+
+AUDIT_DIR = "audit"
+AUDIT_MAX_BYTES = 200 * 1024 * 1024
+JPEG_QUALITY = 80
+
+
+class AuditRecorder:
+	# on_write(seconds), if given, gets the encode + write + index time of
+	# every stored attempt
+	def __init__(self, root=AUDIT_DIR, max_bytes=AUDIT_MAX_BYTES, queue_size=16, jpeg_quality=JPEG_QUALITY, on_write=None):
+		self.root = root
+		self.max_bytes = max_bytes
+		self.jpeg_quality = jpeg_quality
+		self.on_write = on_write
+		self.queue = queue.Queue(maxsize=queue_size)
+		self.lock = threading.Lock()
+		self.recorded = 0
+		self.dropped = 0
+		self.evicted = 0
+		self.failures = 0
+		self.write_times = deque(maxlen=500)
+		os.makedirs(root, exist_ok=True)
+		self.index_path = os.path.join(root, "index.db")
+		self.conn = sqlite3.connect(self.index_path, check_same_thread=False, isolation_level=None)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("PRAGMA synchronous=NORMAL")
+		self.conn.execute(
+			"CREATE TABLE IF NOT EXISTS attempts ("
+			"id INTEGER PRIMARY KEY, ts REAL NOT NULL, person TEXT, label TEXT, confidence REAL, "
+			"decision TEXT NOT NULL, temperature REAL, humidity REAL, scores TEXT, files TEXT, bytes INTEGER NOT NULL)"
+		)
+		self.conn.execute("CREATE INDEX IF NOT EXISTS attempts_ts ON attempts (ts)")
+		self.conn.execute("CREATE INDEX IF NOT EXISTS attempts_person ON attempts (person, ts)")
+		self.bytes = self.conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM attempts").fetchone()[0]
+		self.thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+		self.thread.start()
+
+	# Hot path: never blocks. frames are owned by the recorder from here on;
+	# scores is one dict per frame. Returns False when the attempt was dropped.
+	def record(self, decision, person=None, label=None, confidence=None, frames=(), scores=(),
+			temperature=None, humidity=None, ts=None, **detail):
+		item = (ts if ts is not None else time(), person, label, confidence, decision, temperature, humidity,
+			list(frames), list(scores), detail)
+		try:
+			self.queue.put_nowait(item)
+		except queue.Full:
+			self.dropped += 1
+			return False
+		return True
+
+	def depth(self):
+		return self.queue.qsize()
+
+	def _run(self):
+		while True:
+			item = self.queue.get()
+			try:
+				if item is None:
+					return
+				start = perf_counter()
+				self._write(*item)
+				took = perf_counter() - start
+				self.write_times.append(took)
+				if self.on_write is not None:
+					self.on_write(took)
+			except Exception as e:
+				self.failures += 1
+				print(f"Audit write failed: {e}")
+			finally:
+				self.queue.task_done()
+
+	def _write(self, ts, person, label, confidence, decision, temperature, humidity, frames, scores, detail):
+		day = datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
+		os.makedirs(os.path.join(self.root, day), exist_ok=True)
+		# The row goes in first so its id names the JPEGs; two attempts in the
+		# same millisecond would otherwise overwrite each other's frames
+		with self.lock:
+			row_id = self.conn.execute(
+				"INSERT INTO attempts (ts, person, label, confidence, decision, temperature, humidity, scores, files, bytes) "
+				"VALUES (?, ?, ?, ?, ?, ?, ?, ?, '[]', 0)",
+				(ts, person, label, confidence, decision, temperature, humidity,
+					json.dumps({"frames": scores, **detail}))).lastrowid
+		files = []
+		size = 0
+		params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+		try:
+			for i, frame in enumerate(frames):
+				ok, jpeg = cv2.imencode(".jpg", frame, params)
+				if not ok:
+					continue
+				name = os.path.join(day, f"{row_id}_{i}.jpg")
+				with open(os.path.join(self.root, name), "wb") as f:
+					f.write(jpeg)
+				files.append(name)
+				size += len(jpeg)
+		finally:
+			with self.lock:
+				self.conn.execute("UPDATE attempts SET files = ?, bytes = ? WHERE id = ?", (json.dumps(files), size, row_id))
+				self.bytes += size
+				if self.bytes + self.index_bytes() > self.max_bytes:
+					self._evict()
+		self.recorded += 1
+
+	# The index and its -wal/-shm files, which count against max_bytes too
+	def index_bytes(self):
+		total = 0
+		for suffix in ("", "-wal", "-shm"):
+			try:
+				total += os.path.getsize(self.index_path + suffix)
+			except OSError:
+				pass
+		return total
+
+	# Oldest attempts first until back under budget. The WAL is truncated
+	# first; deleted rows are reused rather than shrinking index.db, so what
+	# is left of the index comes off the JPEG budget.
+	def _evict(self):
+		self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+		budget = self.max_bytes - self.index_bytes()
+		days = set()
+		while self.bytes > budget:
+			rows = self.conn.execute("SELECT id, files, bytes FROM attempts ORDER BY id LIMIT 32").fetchall()
+			if not rows:
+				self.bytes = 0
+				break
+			for _, files, _ in rows:
+				for name in json.loads(files):
+					days.add(os.path.dirname(name))
+					try:
+						os.remove(os.path.join(self.root, name))
+					except FileNotFoundError:
+						pass
+			self.conn.execute("DELETE FROM attempts WHERE id <= ?", (rows[-1][0],))
+			self.bytes -= sum(size for _, _, size in rows)
+			self.evicted += len(rows)
+		for day in days:
+			try:
+				os.rmdir(os.path.join(self.root, day))
+			except OSError:
+				# Still holds newer attempts
+				pass
+
+	# Newest first; since/until are epoch seconds
+	def query(self, person=None, since=None, until=None, decision=None, limit=50):
+		where, args = [], []
+		for clause, value in (("person = ?", person), ("ts >= ?", since), ("ts < ?", until), ("decision = ?", decision)):
+			if value is not None:
+				where.append(clause)
+				args.append(value)
+		sql = "SELECT ts, person, label, confidence, decision, temperature, humidity, scores, files FROM attempts"
+		if where:
+			sql += " WHERE " + " AND ".join(where)
+		sql += " ORDER BY ts DESC LIMIT ?"
+		with self.lock:
+			rows = self.conn.execute(sql, args + [limit]).fetchall()
+		keys = ("ts", "person", "label", "confidence", "decision", "temperature", "humidity", "scores", "files")
+		out = []
+		for row in rows:
+			entry = dict(zip(keys, row))
+			entry["scores"] = json.loads(entry["scores"])
+			entry["files"] = [os.path.join(self.root, name) for name in json.loads(entry["files"])]
+			out.append(entry)
+		return out
+
+	def flush(self):
+		self.queue.join()
+
+	def close(self, timeout=5):
+		self.queue.put(None)
+		self.thread.join(timeout=timeout)
+		with self.lock:
+			self.conn.close()
+
+	def stats(self):
+		times = sorted(self.write_times)
+
+		def pct(q):
+			return round(times[min(len(times) - 1, int(len(times) * q))] * 1000, 2) if times else None
+		return {
+			"recorded": self.recorded,
+			"dropped": self.dropped,
+			"evicted": self.evicted,
+			"failures": self.failures,
+			"depth": self.depth(),
+			"bytes": self.bytes,
+			"index_bytes": self.index_bytes(),
+			"write_p50_ms": pct(0.5),
+			"write_p95_ms": pct(0.95),
+		}
+
+
+def main():
+	import tempfile
+	rng = np.random.default_rng(0)
+	# Smooth frames so JPEG sizes look like camera output, not noise
+	frames = [cv2.resize(rng.integers(0, 256, (30, 40, 3), dtype=np.uint8), (640, 480), interpolation=cv2.INTER_CUBIC)
+		for _ in range(8)]
+	people = ["jayne", "areebah", "shruthigna"]
+	scores = {"jayne": 0.4, "areebah": 0.3, "shruthigna": 0.2, "unknown": 0.1}
+	n = 300
+
+	# Old style: encode and write on the hot path
+	tmp = tempfile.mkdtemp()
+	t0 = perf_counter()
+	for i in range(50):
+		for j in range(2):
+			cv2.imwrite(os.path.join(tmp, f"sync_{i}_{j}.jpg"), frames[(i + j) % 8], [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+	sync = (perf_counter() - t0) / 50
+
+	recorder = AuditRecorder(os.path.join(tmp, "audit"), max_bytes=4 * 1024 * 1024, queue_size=64)
+	spent = []
+	for i in range(n):
+		t0 = perf_counter()
+		recorder.record("wrong_person" if i % 3 else "low_confidence", person=people[i % 3], label="unknown",
+			confidence=0.4, frames=frames[i % 8:i % 8 + 2], scores=[scores, scores], temperature=22.5, humidity=45.0,
+			ts=1767225600 + i * 60)
+		spent.append(perf_counter() - t0)
+		if i % 20 == 19:
+			recorder.flush()
+	recorder.flush()
+	spent.sort()
+	print(f"Attempt with 2 frames: {sync * 1000:.2f} ms written inline vs {spent[len(spent) // 2] * 1e6:.0f} us "
+		f"(p99 {spent[int(len(spent) * 0.99)] * 1e6:.0f} us) handed to the writer")
+	stats = recorder.stats()
+	print(f"Writer: {stats}")
+	on_disk = sum(os.path.getsize(os.path.join(d, f)) for d, _, names in os.walk(recorder.root) for f in names)
+	print(f"On disk {on_disk / 1024:.0f} KiB with the index (budget {recorder.max_bytes / 1024:.0f} KiB)")
+	assert on_disk <= recorder.max_bytes, "audit trail over budget"
+	empty = [d for d, dirs, names in os.walk(recorder.root) if not dirs and not names]
+	assert not empty, f"empty day directories left behind: {empty}"
+
+	t0 = perf_counter()
+	rows = recorder.query(person="jayne", since=1767225600 + 200 * 60, limit=10)
+	print(f"Lookup by person and time: {len(rows)} rows in {(perf_counter() - t0) * 1000:.2f} ms, newest {rows[0]['decision']} "
+		f"at {datetime.fromtimestamp(rows[0]['ts']):%Y-%m-%d %H:%M}")
+
+	# Burst faster than the writer: the queue drops instead of blocking
+	burst = AuditRecorder(os.path.join(tmp, "burst"), queue_size=4)
+	t0 = perf_counter()
+	for i in range(100):
+		burst.record("wrong_person", person="jayne", frames=frames[:2])
+	took = perf_counter() - t0
+	burst.flush()
+	print(f"Burst of 100 in {took * 1000:.1f} ms: {burst.stats()['recorded']} stored, {burst.dropped} dropped")
+	burst.close()
+
+	# Attempts in the same millisecond keep their own frames
+	same = AuditRecorder(os.path.join(tmp, "same"))
+	for _ in range(3):
+		same.record("wrong_person", person="jayne", frames=frames[:2], ts=1767225600.0)
+	same.flush()
+	names = [name for row in same.query() for name in row["files"]]
+	assert len(set(names)) == 6 and all(os.path.exists(name) for name in names), "attempts overwrote each other's frames"
+	same.close()
+	recorder.close()
+
+
+if __name__ == "__main__":
+	main()
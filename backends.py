@@ -0,0 +1,326 @@
+import os
+import abc
+import sys
+import json
+from time import perf_counter
+import numpy as np
+import cv2
+
+from preprocess import Preprocessor
+
+# Inference backends behind the ImageImpulseRunner surface the scripts
+# already use (init, get_features_from_image, classify, stop, with-blocks),
+# so the deployed model format is a config change, not a code change:
+#
+#   eim   Edge Impulse .eim runner (hardware.ImageImpulseRunner, the stub in sim)
+#   dnn   OpenCV DNN: .onnx, .caffemodel (+ .prototxt), .pb, .tflite, .t7
+#   onnx  ONNX Runtime on the CPU, with a configurable thread count
+#   stub  hardware.StubRunner
+#
+# DNN and ONNX models take a float image in [0, 1], NCHW or NHWC, and output
+# one score per label (softmax is applied if they are logits). Labels come
+# from config or from "<model>.labels" next to the model, one per line.
+#
+# `python backends.py bench` times each candidate on a labelled image folder
+# and writes the fastest one that meets the accuracy target to backend.json
+# next to this file; open_configured() prefers it over the script's
+# constants, unless the model it names is missing.
+
+BACKEND_CHOICE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend.json")
+FORMATS = {".eim": "eim", ".onnx": "onnx", ".caffemodel": "dnn", ".prototxt": "dnn", ".pb": "dnn", ".tflite": "dnn", ".t7": "dnn"}
+ACCURACY_TARGET = 0.9
+
+
+def read_labels(model_path):
+	path = os.path.splitext(model_path)[0] + ".labels"
+	if not os.path.exists(path):
+		return None
+	with open(path) as f:
+		return [line.strip() for line in f if line.strip()]
+
+
+class TensorBackend(abc.ABC):
+	# Features are a float tensor, not the packed pixels preprocess.install
+	# produces for .eim models
+	packed_features = False
+
+	def __init__(self, model_path, labels=None, size=None, threads=None, swap_rb=True):
+		self.model_path = model_path
+		self.labels = labels or read_labels(model_path)
+		self.size = tuple(size) if size else None
+		self.threads = threads
+		self.swap_rb = swap_rb
+		self.grayscale = False
+		self.nchw = True
+		self.pre = None
+		self.blob = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	@abc.abstractmethod
+	def load(self):
+		pass
+
+	@abc.abstractmethod
+	def forward(self, blob):
+		pass
+
+	def init(self):
+		self.load()
+		if not self.labels:
+			raise ValueError(f"No labels for {self.model_path} (set MODEL_LABELS or add a .labels file)")
+		if self.size is None:
+			raise ValueError(f"Input size of {self.model_path} unknown (set MODEL_INPUT_SIZE)")
+		width, height = self.size
+		channels = 1 if self.grayscale else 3
+		self.pre = Preprocessor(width, height, grayscale=self.grayscale, swap_rb=self.swap_rb)
+		self.blob = np.empty((1, channels, height, width) if self.nchw else (1, height, width, channels), dtype=np.float32)
+		return {
+			"project": {"name": os.path.basename(self.model_path)},
+			"model_parameters": {
+				"labels": self.labels,
+				"image_input_width": width,
+				"image_input_height": height,
+				"image_channel_count": channels,
+			},
+		}
+
+	# The tensor is reused, so it is only valid until the next call
+	def get_features_from_image(self, img):
+		cropped = self.pre.crop(img)
+		norm = self.pre.normalize_cropped(cropped)
+		np.copyto(self.blob[0], norm.transpose(2, 0, 1) if self.nchw else norm)
+		return self.blob, cropped
+
+	def classify(self, features):
+		t0 = perf_counter()
+		out = np.asarray(self.forward(features), dtype=np.float32).reshape(-1)
+		if len(out) != len(self.labels):
+			raise ValueError(f"Model gave {len(out)} scores for {len(self.labels)} labels")
+		if out.min() < 0 or abs(float(out.sum()) - 1) > 1e-3:
+			out = np.exp(out - out.max())
+			out /= out.sum()
+		took = int((perf_counter() - t0) * 1000)
+		return {"result": {"classification": dict(zip(self.labels, out.tolist()))}, "timing": {"classification": took}}
+
+	def stop(self):
+		pass
+
+
+class DnnBackend(TensorBackend):
+	# config is the Caffe .prototxt (or TF .pbtxt); a sibling .prototxt is
+	# picked up when not given
+	def __init__(self, model_path, config=None, **kwargs):
+		super().__init__(model_path, **kwargs)
+		sibling = os.path.splitext(model_path)[0] + ".prototxt"
+		self.config = config or (sibling if model_path.endswith(".caffemodel") and os.path.exists(sibling) else "")
+		self.net = None
+
+	def load(self):
+		if self.threads:
+			cv2.setNumThreads(self.threads)
+		self.net = cv2.dnn.readNet(self.model_path, self.config)
+
+	def forward(self, blob):
+		self.net.setInput(blob)
+		return self.net.forward()
+
+
+class OnnxBackend(TensorBackend):
+	def __init__(self, model_path, **kwargs):
+		super().__init__(model_path, **kwargs)
+		self.session = None
+		self.input_name = None
+
+	def load(self):
+		import onnxruntime as ort
+		options = ort.SessionOptions()
+		if self.threads:
+			options.intra_op_num_threads = self.threads
+			options.inter_op_num_threads = 1
+		self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+		model_input = self.session.get_inputs()[0]
+		self.input_name = model_input.name
+		shape = model_input.shape
+		# Dynamic dimensions come back as strings or None
+		if len(shape) == 4:
+			self.nchw = shape[1] in (1, 3)
+			channels, h, w = (shape[1], shape[2], shape[3]) if self.nchw else (shape[3], shape[1], shape[2])
+			self.grayscale = channels == 1
+			if isinstance(h, int) and isinstance(w, int):
+				self.size = (w, h)
+
+	def forward(self, blob):
+		return self.session.run(None, {self.input_name: blob})[0]
+
+	def stop(self):
+		self.session = None
+
+
+def backend_format(path):
+	return FORMATS.get(os.path.splitext(path)[1].lower(), "dnn")
+
+
+def open_backend(path, format=None, labels=None, size=None, threads=None):
+	format = format or backend_format(path)
+	if format == "eim":
+		from hardware import ImageImpulseRunner
+		return ImageImpulseRunner(path)
+	if format == "stub":
+		from hardware import StubRunner
+		return StubRunner(path, labels=labels)
+	if format == "dnn":
+		return DnnBackend(path, labels=labels, size=size, threads=threads)
+	if format == "onnx":
+		return OnnxBackend(path, labels=labels, size=size, threads=threads)
+	raise ValueError(f"Unknown model format {format!r}")
+
+
+def load_choice(path=BACKEND_CHOICE):
+	if not path or not os.path.exists(path):
+		return None
+	try:
+		with open(path) as f:
+			return json.load(f)
+	except (OSError, ValueError) as e:
+		print(f"Ignoring {path}: {e}")
+		return None
+
+
+# Backend from the script's constants, overridden by a bench result
+def open_configured(path, format=None, labels=None, size=None, threads=None, choice_path=BACKEND_CHOICE):
+	choice = load_choice(choice_path)
+	# The stub only stands in for a model under the simulator
+	if choice and choice.get("format") == "stub" and os.environ.get("DISPENSER_BACKEND") != "sim":
+		print(f"Ignoring {choice_path}: the stub backend is only used with DISPENSER_BACKEND=sim, using {path}")
+		choice = None
+	if choice and choice.get("format") != "stub" and not os.path.exists(choice.get("path", path)):
+		print(f"Ignoring {choice_path}: model {choice.get('path')} not found, using {path}")
+		choice = None
+	if choice:
+		configured = path
+		path = choice.get("path", path)
+		format = choice.get("format", format)
+		threads = choice.get("threads", threads)
+		labels = choice.get("labels") or labels
+		size = choice.get("size") or size
+		print(f"Inference backend from {choice_path}: {format} {path}"
+			+ (f" (instead of {configured})" if os.path.abspath(path) != os.path.abspath(configured) else ""))
+	return open_backend(path, format, labels=labels, size=size, threads=threads)
+
+
+# "stub", "path" (format from the extension) or "format:path"
+def parse_candidate(spec):
+	if spec == "stub":
+		return "stub", "stub"
+	format, sep, path = spec.partition(":")
+	if sep and format in ("eim", "dnn", "onnx", "stub"):
+		return format, path
+	return backend_format(spec), spec
+
+
+def load_samples(root):
+	from embedding import read_images
+	if root is None:
+		rng = np.random.default_rng(0)
+		return [(None, rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)) for _ in range(20)]
+	samples = []
+	for person in sorted(os.listdir(root)):
+		if os.path.isdir(os.path.join(root, person)):
+			samples += [(person, image) for _, image in read_images([os.path.join(root, person)])]
+	return samples
+
+
+def bench_backend(format, path, samples, labels=None, size=None, threads=None, repeat=3):
+	t0 = perf_counter()
+	runner = open_backend(path, format, labels=labels, size=size, threads=threads)
+	try:
+		runner.init()
+		load = perf_counter() - t0
+		for _, image in samples[:3]:
+			runner.classify(runner.get_features_from_image(image)[0])
+		times = []
+		hits = 0
+		for _ in range(repeat):
+			for label, image in samples:
+				t0 = perf_counter()
+				scores = runner.classify(runner.get_features_from_image(image)[0])["result"]["classification"]
+				times.append(perf_counter() - t0)
+				hits += max(scores, key=scores.get) == label
+	finally:
+		runner.stop()
+	times.sort()
+	labelled = sum(1 for label, _ in samples if label is not None) * repeat
+	return {
+		"format": format,
+		"path": path,
+		"threads": threads,
+		"labels": labels,
+		"size": list(size) if size else None,
+		"load_ms": round(load * 1000, 1),
+		"mean_ms": round(sum(times) / len(times) * 1000, 3),
+		"p95_ms": round(times[min(len(times) - 1, int(len(times) * 0.95))] * 1000, 3),
+		"accuracy": round(hits / labelled, 4) if labelled else None,
+	}
+
+
+def bench(args):
+	samples = load_samples(args.images)
+	if not samples:
+		print(f"No images under {args.images}")
+		return 1
+	size = tuple(args.size) if args.size else None
+	labels = args.labels.split(",") if args.labels else None
+	results = []
+	for spec in args.candidates:
+		format, path = parse_candidate(spec)
+		for threads in (args.threads if format in ("dnn", "onnx") else [None]):
+			name = f"{format}:{os.path.basename(path)}" + (f" x{threads}" if threads else "")
+			try:
+				result = bench_backend(format, path, samples, labels=labels, size=size, threads=threads, repeat=args.repeat)
+			except Exception as e:
+				print(f"{name:<32} unavailable: {e}")
+				continue
+			accuracy = result["accuracy"]
+			result["meets_target"] = accuracy is None and args.target <= 0 or accuracy is not None and accuracy >= args.target
+			results.append(result)
+			shown = "n/a" if accuracy is None else f"{accuracy:.1%}"
+			print(f"{name:<32} load {result['load_ms']:8.1f} ms  {result['mean_ms']:8.2f} ms mean  "
+				f"{result['p95_ms']:8.2f} ms p95  accuracy {shown:>6}  {'ok' if result['meets_target'] else 'below target'}")
+	passing = [r for r in results if r["meets_target"]]
+	if not passing:
+		print(f"No backend reached {args.target:.0%} accuracy on {len(samples)} images")
+		return 1
+	best = min(passing, key=lambda r: r["mean_ms"])
+	print(f"Fastest meeting target: {best['format']} {best['path']}" + (f" with {best['threads']} threads" if best["threads"] else ""))
+	if args.out:
+		with open(args.out, "w") as f:
+			json.dump({**best, "images": args.images, "samples": len(samples), "target": args.target}, f, indent=2)
+		print(f"Wrote {args.out}")
+	return 0
+
+
+def main():
+	import argparse
+	parser = argparse.ArgumentParser(description="Inference backends")
+	sub = parser.add_subparsers(dest="command", required=True)
+	p = sub.add_parser("bench", help="time candidate backends and pick the fastest accurate one")
+	p.add_argument("candidates", nargs="+", help='"stub", a model path, or format:path (eim, dnn, onnx)')
+	p.add_argument("--images", help="labelled folder, one subfolder per label (random frames if omitted)")
+	p.add_argument("--target", type=float, default=ACCURACY_TARGET, help="minimum top-1 accuracy")
+	p.add_argument("--threads", type=lambda s: [int(n) for n in s.split(",")], default=[1, 2, 4])
+	p.add_argument("--labels", help="comma-separated labels for models without a .labels file")
+	p.add_argument("--size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"))
+	p.add_argument("--repeat", type=int, default=3)
+	p.add_argument("--out", default=BACKEND_CHOICE, help="where to write the choice ('' to skip)")
+	args = parser.parse_args()
+	if args.command == "bench":
+		return bench(args)
+
+
+if __name__ == "__main__":
+	sys.exit(main())
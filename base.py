@@ -1,45 +1,37 @@
 import serial
 import json
-from gpiozero import LED
-from time import sleep
+from hardware import LED, open_serial
+from sensors import SerialReader
+from actuators import Actuators, pulses
 
 led = LED(23)
+actuators = Actuators()
 SERIAL_PORT = '/dev/ttyACM0'
 BAUD_RATE = 9600
 
 def read_serial_data():
 	try: 
-		ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
+		ser = open_serial(SERIAL_PORT, BAUD_RATE)
 		print("Connected to Arduino")
 		
-		sleep(2)
-		
-		ser.reset_input_buffer()
+		reader = SerialReader(ser).start()
 		
 		while True:
-			if ser.in_waiting > 0:
-				line = ser.readline().decode('utf-8').strip()
-				
-				if line:
-					try:
-						data = json.loads(line)
-						temperature = data.get("temperature")
-						humidity = data.get("humidity")
-						print(f"Temperature: {temperature}, Humidity: {humidity}")
-						led.on()
-						sleep(2)
-						led.off()
-						sleep(2)
-					except json.JSONDecodeError:
-						print("Invalid JSON")
-				
-				sleep(0.1)
+			reading = reader.next_reading(timeout=5)
+			if reading is None:
+				continue
+			print(f"Temperature: {reading.temperature}, Humidity: {reading.humidity}")
+			# One blink per reading; readings during a blink only print
+			if not actuators.busy("reading"):
+				actuators.play(pulses(led, 1, on=2, off=2, name="reading"))
 	
 	except serial.SerialException as e:
 		print(f"Error: {e}")
 	except KeyboardInterrupt:
 		print("exiting")
+		reader.stop()
 		ser.close()
+		actuators.close()
 
 if __name__ == "__main__":
 	read_serial_data()
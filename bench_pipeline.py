@@ -0,0 +1,258 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter, sleep
+
+# End-to-end latency benchmark for the dispense flow. Drives the real
+# dispensing.py functions against the simulated backend (mock GPIO, pty
+# Arduino, file camera, stub runner) and times every stage of each dose:
+#
+#   schedule -> buzzer -> sensor -> recognize -> publish -> dispense
+#
+# recognize is dispensing.recognize_face, the path production runs: frame
+# gate, burst capture with pipelined classification and score fusion. The
+# capture, features and classify calls inside it are also timed per call
+# (a burst makes several), as a breakdown rather than as stages. dispense is
+# dispensing.dispense_dose, the actuator pattern (buzzer off, LED, motor) the
+# loop plays, and buzzer only starts the alert pattern, which the dispense
+# preempts.
+#
+# Results (p50/p95/p99 per stage, end to end and throughput) are written as
+# JSON so two revisions can be compared with --compare.
+
+os.environ.setdefault("DISPENSER_BACKEND", "sim")
+
+import numpy as np
+import dispensing
+from hardware import open_serial
+from sensors import SerialReader
+from scheduler import DoseScheduler
+from outbox import PublishQueue, FakeClient
+
+STAGES = ["schedule", "buzzer", "sensor", "recognize", "publish", "dispense"]
+CALLS = ["capture", "features", "classify"]
+PERCENTILES = (50, 95, 99)
+RESULTS_PATH = "bench_pipeline.json"
+PERSON = "jayne"
+BASE_TIME = datetime(2026, 1, 1, 8, 0)
+# Sub-millisecond stages are too noisy to flag on a percentage alone
+MIN_REGRESSION_MS = 1.0
+
+
+def percentiles(samples):
+	if not samples:
+		return None
+	values = np.asarray(samples) * 1000
+	out = {f"p{p}": round(float(np.percentile(values, p)), 3) for p in PERCENTILES}
+	out["mean"] = round(float(values.mean()), 3)
+	out["max"] = round(float(values.max()), 3)
+	out["n"] = len(samples)
+	return out
+
+
+class TimedClient(FakeClient):
+	# Records when the broker accepted each message
+	def __init__(self):
+		super().__init__(connected=True)
+		self.sent_at = []
+
+	def publish(self, topic, payload=None, qos=0, retain=False):
+		info = super().publish(topic, payload, qos, retain)
+		self.sent_at.append(perf_counter())
+		return info
+
+
+def revision():
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+			check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+class Pipeline:
+	def __init__(self, runner, ser, client, buzzer=False, angle=60, rpm=10):
+		self.runner = runner
+		self.ser = ser
+		self.client = client
+		self.buzzer = buzzer
+		self.angle = angle
+		self.rpm = rpm
+		self.timings = {stage: [] for stage in STAGES}
+		self.calls = {name: [] for name in CALLS}
+		self.frames = []
+		self.end_to_end = []
+		self.due_to_published = []
+
+	def timed(self, stage, fn, *args):
+		t0 = perf_counter()
+		result = fn(*args)
+		self.timings[stage].append(perf_counter() - t0)
+		return result
+
+	# Wraps fn so each call inside recognize_face is timed under name
+	def wrap(self, name, fn):
+		def wrapper(*args, **kwargs):
+			t0 = perf_counter()
+			try:
+				return fn(*args, **kwargs)
+			finally:
+				self.calls[name].append(perf_counter() - t0)
+		return wrapper
+
+	def trigger(self, i):
+		# A fresh dose due exactly now, one per trigger
+		due = BASE_TIME + timedelta(minutes=i % 1440)
+		dispensing.scheduler = DoseScheduler({PERSON: due.strftime("%H:%M")}, now=due - timedelta(seconds=1))
+		dispensing.pending_doses.clear()
+		sent = len(self.client.sent_at)
+
+		t0 = perf_counter()
+		person, slot, date = self.timed("schedule", dispensing.check_medication_time, due)
+		if person is None:
+			raise RuntimeError(f"Dose at {due:%H:%M} was not picked up")
+		if self.buzzer:
+			self.timed("buzzer", dispensing.play_buzzer)
+		temperature, humidity = self.timed("sensor", dispensing.read_sensor_data, self.ser)
+		classified = len(self.calls["classify"])
+		label, confidence = self.timed("recognize", dispensing.recognize_face, self.runner, person)
+		self.frames.append(len(self.calls["classify"]) - classified)
+		self.timed("publish", dispensing.publish_to_aws, self.client, label or "unknown", temperature, humidity)
+		t_queued = perf_counter()
+		self.timed("dispense", dispensing.dispense_dose, self.angle, self.rpm)
+		self.end_to_end.append(perf_counter() - t0)
+
+		# The outbox publishes in the background while the dispense plays
+		while len(self.client.sent_at) <= sent and perf_counter() - t_queued < 5:
+			sleep(0.0005)
+		if len(self.client.sent_at) > sent:
+			self.due_to_published.append(self.client.sent_at[sent] - t0)
+		dispensing.clear_pending_dose(date, person, slot)
+
+	def report(self, runs, elapsed):
+		return {
+			"revision": revision(),
+			"timestamp": datetime.now().isoformat(timespec="seconds"),
+			"backend": os.environ.get("DISPENSER_BACKEND"),
+			"runs": runs,
+			"buzzer": self.buzzer,
+			"unit": "ms",
+			"stages": {stage: percentiles(self.timings[stage]) for stage in STAGES},
+			"calls": {name: percentiles(self.calls[name]) for name in CALLS},
+			"frames_per_recognition": round(float(np.mean(self.frames)), 2) if self.frames else None,
+			"end_to_end": percentiles(self.end_to_end),
+			"due_to_published": percentiles(self.due_to_published),
+			"elapsed_s": round(elapsed, 3),
+			"throughput_per_min": round(runs / elapsed * 60, 2),
+		}
+
+
+def print_report(results):
+	print(f"{'stage':<18}{'p50':>10}{'p95':>10}{'p99':>10}{'n':>6}   (ms)")
+	rows = list(results["stages"].items()) + [("end_to_end", results["end_to_end"]),
+		("due_to_published", results["due_to_published"])]
+	for name, stats in rows:
+		if stats is None:
+			print(f"{name:<18}{'skipped':>10}")
+			continue
+		print(f"{name:<18}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}{stats['n']:>6}")
+	print(f"Inside recognize ({results['frames_per_recognition']} frames classified per dose):")
+	for name, stats in results["calls"].items():
+		if stats is not None:
+			print(f"  {name:<16}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}{stats['n']:>6}")
+	print(f"Throughput: {results['throughput_per_min']:.1f} doses/min over {results['runs']} triggers "
+		f"({results['elapsed_s']:.1f} s)")
+
+
+# Prints p95 changes against an earlier results file, returns the stages that
+# got slower by more than tolerance
+def compare(results, previous, tolerance=0.1):
+	print(f"Compared with {previous.get('revision')} ({previous.get('timestamp')}):")
+	regressions = []
+	names = STAGES + ["end_to_end", "due_to_published"]
+	for name in names:
+		new = results["stages"].get(name) if name in STAGES else results.get(name)
+		old = previous["stages"].get(name) if name in STAGES else previous.get(name)
+		if not new or not old:
+			continue
+		change = (new["p95"] - old["p95"]) / old["p95"] if old["p95"] else 0.0
+		flag = ""
+		if change > tolerance and new["p95"] - old["p95"] > MIN_REGRESSION_MS:
+			flag = "  REGRESSION"
+			regressions.append(name)
+		print(f"  {name:<18}p95 {old['p95']:>9.2f} -> {new['p95']:>9.2f} ms ({change:+.1%}){flag}")
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Dispense pipeline latency benchmark")
+	parser.add_argument("--runs", type=int, default=20, help="number of dose triggers")
+	parser.add_argument("--warmup", type=int, default=2)
+	parser.add_argument("--buzzer", action="store_true", help="start the alert pattern each dose (non-blocking, the dispense cuts it short)")
+	parser.add_argument("--angle", type=float, default=dispensing.angle)
+	parser.add_argument("--rpm", type=float, default=10)
+	parser.add_argument("--output", default=RESULTS_PATH)
+	parser.add_argument("--compare", help="earlier results file to compare against")
+	parser.add_argument("--tolerance", type=float, default=0.1, help="p95 slowdown that counts as a regression")
+	args = parser.parse_args()
+
+	workdir = tempfile.mkdtemp()
+	dispensing.start_actuators()
+	client = TimedClient()
+	dispensing.mqtt_connected = True
+	dispensing.outbox = PublishQueue(client, os.path.join(workdir, "outbox.db"), is_connected=lambda: client.connected,
+		rate=0).start()
+	ser = open_serial(dispensing.SERIAL_PORT, dispensing.BAUD_RATE)
+	dispensing.sensor_reader = SerialReader(ser).start()
+	dispensing.sensor_reader.next_reading(timeout=5)
+
+	# Same runner, camera and gate setup as the dispenser, including
+	# FAST_PREPROCESS and the capture-resolution frames for the gate
+	loaded = dispensing.load_runner()
+	runner = loaded[0]
+	dispensing.camera = dispensing.start_camera(loaded)
+	dispensing.gate = dispensing.load_gate()
+	capture_frame = dispensing.capture_frame
+	get_features, classify = runner.get_features_from_image, runner.classify
+
+	def instrument(pipeline):
+		dispensing.capture_frame = pipeline.wrap("capture", capture_frame)
+		runner.get_features_from_image = pipeline.wrap("features", get_features)
+		runner.classify = pipeline.wrap("classify", classify)
+		return pipeline
+
+	try:
+		pipeline = instrument(Pipeline(runner, ser, client, buzzer=args.buzzer, angle=args.angle, rpm=args.rpm))
+		for i in range(args.warmup):
+			pipeline.trigger(i)
+		pipeline = instrument(Pipeline(runner, ser, client, buzzer=args.buzzer, angle=args.angle, rpm=args.rpm))
+		t0 = perf_counter()
+		for i in range(args.runs):
+			pipeline.trigger(args.warmup + i)
+		elapsed = perf_counter() - t0
+	finally:
+		dispensing.camera.stop()
+		dispensing.sensor_reader.stop()
+		dispensing.outbox.stop()
+		runner.stop()
+		ser.close()
+
+	results = pipeline.report(args.runs, elapsed)
+	print_report(results)
+	with open(args.output, "w") as f:
+		json.dump(results, f, indent=2)
+	print(f"Results written to {args.output}")
+
+	if args.compare:
+		with open(args.compare) as f:
+			previous = json.load(f)
+		if compare(results, previous, args.tolerance):
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
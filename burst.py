@@ -0,0 +1,214 @@
+import queue
+import threading
+from collections import Counter
+from time import perf_counter
+
+# Burst recognition: a capture thread feeds frames through a bounded queue
+# while the caller classifies them, and per-frame scores are fused into one
+# decision that can stop the burst early once it is confident. An exception
+# from capture ends the burst and is re-raised to the caller.
+
+
+class MeanFusion:
+	def __init__(self):
+		self.totals = Counter()
+		self.n = 0
+
+	def update(self, scores):
+		self.totals.update(scores)
+		self.n += 1
+		return {label: total / self.n for label, total in self.totals.items()}
+
+
+class MajorityFusion:
+	# Confidence is the share of frames whose top label agrees, gated on mean score
+	def __init__(self):
+		self.votes = Counter()
+		self.mean = MeanFusion()
+
+	def update(self, scores):
+		self.votes[max(scores, key=scores.get)] += 1
+		means = self.mean.update(scores)
+		return {label: min(self.votes[label] / self.mean.n, means[label]) for label in means}
+
+
+class EwmaFusion:
+	def __init__(self, alpha=0.5):
+		self.alpha = alpha
+		self.state = None
+
+	def update(self, scores):
+		if self.state is None:
+			self.state = dict(scores)
+		else:
+			a = self.alpha
+			for label, score in scores.items():
+				self.state[label] = a * score + (1 - a) * self.state.get(label, 0.0)
+		return dict(self.state)
+
+
+FUSIONS = {
+	"mean": MeanFusion,
+	"majority": MajorityFusion,
+	"ewma": EwmaFusion,
+}
+
+
+def classify_scores(runner, frame):
+	features, cropped = runner.get_features_from_image(frame)
+	result = runner.classify(features)
+	if isinstance(result, dict) and "result" in result and "classification" in result["result"]:
+		return result["result"]["classification"]
+	return None
+
+
+class BurstResult:
+	# samples holds (frame, scores) for the first `keep` classified frames
+	def __init__(self, label, confidence, frames, elapsed, samples=None):
+		self.label = label
+		self.confidence = confidence
+		self.frames = frames
+		self.elapsed = elapsed
+		self.samples = samples or []
+
+	def __repr__(self):
+		return f"BurstResult({self.label!r}, {self.confidence:.3f}, frames={self.frames}, {self.elapsed * 1000:.1f} ms)"
+
+
+def burst_recognize(capture, runner, frames=5, fusion="mean", threshold=0.8, min_frames=2,
+	queue_size=2, classify=classify_scores, keep=0):
+	start = perf_counter()
+	frame_queue = queue.Queue(maxsize=queue_size)
+	stop = threading.Event()
+
+	errors = []
+
+	def producer():
+		try:
+			for _ in range(frames):
+				if stop.is_set():
+					break
+				frame = capture()
+				if frame is None:
+					continue
+				while not stop.is_set():
+					try:
+						frame_queue.put(frame, timeout=0.1)
+						break
+					except queue.Full:
+						continue
+		except Exception as e:
+			# Handed to the caller's thread once the queue drains
+			errors.append(e)
+		finally:
+			frame_queue.put(None)
+
+	thread = threading.Thread(target=producer, name="burst-capture", daemon=True)
+	thread.start()
+
+	fuser = FUSIONS[fusion]()
+	fused = {}
+	used = 0
+	samples = []
+	try:
+		while True:
+			frame = frame_queue.get()
+			if frame is None:
+				if errors:
+					raise errors[0]
+				break
+			scores = classify(runner, frame)
+			if not scores:
+				continue
+			used += 1
+			if len(samples) < keep:
+				samples.append((frame, scores))
+			fused = fuser.update(scores)
+			label = max(fused, key=fused.get)
+			if used >= min_frames and fused[label] >= threshold:
+				break
+	finally:
+		stop.set()
+		# Unblock the producer if it is waiting on a full queue
+		while thread.is_alive():
+			try:
+				frame_queue.get(timeout=0.05)
+			except queue.Empty:
+				pass
+		thread.join()
+
+	if not fused:
+		return BurstResult(None, 0.0, used, perf_counter() - start, samples)
+	label = max(fused, key=fused.get)
+	return BurstResult(label, fused[label], used, perf_counter() - start, samples)
+
+
+def main():
+	import random
+	from time import sleep
+
+	labels = ["jayne", "areebah", "shruthigna", "unknown"]
+
+	def capture():
+		sleep(0.03)
+		return object()
+
+	def classify(runner, frame):
+		sleep(0.05)
+		noisy = random.random() < 0.3
+		top = random.choice(labels) if noisy else "jayne"
+		scores = {label: random.uniform(0, 0.1) for label in labels}
+		scores[top] = random.uniform(0.75, 0.98)
+		return scores
+
+	# Sequential baseline: capture then classify one frame per attempt
+	t0 = perf_counter()
+	correct = 0
+	for _ in range(20):
+		scores = classify(None, capture())
+		correct += max(scores, key=scores.get) == "jayne" and scores["jayne"] >= 0.8
+	print(f"single frame: {(perf_counter() - t0) / 20 * 1000:.1f} ms/attempt, {correct}/20 authorized")
+
+	for fusion in FUSIONS:
+		t0 = perf_counter()
+		correct = frames = 0
+		for _ in range(20):
+			r = burst_recognize(capture, None, frames=5, fusion=fusion, classify=classify)
+			correct += r.label == "jayne" and r.confidence >= 0.8
+			frames += r.frames
+		print(f"burst/{fusion}: {(perf_counter() - t0) / 20 * 1000:.1f} ms/attempt, "
+			f"{frames / 20:.1f} frames, {correct}/20 authorized")
+
+	check_capture_failure()
+
+
+# Regression check: a capture that raises mid-burst must reach the caller,
+# not leave it blocked on the frame queue
+def check_capture_failure():
+	import subprocess
+	calls = []
+
+	def capture():
+		calls.append(1)
+		if len(calls) == 2:
+			raise subprocess.CalledProcessError(1, "rpicam-jpeg")
+		return object()
+
+	result = []
+
+	def attempt():
+		try:
+			burst_recognize(capture, None, frames=5, threshold=2.0, classify=lambda runner, frame: {"jayne": 0.5})
+		except subprocess.CalledProcessError as e:
+			result.append(e)
+
+	thread = threading.Thread(target=attempt, daemon=True)
+	thread.start()
+	thread.join(timeout=5)
+	assert not thread.is_alive(), "burst_recognize hung after a capture error"
+	assert result, "capture error was not re-raised"
+	print(f"capture error mid-burst: re-raised ({result[0].cmd} exit {result[0].returncode})")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,276 @@
+import os
+import glob
+import threading
+from collections import deque
+from time import sleep, monotonic
+import numpy as np
+import cv2
+
+# Long-lived capture engine: keeps the camera open and fills a preallocated
+# ring of frames at model resolution so callers never wait on rpicam-jpeg.
+# Frames of another aspect ratio are centre-cropped to the model's before
+# the resize, as the SDK's resize-then-crop does, so faces are not squashed.
+# With capture_size the camera runs at that resolution and a second ring
+# keeps the frames as captured, for consumers such as the face detector that
+# need more pixels than the model does (grab(full=True)).
+
+
+def center_crop(frame, width, height):
+	h, w = frame.shape[:2]
+	if w * height > h * width:
+		cw = h * width // height
+		x = (w - cw) // 2
+		return frame[:, x:x + cw]
+	ch = w * height // width
+	y = (h - ch) // 2
+	return frame[y:y + ch]
+
+
+class OpenCVBackend:
+	name = "opencv"
+
+	def __init__(self, device=0):
+		self.device = device
+		self.cap = None
+
+	def open(self, width, height):
+		self.cap = cv2.VideoCapture(self.device, cv2.CAP_V4L2)
+		if not self.cap.isOpened():
+			raise RuntimeError("Camera not detected")
+		self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+		self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+		self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+	def read(self):
+		ok, frame = self.cap.read()
+		return frame if ok else None
+
+	def close(self):
+		if self.cap is not None:
+			self.cap.release()
+			self.cap = None
+
+
+class PicameraBackend:
+	name = "picamera"
+
+	def __init__(self):
+		self.cam = None
+
+	def open(self, width, height):
+		from picamera2 import Picamera2
+		self.cam = Picamera2()
+		# RGB888 in picamera2 is laid out B,G,R in memory, which is what cv2 expects
+		config = self.cam.create_video_configuration(main={"size": (width, height), "format": "RGB888"})
+		self.cam.configure(config)
+		self.cam.start()
+
+	def read(self):
+		return self.cam.capture_array()
+
+	def close(self):
+		if self.cam is not None:
+			self.cam.stop()
+			self.cam.close()
+			self.cam = None
+
+
+class FileBackend:
+	name = "file"
+
+	# path may be a single image, a folder of images, or None for synthetic frames
+	def __init__(self, path=None, fps=30):
+		self.path = path
+		self.fps = fps
+		self.images = []
+		self.index = 0
+		self.last = 0
+
+	def open(self, width, height):
+		self.width = width
+		self.height = height
+		if self.path and os.path.isdir(self.path):
+			files = sorted(glob.glob(os.path.join(self.path, "*")))
+		elif self.path:
+			files = [self.path]
+		else:
+			files = []
+		for f in files:
+			img = cv2.imread(f)
+			if img is not None:
+				self.images.append(cv2.resize(center_crop(img, width, height), (width, height), interpolation=cv2.INTER_AREA))
+		if self.path and not self.images:
+			raise RuntimeError(f"No images found in {self.path}")
+
+	def read(self):
+		if self.fps:
+			wait = self.last + 1 / self.fps - monotonic()
+			if wait > 0:
+				sleep(wait)
+			self.last = monotonic()
+		if self.images:
+			img = self.images[self.index % len(self.images)]
+			self.index += 1
+			return img
+		self.index += 1
+		return np.random.randint(0, 256, (self.height, self.width, 3), dtype=np.uint8)
+
+	def close(self):
+		self.images = []
+
+
+BACKENDS = {
+	"opencv": OpenCVBackend,
+	"picamera": PicameraBackend,
+	"file": FileBackend,
+}
+
+
+def make_backend(name, **kwargs):
+	if name not in BACKENDS:
+		raise ValueError(f"Unknown camera backend: {name}")
+	return BACKENDS[name](**kwargs)
+
+
+class CameraEngine:
+	def __init__(self, backend, width, height, buffer_size=4, capture_size=None):
+		if buffer_size < 2:
+			raise ValueError("buffer_size must be at least 2")
+		self.backend = backend
+		self.width = width
+		self.height = height
+		self.capture_size = tuple(capture_size) if capture_size else None
+		self.frames = np.zeros((buffer_size, height, width, 3), dtype=np.uint8)
+		self.full = None
+		if self.capture_size:
+			cw, ch = self.capture_size
+			self.full = np.zeros((buffer_size, ch, cw, 3), dtype=np.uint8)
+		self.stamps = np.zeros(buffer_size)
+		self.count = 0
+		self.failures = 0
+		self.latencies = deque(maxlen=500)
+		self.cond = threading.Condition()
+		self.running = False
+		self.thread = None
+
+	def start(self):
+		self.backend.open(*(self.capture_size or (self.width, self.height)))
+		self.running = True
+		self.thread = threading.Thread(target=self._run, name="camera", daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join(timeout=2)
+		self.backend.close()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def _run(self):
+		n = len(self.frames)
+		while self.running:
+			t0 = monotonic()
+			try:
+				frame = self.backend.read()
+			except Exception as e:
+				print(f"Camera read error: {e}")
+				frame = None
+			if frame is None:
+				self.failures += 1
+				sleep(0.01)
+				continue
+			# Writer only touches slot count % n, readers copy count - 1 under the lock
+			slot = self.count % n
+			if frame.shape[:2] != (self.height, self.width):
+				cropped = center_crop(frame, self.width, self.height)
+				cv2.resize(cropped[:, :, :3], (self.width, self.height), dst=self.frames[slot], interpolation=cv2.INTER_AREA)
+			else:
+				np.copyto(self.frames[slot], frame[:, :, :3])
+			if self.full is not None:
+				if frame.shape[:2] != self.full.shape[1:3]:
+					cv2.resize(frame[:, :, :3], self.capture_size, dst=self.full[slot], interpolation=cv2.INTER_AREA)
+				else:
+					np.copyto(self.full[slot], frame[:, :, :3])
+			t1 = monotonic()
+			self.latencies.append(t1 - t0)
+			with self.cond:
+				self.stamps[slot] = t1
+				self.count += 1
+				self.cond.notify_all()
+
+	# full=True copies from the capture-resolution ring when there is one
+	def _copy_latest(self, out, full=False):
+		ring = self.full if full and self.full is not None else self.frames
+		slot = (self.count - 1) % len(ring)
+		if out is None:
+			return ring[slot].copy()
+		np.copyto(out, ring[slot])
+		return out
+
+	# Most recent frame without waiting, or None before the first frame arrives
+	def latest(self, out=None, full=False):
+		with self.cond:
+			if self.count == 0:
+				return None
+			return self._copy_latest(out, full)
+
+	# Wait for a frame captured after this call
+	def grab(self, timeout=2.0, out=None, full=False):
+		with self.cond:
+			seen = self.count
+			if not self.cond.wait_for(lambda: self.count > seen, timeout):
+				return None
+			return self._copy_latest(out, full)
+
+	def age(self):
+		with self.cond:
+			if self.count == 0:
+				return None
+			return monotonic() - self.stamps[(self.count - 1) % len(self.frames)]
+
+	def stats(self):
+		lat = np.array(self.latencies) * 1000
+		return {
+			"backend": self.backend.name,
+			"frames": self.count,
+			"failures": self.failures,
+			"mean_ms": float(lat.mean()) if len(lat) else None,
+			"p95_ms": float(np.percentile(lat, 95)) if len(lat) else None,
+			"fps": float(1000 / lat.mean()) if len(lat) else None,
+		}
+
+
+def open_camera(name, width, height, capture_size=None, **kwargs):
+	return CameraEngine(make_backend(name, **kwargs), width, height, capture_size=capture_size).start()
+
+
+def main():
+	import sys
+	names = sys.argv[1:] or list(BACKENDS)
+	width, height = 96, 96
+	for name in names:
+		kwargs = {"fps": 0} if name == "file" else {}
+		try:
+			engine = open_camera(name, width, height, **kwargs)
+		except Exception as e:
+			print(f"{name}: unavailable ({e})")
+			continue
+		grabs = []
+		for _ in range(50):
+			t0 = monotonic()
+			engine.grab()
+			grabs.append(monotonic() - t0)
+		engine.stop()
+		stats = engine.stats()
+		print(f"{name}: capture mean {stats['mean_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms, "
+			f"grab mean {np.mean(grabs) * 1000:.2f} ms, {stats['frames']} frames, {stats['failures']} failures")
+
+
+if __name__ == "__main__":
+	main()
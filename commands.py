@@ -0,0 +1,205 @@
+import json
+import queue
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from time import sleep, monotonic, time
+
+# MQTT command intake: on_message only parses the payload, drops duplicates
+# and enqueues, so paho's network thread is never blocked by a motor move.
+# A worker thread runs the handlers one at a time and reports each outcome
+# on the ack callback with how long the command waited and ran.
+#
+# Commands are JSON objects with an "action" and optionally an "id". The id
+# is the idempotency key: one seen within dedupe_window seconds is acked as a
+# duplicate and not re-run, which covers qos=1 redeliveries. Two commands
+# without an id may both be genuine, so those are only dropped when the
+# broker flags a redelivery (paho's msg.dup) of a payload already seen.
+
+
+class CommandQueue:
+	# handlers maps action -> fn(data); default handles any other action.
+	# ack(payload_str) is called from both the network and the worker thread.
+	def __init__(self, handlers, default=None, ack=None, max_depth=32, dedupe_window=600.0, max_keys=1000):
+		self.handlers = handlers
+		self.default = default
+		self.ack = ack
+		self.queue = queue.Queue(maxsize=max_depth)
+		self.dedupe_window = dedupe_window
+		self.max_keys = max_keys
+		self.seen = OrderedDict()
+		self.lock = threading.Lock()
+		self.received = 0
+		self.executed = 0
+		self.duplicates = 0
+		self.malformed = 0
+		self.rejected = 0
+		self.failures = 0
+		self.timings = deque(maxlen=500)
+		self.running = False
+		self.thread = None
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self._run, name="commands", daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self, timeout=2):
+		self.running = False
+		try:
+			self.queue.put_nowait(None)
+		except queue.Full:
+			pass
+		if self.thread is not None:
+			self.thread.join(timeout=timeout)
+
+	def _ack(self, key, action, status, **extra):
+		if self.ack is None:
+			return
+		try:
+			self.ack(json.dumps({"id": key, "action": action, "status": status, "ts": int(time()), **extra}))
+		except Exception as e:
+			print(f"Command ack failed: {e}")
+
+	def _duplicate(self, key, now):
+		with self.lock:
+			while self.seen and (len(self.seen) > self.max_keys or now - next(iter(self.seen.values())) > self.dedupe_window):
+				self.seen.popitem(last=False)
+			if key in self.seen:
+				return True
+			self.seen[key] = now
+			return False
+
+	# Returns the command id (None without one), or None when the payload was
+	# rejected
+	def submit(self, payload, redelivery=False):
+		now = monotonic()
+		self.received += 1
+		raw = payload if isinstance(payload, bytes) else str(payload).encode()
+		try:
+			data = json.loads(raw)
+			if not isinstance(data, dict):
+				raise ValueError("command must be a JSON object")
+		except (ValueError, UnicodeDecodeError) as e:
+			self.malformed += 1
+			print(f"Malformed command ignored: {e}")
+			self._ack(None, None, "malformed", error=str(e))
+			return None
+		action = data.get("action")
+		key = str(data["id"]) if data.get("id") is not None else None
+		seen = key if key is not None else "sha1:" + hashlib.sha1(raw).hexdigest()[:16]
+		if self._duplicate(seen, now) and (key is not None or redelivery):
+			self.duplicates += 1
+			self._ack(key, action, "duplicate")
+			return key
+		try:
+			self.queue.put_nowait((key, action, data, now))
+		except queue.Full:
+			self.rejected += 1
+			with self.lock:
+				self.seen.pop(seen, None)
+			print(f"Command queue full, rejected {action}")
+			self._ack(key, action, "rejected")
+			return None
+		return key
+
+	def _run(self):
+		while self.running:
+			item = self.queue.get()
+			if item is None:
+				break
+			key, action, data, received = item
+			handler = self.handlers.get(action, self.default)
+			started = monotonic()
+			status = "done"
+			error = None
+			try:
+				if handler is None:
+					status = "unknown"
+				else:
+					handler(data)
+			except Exception as e:
+				status = "error"
+				error = str(e)
+				self.failures += 1
+				print(f"Command {action} failed: {e}")
+			finished = monotonic()
+			self.executed += 1
+			self.timings.append((started - received, finished - started))
+			extra = {"queued_ms": round((started - received) * 1000, 1), "run_ms": round((finished - started) * 1000, 1)}
+			if error:
+				extra["error"] = error
+			self._ack(key, action, status, **extra)
+
+	def depth(self):
+		return self.queue.qsize()
+
+	def stats(self):
+		queued = sorted(t[0] for t in self.timings)
+		run = sorted(t[1] for t in self.timings)
+
+		def p95(values):
+			return round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 2) if values else None
+		return {
+			"received": self.received,
+			"executed": self.executed,
+			"duplicates": self.duplicates,
+			"malformed": self.malformed,
+			"rejected": self.rejected,
+			"failures": self.failures,
+			"depth": self.depth(),
+			"queued_p95_ms": p95(queued),
+			"run_p95_ms": p95(run),
+		}
+
+
+def main():
+	acks = []
+	done = threading.Event()
+
+	def dispense(data):
+		sleep(0.002)
+		if data.get("last"):
+			done.set()
+
+	commands = CommandQueue({"dispense": dispense}, default=lambda data: None, ack=acks.append, max_depth=256).start()
+	payloads = []
+	for i in range(1000):
+		payloads.append(json.dumps({"action": "dispense", "id": f"cmd-{i}"}).encode())
+		if i % 10 == 0:
+			payloads.append(payloads[-1])  # qos=1 redelivery
+		if i % 50 == 0:
+			payloads.append(b"{not json")
+	payloads.append(json.dumps({"action": "dispense", "id": "last", "last": True}).encode())
+
+	# What paho's network thread sees: time spent inside on_message
+	spent = []
+	for payload in payloads:
+		t0 = monotonic()
+		commands.submit(payload)
+		spent.append(monotonic() - t0)
+		if commands.depth() > 200:
+			sleep(0.1)
+	submit, worst = sum(spent) / len(spent), max(spent)
+	done.wait(30)
+	commands.stop()
+	print(f"{len(payloads)} messages, on_message {submit * 1e6:.0f} us mean / {worst * 1e6:.0f} us worst")
+	print(commands.stats())
+	print(f"{len(acks)} acks, last: {acks[-1]}")
+
+	# Without an id, a repeated command runs again; only a flagged redelivery is dropped
+	ran = []
+	commands = CommandQueue({"dispense": ran.append}).start()
+	payload = json.dumps({"action": "dispense"}).encode()
+	commands.submit(payload)
+	commands.submit(payload)
+	commands.submit(payload, redelivery=True)
+	while commands.depth():
+		sleep(0.01)
+	commands.stop()
+	assert len(ran) == 2 and commands.duplicates == 1, (len(ran), commands.duplicates)
+
+
+if __name__ == "__main__":
+	main()
@@ -1,99 +1,219 @@
-import serial
 import json
-import cv2
-import subprocess 
-import numpy as np 
-from gpiozero import LED, OutputDevice, Buzzer 
+from hardware import LED, OutputDevice, Buzzer, open_serial, open_camera
 from time import sleep, time
 from datetime import datetime 
-from edge_impulse_linux.image import ImageImpulseRunner 
-import paho.mqtt.client as mqtt 
 import ssl
+import sys
+import asyncio
+import threading
+from runtime import DispenserRuntime, RealClock
+from sensors import SerialReader
+from framing import FrameDecoder, negotiate_baud
+from burst import burst_recognize
+from scheduler import DoseScheduler, MEDICATION_SCHEDULE
+from ledger import DispenseLedger
+from outbox import PublishQueue
+from telemetry import encode_payload
+from metrics import timed, counter, gauge, histogram, start_server, HealthPublisher
+from startup import Startup
+from commands import CommandQueue
 
 led = LED(23)
 buzz = Buzzer(26)
 
 SERIAL_PORT = '/dev/ttyACM0' 
 BAUD_RATE = 9600 
+SENSOR_MAX_AGE = 30
+# Startup waits this long for the first reading / the broker's CONNACK
+SERIAL_READY_TIMEOUT = 5
+# "json" lines, or "framed" (framing.py: CRC-checked binary frames, several
+# readings each) at SERIAL_FAST_BAUD if the sketch accepts it
+SERIAL_PROTOCOL = "json"
+SERIAL_FAST_BAUD = 115200
+MQTT_READY_TIMEOUT = 10
 MODEL_PATH = "/home/Shruthigna/Documents/face_recognition-linux-aarch64-v14.eim" 
-
-MEDICATION_SCHEDULE = {
-	"jayne": "20:52",
-	"areebah": "13:00"
-}
-
-step_sequence_fast = [
-	[1,1,0,0,],
-	[0,1,1,0],
-	[0,0,1,1],
-	[1,0,0,1]
-]
+# "eim", "onnx", "dnn" or "stub" (backends.py); None goes by the extension.
+# A backend.json written by `python backends.py bench` overrides these.
+MODEL_FORMAT = None
+MODEL_LABELS = None
+MODEL_INPUT_SIZE = (96, 96)
+INFERENCE_THREADS = None
+# Replace the SDK's per-call resize/crop/pack with preallocated buffers (preprocess.py)
+FAST_PREPROCESS = True
+CAMERA_BACKEND = "picamera"
+# The camera runs at this resolution; the frame gate's face detector gets
+# these frames and the model a centre-cropped copy at its input size
+CAMERA_CAPTURE_SIZE = (640, 480)
+CONFIDENCE_THRESHOLD = 0.8
+BURST_FRAMES = 5
+BURST_FUSION = "mean"
+# "classifier" uses the .eim labels, "embedding" matches against the enrolled
+# gallery (python embedding.py enroll <name> <images>)
+RECOGNITION_MODE = "classifier"
+GALLERY_PATH = "gallery.npy"
+EMBEDDING_THRESHOLD = 0.7
+# Recognition attempts (frames, scores, sensors, decision) kept by audit.py;
+# AUDIT_FRAMES frames per attempt, 0 turns the audit trail off
+AUDIT_DIR = "audit"
+AUDIT_MAX_BYTES = 200 * 1024 * 1024
+AUDIT_FRAMES = 2
+SCHEDULE_CHECK_INTERVAL = 1
+SCHEDULE_MAX_SLEEP = 300
+# Alert beeps (seconds on/off) and the LED hold after a match, played by the
+# actuator thread (actuators.py) while recognition runs
+ALERT_BEEPS = 2
+ALERT_ON = 2
+ALERT_OFF = 2
+RECOGNIZED_LED_HOLD = 7
+# A dose still pending after a failed round is only alerted again after this
+ALERT_REPEAT = 60
+LEDGER_PATH = "dispense_ledger.db"
 
 IN1 = OutputDevice(17)
 IN2 = OutputDevice(27)
 IN3 = OutputDevice(22)
 IN4 = OutputDevice(5)
+motion = None
+actuators = None
 
 angle = 60
 
 AWS_IOT_ENDPOINT = "a9saj11jrwuqo-ats.iot.us-east-2.amazonaws.com" 
 AWS_IOT_PORT = 8883 
 AWS_IOT_TOPIC = "raspi/data" 
+COMMAND_ACK_TOPIC = "raspi/commands/ack"
+COMMAND_QUEUE_DEPTH = 32
+# Pause after a remote dispense before the next command runs
+COMMAND_COOLDOWN = 15
+# Longest a command waits for the async runtime before it is acked as an error
+COMMAND_TIMEOUT = 120
 CA_CERT_PATH = 'certs/AmazonRootCA1.pem' 
 CERT_PATH = 'certs/certificate.pem.crt' 
 KEY_PATH = 'certs/private.pem.key' 
+OUTBOX_PATH = "outbox.db"
+# "json" keeps the original payloads, "binary" sends the compact frame
+# (telemetry.py). Each reading here is a dispense record, so it goes to the
+# outbox on its own rather than waiting in a batch.
+TELEMETRY_FORMAT = "json"
+SENSOR_TOPIC = "raspi/data/sensors"
+SENSOR_THRESHOLDS = {"temperature": (None, 30), "humidity": (None, 70)}
+METRICS_PORT = 9100
+HEALTH_TOPIC = "raspi/health"
+# When the outbox is full, lower priority messages are evicted first
+OUTBOX_PRIORITIES = {AWS_IOT_TOPIC: 2, COMMAND_ACK_TOPIC: 2, SENSOR_TOPIC: 1, HEALTH_TOPIC: 0}
+# Seconds between health messages, None to disable
+HEALTH_INTERVAL = 60
 
 current_temperature = None
 current_humidity = None
 mqtt_connected = None
-dispensed_today = {}
+mqtt_ready = threading.Event()
+ledger = None
+camera = None
+outbox = None
+aggregator = None
+runtime = None
+sensor_reader = None
+gate = None
+recognizer = None
+scheduler = None
+pending_doses = []
+last_alert = {}
+runtime_loop = None
+commands = None
+audit = None
 
-def on_message(client, userdata, msg):
-	print(f"Message received on {msg.topic} --- {msg.payload.decode()}")
-	data = json.loads(msg.payload.decode())
-	signal = data.get("action")
-	
-	if signal == "dispense":
-		print("Dispense Command Received")
-		stop_angle(60, 1)
-		sleep(15)
-	else:
-		print("No Dispense. Medication may not be in good condition.")
+gauge("outbox_depth", "Messages waiting in the outbox", fn=lambda: outbox.depth if outbox else 0)
+counter("outbox_failures_total", "Outbox publishes not acked", fn=lambda: outbox.failures if outbox else 0)
+counter("serial_lines_total", "Lines read from the Arduino", fn=lambda: sensor_reader.lines if sensor_reader else 0)
+counter("serial_errors_total", "Unparseable serial lines", fn=lambda: sensor_reader.errors if sensor_reader else 0)
+publish_failures = counter("publish_failures_total", "Readings dropped or rejected on publish")
+gauge("command_queue_depth", "Commands waiting to run", fn=lambda: commands.depth() if commands else 0)
+counter("commands_received_total", "Command messages received", fn=lambda: commands.received if commands else 0)
+counter("commands_duplicate_total", "Redelivered commands dropped", fn=lambda: commands.duplicates if commands else 0)
+counter("commands_malformed_total", "Unparseable command messages", fn=lambda: commands.malformed if commands else 0)
+counter("commands_rejected_total", "Commands rejected on a full queue", fn=lambda: commands.rejected if commands else 0)
+audit_write = histogram("audit_write_seconds", "Encode, write and index time per audited attempt")
+gauge("audit_queue_depth", "Attempts waiting for the audit writer", fn=lambda: audit.depth() if audit else 0)
+counter("audit_dropped_total", "Attempts not audited because the queue was full", fn=lambda: audit.dropped if audit else 0)
+counter("audit_evicted_total", "Audited attempts deleted to stay under budget", fn=lambda: audit.evicted if audit else 0)
 
-def stop_angle(angle_deg, direction, rpm=50):
-	steps = int(angle_deg / 360 * 510)
-	step_motor(steps, direction, rpm=rpm)
-	
-def set_step(w1, w2, w3, w4):
-	IN1.value = w1
-	IN2.value = w2
-	IN3.value = w3
-	IN4.value = w4
+def on_message(client, userdata, msg):
+	# Runs on paho's network thread: parse and enqueue only
+	print(f"Message received on {msg.topic} --- {msg.payload.decode(errors='replace')}")
+	if commands is not None:
+		commands.submit(msg.payload, redelivery=msg.dup)
+		
+def handle_dispense(data):
+	print("Dispense Command Received")
+	if runtime is not None and runtime_loop is not None:
+		# Blocks the command worker until the motor stops, so the ack says done
+		# only once the dose is out
+		runtime.submit_command(runtime_loop, "dispense").result(COMMAND_TIMEOUT)
+		return
+	dispense_dose()
+	sleep(COMMAND_COOLDOWN)
+	
+def handle_other(data):
+	if runtime is not None and runtime_loop is not None:
+		runtime.submit_command(runtime_loop, data.get("action")).result(COMMAND_TIMEOUT)
+		return
+	print("No Dispense. Medication may not be in good condition.")
+	
+def publish_ack(payload):
+	if outbox is not None:
+		outbox.put(COMMAND_ACK_TOPIC, payload)
 
-def step_motor(steps, direction=1, rpm = None, delay=0.01):
-	if rpm is not None:
-		delay = 60 / (rpm * steps)
-	for _ in range(steps):
-		for step in (step_sequence_fast if direction > 0 else reversed(step_sequence_fast)):
-			set_step(*step)
-			sleep(delay)
+@timed("stop_angle")
+def stop_angle(angle_deg, direction=1, rpm=10, wait=True):
+	from motion import plan_angle
+	move = motion.move(plan_angle(angle_deg, direction, rpm=rpm))
+	if wait:
+		move.wait()
+	return move
+	
+@timed("step_motor")
+def step_motor(steps, direction=1, rpm=None, delay=0.01, wait=True):
+	from motion import plan_move, PHASES_PER_REV
+	if rpm is None:
+		# Fixed per-phase delay, no ramp
+		plan = plan_move(steps, direction, rpm=60 / (delay * PHASES_PER_REV), ramp_steps=0)
+	else:
+		plan = plan_move(steps, direction, rpm=rpm)
+	move = motion.move(plan)
+	if wait:
+		move.wait()
+	return move
 
 def on_connect(client, userdata, flags, rc): 
 	global mqtt_connected 
 	if rc == 0: 
 		print("Connected to AWS IoT Successfully") 
 		mqtt_connected = True 
+		mqtt_ready.set()
+		if outbox is not None:
+			outbox.notify()
 	else: 
 		print(f"Failed to connect to AWS IoT: {rc}") 
 		mqtt_connected = False 
+		mqtt_ready.set()
+	
+# Without this the flag stays True after the link drops and the outbox
+# keeps handing paho messages to queue
+def on_disconnect(client, userdata, rc):
+	global mqtt_connected
+	mqtt_connected = False
+	print(f"Disconnected from AWS IoT ({rc}), paho will reconnect")
 	
 def on_publish(client, userdata, mid): 
 	print(f"Data published to AWS IoT: {mid}") 
 		
 def setup_aws_iot(): 
+	import paho.mqtt.client as mqtt
 	try: 
 		client = mqtt.Client() 
 		client.on_connect = on_connect 
+		client.on_disconnect = on_disconnect
 		client.on_publish = on_publish 
 		client.on_message = on_message
 		client.tls_set(ca_certs=CA_CERT_PATH, certfile=CERT_PATH, keyfile=KEY_PATH, tls_version=ssl.PROTOCOL_TLSv1_2) 
@@ -104,11 +224,23 @@ def setup_aws_iot():
 		print(f"Error setting up AWS IoT: {e}") 
 		return None 
 		
+@timed("publish_to_aws")
 def publish_to_aws(client, label, temperature, humidity): 
+	if outbox is not None:
+		payload = encode_payload([(time(), label, temperature, humidity)], TELEMETRY_FORMAT)
+		if outbox.put(AWS_IOT_TOPIC, payload):
+			print(f"Queued {len(payload)} bytes (outbox depth {outbox.depth})")
+		else:
+			publish_failures.inc()
+			print("Outbox full, dropped publish")
+		return
+		
 	if not client or not mqtt_connected: 
+		publish_failures.inc()
 		print("MQTT not connected, skipping publish") 
 		return 
 		
+	import paho.mqtt.client as mqtt
 	try: 
 		now = datetime.now() 
 		payload = { "Person": label, "Temperature": temperature, "Humidity": humidity, "Date": now.strftime("%Y-%m-%d"), "Time": now.strftime("%H-%M-%S") } 
@@ -116,16 +248,34 @@ def publish_to_aws(client, label, temperature, humidity):
 		if result.rc == mqtt.MQTT_ERR_SUCCESS: 
 			print(f"Published: {payload}") 
 		else: 
+			publish_failures.inc()
 			print(f"Error publishing to AWS: {result.rc}") 
 	except Exception as e: 
+		publish_failures.inc()
 		print(f"Exception during publish: {e}") 
 
-def capture_frame(filename="/tmp/frame.jpg"): 
+def on_sensor_reading(reading):
+	# Only window summaries and threshold crossings go upstream
+	for event in aggregator.add(now=reading.timestamp, temperature=reading.temperature, humidity=reading.humidity):
+		if event["type"] == "threshold":
+			print(f"Sensor {event['metric']} is {event['state']}: {event['value']}")
+		if outbox is not None:
+			outbox.put(SENSOR_TOPIC, json.dumps(event))
+			
+@timed("capture_frame")
+def capture_frame(filename="/tmp/frame.jpg", full=False): 
+	if camera is not None:
+		return camera.grab(full=full)
+	import subprocess
+	import cv2
 	subprocess.run(["rpicam-jpeg", "-o", filename, "-t", "1000"], check=True) 
 	frame = cv2.imread(filename) 
 	return frame 
 	
+@timed("read_sensor_data")
 def read_sensor_data(ser):
+	if sensor_reader is not None:
+		return sensor_reader.current(SENSOR_MAX_AGE)
 	if not ser:
 		return None, None
 		
@@ -153,52 +303,308 @@ def read_sensor_data(ser):
 			#return person, med_time, datetime.now().strftime("%Y-%m-%d")
 	#return None, None, None
 	
-def check_medication_time():
-	now = datetime.now()
-	for person, med_time in MEDICATION_SCHEDULE.items():
-		med_hour, med_minute = map(int, med_time.split(":"))
-		scheduled_time = now.replace(hour=med_hour, minute=med_minute, second=0, microsecond=0)
-		
-		if abs((now - scheduled_time).total_seconds()) < 60:
-			return person, med_time, now.strftime("%Y-%m-%d")
+def check_medication_time(now=None):
+	global scheduler
+	now = now or datetime.now()
+	if scheduler is None:
+		scheduler = DoseScheduler(MEDICATION_SCHEDULE, now=now)
+	pending_doses.extend(scheduler.pop_due(now))
+	pending_doses[:] = [dose for dose in pending_doses if not dose.expired(now)]
+	# A dose stays pending until it is recorded or its grace window ends.
+	# Each call offers the next pending dose in turn, so one person failing
+	# recognition does not hold up everyone else due at the same time.
+	if pending_doses:
+		dose = pending_doses.pop(0)
+		pending_doses.append(dose)
+		return dose.person, dose.slot, dose.date
 	return None, None, None
+	
+def seconds_until_next_check(now=None):
+	if pending_doses or scheduler is None:
+		return SCHEDULE_CHECK_INTERVAL
+	wait = scheduler.seconds_until_next(now)
+	return SCHEDULE_MAX_SLEEP if wait is None else min(wait, SCHEDULE_MAX_SLEEP)
+	
+def clear_pending_dose(date, person, slot):
+	pending_doses[:] = [d for d in pending_doses if (d.date, d.person, d.slot) != (date, person, slot)]
 
+# Returns at once; a dispense (higher priority on the buzzer) cuts it short
 def play_buzzer():
-	for _ in range(2):
-		buzz.on()
-		sleep(2)
-		buzz.off()
-		sleep(2)
+	from actuators import pulses
+	return actuators.play(pulses(buzz, ALERT_BEEPS, on=ALERT_ON, off=ALERT_OFF, name="alert", priority=1))
+	
+# Alert for a dose unless it was alerted within ALERT_REPEAT; None if skipped
+def alert_dose(date, person, slot):
+	now = time()
+	key = (date, person, slot)
+	if now - last_alert.get(key, 0) < ALERT_REPEAT:
+		return None
+	last_alert[key] = now
+	for old in [k for k, at in last_alert.items() if now - at > 86400]:
+		del last_alert[old]
+	return play_buzzer()
 		
 def add_dispense_record(date, person, time):
-	if date not in dispensed_today:
-		dispensed_today[date] = []
-	dispensed_today[date].append((person,time))
+	ledger.record(date, person, time)
+	clear_pending_dose(date, person, time)
 	
-def main():
-	print("Medication Dispenser System Starting...")
+def already_dispensed(person, time, date):
+	return ledger.contains(date, person, time)
 	
-	ser = None
-	try: 
-		ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-		print("Connected to Arduino")
-		sleep(2)
-		ser.reset_input_buffer()
+def open_ledger():
+	ledger = DispenseLedger(LEDGER_PATH)
+	print(f"Dispense ledger recovered {len(ledger.index)} records in {ledger.recovery_time * 1000:.1f} ms")
+	return ledger
+	
+def open_audit():
+	if not AUDIT_FRAMES:
+		return None
+	from audit import AuditRecorder
+	return AuditRecorder(AUDIT_DIR, max_bytes=AUDIT_MAX_BYTES, on_write=audit_write.observe)
+	
+# With no frame classified, the gate's reason (gate_dark, gate_no_face, ...)
+# is the decision unless the camera itself returned nothing
+def audit_attempt(result, person_due, threshold):
+	reason = gate.last_reason if gate is not None else None
+	if result.frames == 0 and reason not in (None, "no_frame"):
+		decision = f"gate_{reason}"
+	elif result.frames == 0:
+		decision = "camera_failed"
+	elif result.confidence < threshold:
+		decision = "low_confidence"
+	elif person_due is None or result.label == person_due:
+		decision = "recognized"
+	else:
+		decision = "wrong_person"
+	temperature, humidity = sensor_reader.current(SENSOR_MAX_AGE) if sensor_reader else (None, None)
+	audit.record(decision, person=person_due, label=result.label, confidence=result.confidence,
+		frames=[frame for frame, _ in result.samples], scores=[scores for _, scores in result.samples],
+		temperature=temperature, humidity=humidity, mode=RECOGNITION_MODE, frames_used=result.frames,
+		elapsed_ms=round(result.elapsed * 1000, 1))
+	
+def recognize_face(runner, person_due=None):
+	capture = (lambda: gate.capture(lambda: capture_frame(full=True))) if gate is not None else capture_frame
+	keep = AUDIT_FRAMES if audit is not None else 0
+	try:
+		if recognizer is not None:
+			from embedding import classify_embedding
+			threshold = EMBEDDING_THRESHOLD
+			result = burst_recognize(capture, recognizer, frames=BURST_FRAMES, fusion=BURST_FUSION, threshold=threshold,
+				classify=classify_embedding, keep=keep)
+		else:
+			threshold = CONFIDENCE_THRESHOLD
+			result = burst_recognize(capture, runner, frames=BURST_FRAMES, fusion=BURST_FUSION, threshold=threshold, keep=keep)
 	except Exception as e:
-		print(f"Arduino Error : {e}")
+		# A capture or classify error still leaves a record of the attempt
+		if audit is not None:
+			audit.record("error", person=person_due, mode=RECOGNITION_MODE, error=repr(e))
+		raise
+	if audit is not None:
+		audit_attempt(result, person_due, threshold)
+	if result.frames == 0:
+		reason = gate.last_reason if gate is not None else None
+		print("Camera Failed" if reason in (None, "no_frame") else f"No usable frame ({reason})")
+		return None, 0.0
+	print(f"Detected: {result.label} with confidence {result.confidence} over {result.frames} frames")
+	if result.confidence < threshold:
+		return None, result.confidence
+	return result.label, result.confidence
+	
+def dispense_pattern(angle_deg=60, direction=1, rpm=10):
+	from actuators import Pattern
+	from motion import plan_angle
+	plan = plan_angle(angle_deg, direction, rpm=rpm)
+	return Pattern("dispense", [(0, buzz, False), (0, led, True), (0, motion, plan), (plan.duration, led, False)], priority=2)
+	
+@timed("dispense_dose")
+def dispense_dose(angle_deg=60, rpm=10):
+	actuators.play(dispense_pattern(angle_deg, rpm=rpm)).wait()
+	
+def start_monitoring():
+	server = start_server(METRICS_PORT)
+	health = None
+	if HEALTH_INTERVAL:
+		health = HealthPublisher(lambda payload: outbox.put(HEALTH_TOPIC, payload), HEALTH_INTERVAL).start()
+	return server, health
+	
+def instrument_runner(runner):
+	runner.get_features_from_image = timed("get_features_from_image")(runner.get_features_from_image)
+	runner.classify = timed("classify")(runner.classify)
+	
+# numpy (motion, aggregate) and cv2 (backends, preprocess, gating) load
+# here, on startup threads, instead of when the module is imported
+def start_actuators():
+	global motion, actuators, aggregator
+	from motion import MotionController
+	from actuators import Actuators
+	from aggregate import SensorAggregator
+	motion = MotionController([IN1, IN2, IN3, IN4])
+	actuators = Actuators()
+	aggregator = SensorAggregator(windows=(60, 300), emit_every=60, thresholds=SENSOR_THRESHOLDS)
+	return actuators
+	
+def open_arduino():
+	global sensor_reader
+	ser = open_serial(SERIAL_PORT, BAUD_RATE)
+	print("Connected to Arduino")
+	decoder = None
+	if SERIAL_PROTOCOL == "framed":
+		negotiate_baud(ser, SERIAL_FAST_BAUD)
+		decoder = FrameDecoder()
+	sensor_reader = SerialReader(ser, on_reading=on_sensor_reading, decoder=decoder).start()
+	if sensor_reader.next_reading(timeout=SERIAL_READY_TIMEOUT) is None:
+		print(f"No Arduino reading within {SERIAL_READY_TIMEOUT} s, continuing")
+	return ser
+	
+def connect_aws_iot():
+	client = setup_aws_iot()
+	if client and not mqtt_ready.wait(MQTT_READY_TIMEOUT):
+		print(f"No CONNACK within {MQTT_READY_TIMEOUT} s, continuing; the outbox drains once connected")
+	return client
+	
+def load_runner():
+	from backends import open_configured
+	from preprocess import install as install_preprocessor
+	runner = open_configured(MODEL_PATH, MODEL_FORMAT, labels=MODEL_LABELS, size=MODEL_INPUT_SIZE, threads=INFERENCE_THREADS)
+	model_info = runner.init()
+	if FAST_PREPROCESS and getattr(runner, "packed_features", True):
+		install_preprocessor(runner, model_info)
+	instrument_runner(runner)
+	print("Model Loaded")
+	return runner, model_info
+	
+def start_camera(loaded):
+	width = loaded[1]['model_parameters']['image_input_width']
+	height = loaded[1]['model_parameters']['image_input_height']
+	engine = open_camera(CAMERA_BACKEND, width, height, capture_size=CAMERA_CAPTURE_SIZE)
+	print(f"Camera engine started ({CAMERA_BACKEND}, {CAMERA_CAPTURE_SIZE[0]}x{CAMERA_CAPTURE_SIZE[1]})")
+	return engine
+	
+def load_gate():
+	from gating import FrameGate, load_face_detector
+	return FrameGate(detector=load_face_detector())
+	
+# No detector here: the frame gate hands over the same face crop enrollment
+# makes. EmbeddingRecognizer raises at startup if the gallery was enrolled
+# with another descriptor size.
+def load_recognizer():
+	from embedding import EmbeddingRecognizer, Gallery
+	engine = EmbeddingRecognizer(gallery=Gallery(GALLERY_PATH))
+	print(f"Embedding gallery: {len(engine.gallery.names)} people, {len(engine.gallery)} images")
+	return engine
+	
+# Brings serial, MQTT, the model runner and the camera up concurrently.
+# Returns (ser, mqtt_client, runner); the runner is required, the rest may be None.
+def start_services():
+	global camera, gate, ledger, outbox, recognizer, commands, audit
+	commands = CommandQueue({"dispense": handle_dispense}, default=handle_other, ack=publish_ack,
+		max_depth=COMMAND_QUEUE_DEPTH).start()
+	startup = Startup()
+	startup.add("ledger", open_ledger, required=True)
+	startup.add("actuators", start_actuators, required=True)
+	# Readings go through the aggregator, so the reader starts after it
+	startup.add("serial", lambda _: open_arduino(), after=["actuators"])
+	startup.add("mqtt", connect_aws_iot)
+	startup.add("outbox", lambda client: PublishQueue(client, OUTBOX_PATH, is_connected=lambda: mqtt_connected,
+		priorities=OUTBOX_PRIORITIES).start(),
+		after=["mqtt"], required=True)
+	startup.add("runner", load_runner, required=True)
+	startup.add("camera", start_camera, after=["runner"])
+	startup.add("gate", load_gate)
+	startup.add("audit", open_audit)
+	if RECOGNITION_MODE == "embedding":
+		startup.add("recognizer", load_recognizer, required=True)
+	startup.run()
+	startup.report()
+	for name, seconds in startup.timings().items():
+		gauge(f"startup_{name}_seconds", f"Time spent starting {name}").set(seconds)
+	gauge("startup_seconds", "Time from start to ready").set(startup.elapsed())
+	
+	startup.result("actuators")
+	ledger = startup.result("ledger")
+	outbox = startup.result("outbox")
+	gate = startup.result("gate")
+	audit = startup.result("audit")
+	camera = startup.result("camera")
+	if camera is None:
+		print("Camera engine unavailable, falling back to rpicam-jpeg")
+	if RECOGNITION_MODE == "embedding":
+		recognizer = startup.result("recognizer")
+		if gate is None or gate.detector is None:
+			print("No face detector: embedding whole frames, which only matches a gallery enrolled without one")
+	runner, _ = startup.result("runner")
+	return startup.result("serial"), startup.result("mqtt"), runner
+	
+def main_async():
+	global runtime, runtime_loop
+	print("Medication Dispenser System Starting (async)...")
+	ser, mqtt_client, runner = start_services()
+	metrics_server, health = start_monitoring()
+	
+	with runner:
+		runtime = DispenserRuntime(
+			RealClock(),
+			check_due=check_medication_time,
+			read_sensor=lambda: read_sensor_data(ser),
+			recognize=lambda person: recognize_face(runner, person),
+			publish=lambda label, temperature, humidity: publish_to_aws(mqtt_client, label, temperature, humidity),
+			dispense=dispense_dose,
+			# Rate-limited per dose, so a dose retried through its grace
+			# window is not re-alerted every round
+			alert=alert_dose,
+			already_dispensed=already_dispensed,
+			record_dispense=add_dispense_record,
+			next_check=seconds_until_next_check,
+		)
 		
-	mqtt_client = setup_aws_iot()
+		async def run():
+			global runtime_loop
+			runtime_loop = asyncio.get_running_loop()
+			await runtime.run()
+			
+		try:
+			asyncio.run(run())
+		except KeyboardInterrupt:
+			print("Stopping")
+		finally:
+			led.off()
+			print(f"Actuators: {actuators.stats()}")
+			actuators.close()
+			if gate:
+				print(f"Frame gate: {gate.stats()}")
+			if camera:
+				camera.stop()
+			if sensor_reader:
+				sensor_reader.stop()
+			ledger.close()
+			if audit:
+				print(f"Audit: {audit.stats()}")
+				audit.close()
+			if ser:
+				ser.close()
+			if commands:
+				print(f"Commands: {commands.stats()}")
+				commands.stop()
+			if health:
+				health.stop()
+			if metrics_server:
+				metrics_server.stop()
+			if outbox:
+				outbox.stop()
+			if mqtt_client:
+				mqtt_client.loop_stop()
+				mqtt_client.disconnect()
+	
+def main():
+	from actuators import hold
+	print("Medication Dispenser System Starting...")
+	ser, mqtt_client, runner = start_services()
+	metrics_server, health = start_monitoring()
 	if not mqtt_client:
 		print("Cannot run without AWS IoT. Exiting")
 		#return
 	
-	sleep(3)
-	
-	with ImageImpulseRunner(MODEL_PATH) as runner:
-		model_info = runner.init()
-		print("Model Loaded")
-		
-		
+	with runner:
 		try:
 			while True:
 				print("\n" + "="*60)
@@ -209,19 +615,13 @@ def main():
 				
 				if person_due:
 					
-					current_date = datetime.now().strftime("%Y-%m-%d")
-					already_dispensed = any  (
-						person == person_due and time == person_time
-						for person, time in dispensed_today.get(current_date, [])					
-					)
-					
-					if already_dispensed:
+					if already_dispensed(person_due, person_time, person_date):
 						print(f"Person {person_due} already received medication for {person_time}")
-						sleep(60)
+						clear_pending_dose(person_date, person_due, person_time)
 						continue
 							
 					print(f"Medication Time for {person_due}")
-					play_buzzer()
+					alert_dose(person_date, person_due, person_time)
 					
 					temperature, humidity = read_sensor_data(ser)
 					
@@ -236,67 +636,77 @@ def main():
 						attempt += 1
 						print("Show face to camera")
 						sleep(1)
-						frame = capture_frame()
-						
-						if frame is None:
-							print("Camera Failed")
-							sleep(60)
-							continue
-							
-						features, cropped = runner.get_features_from_image(frame)
-						result = runner.classify(features)
+						label, confidence = recognize_face(runner, person_due)
 						detected_person = "unknown"
 						
-						if isinstance(result, dict) and "result" in result:
-							scores = result["result"]["classification"]
-							label = max(scores, key=scores.get)
-							confidence = scores[label]
-							print(f"Detected: {label} with confidence {confidence}")
+						if label == person_due:
+							detected_person = label
+							actuators.cancel("alert")
+							actuators.play(hold(led, RECOGNIZED_LED_HOLD, name="recognized", priority=2))
+							recognized = True
+							
+							#stop_angle(60)
+							
+							print("Sending data to AWS Lambda")
+							publish_to_aws(mqtt_client, detected_person, temperature, humidity)
+							
+							sleep(5)
+							mqtt_client.subscribe("sensors")
+							add_dispense_record(person_date, person_due, person_time)
+							
+							sleep(15)
+							
+						elif label is not None:
+							print("Wrong person")
+							led.off()
+							sleep(2)
+							
+						else:
+							print("Low confidence or unknown person")
 							
-							if confidence >= 0.8 and label == person_due:
-								detected_person = label
-								led.on()
-								recognized = True
-								
-								#stop_angle(60)
-								
-								print("Sending data to AWS Lambda")
-								publish_to_aws(mqtt_client, detected_person, temperature, humidity)
-								
-								sleep(5)
-								mqtt_client.subscribe("sensors")
-								add_dispense_record(person_date, person_due, person_time)
-								
-								sleep(2)
-								led.off()
-								sleep(15)
-								
-							elif confidence >= 0.8 and label != person_due:
-								print("Wrong person")
-								led.off()
-								sleep(2)
-								
-							else:
-								print("Low confidence or unknown person")
-								
 					#if not recognized:
 						#print(f"Failed to recognize person after {max_attempts}")
 						#print("Please use manual trigger")
 						
 				else:
-					print("No medication due. Waiting...")
-					sleep(60)
+					wait = seconds_until_next_check()
+					print(f"No medication due. Waiting {wait:.0f} s...")
+					sleep(wait)
 							
 		except KeyboardInterrupt:
 			print("Stopping")
 			led.off()
+			print(f"Actuators: {actuators.stats()}")
+			actuators.close()
+			if gate:
+				print(f"Frame gate: {gate.stats()}")
+			if camera:
+				camera.stop()
+			if sensor_reader:
+				sensor_reader.stop()
+			ledger.close()
+			if audit:
+				print(f"Audit: {audit.stats()}")
+				audit.close()
 			if ser:
 				ser.close()
+			if commands:
+				print(f"Commands: {commands.stats()}")
+				commands.stop()
+			if health:
+				health.stop()
+			if metrics_server:
+				metrics_server.stop()
+			if outbox:
+				outbox.stop()
 			if mqtt_client:
 				mqtt_client.loop_stop()
 				mqtt_client.disconnect()
 					
 if __name__ == "__main__":
-	main()
+	if "--async" in sys.argv:
+		main_async()
+	else:
+		main()
 					
 					
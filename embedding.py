@@ -0,0 +1,370 @@
+import os
+import sys
+import json
+from time import perf_counter
+import numpy as np
+import cv2
+
+from gating import crop_face, load_face_detector, FACE_MARGIN
+
+# Embedding recognition: a face crop is turned into an L2-normalised
+# descriptor and matched against an enrolled gallery by cosine similarity,
+# so adding a patient is an enrollment instead of retraining the .eim.
+#
+# The gallery is a float32 .npy matrix (one row per enrolled image) opened
+# memory-mapped, with the row labels in a JSON file next to it. Above
+# ANN_THRESHOLD rows an LSH index narrows the candidates before the exact
+# dot product.
+#
+# Gallery and probe descriptors must come from the same crop. Enrollment
+# runs the face detector and takes gating.crop_face (box plus the gate's
+# margin); in the dose loop the frame gate has already made that crop, so
+# the recognizer there embeds its input as is. Without detector files both
+# sides fall back to whole frames.
+
+EMBED_MODEL = "nn4.small2.v1.t7"
+GALLERY_PATH = "gallery.npy"
+MATCH_THRESHOLD = 0.7
+ANN_THRESHOLD = 2000
+TOP_K = 5
+
+
+class OpenFaceEmbedder:
+	# OpenFace nn4.small2 through OpenCV DNN, 128-d descriptors from 96x96 crops
+	def __init__(self, model=EMBED_MODEL, size=96):
+		self.net = cv2.dnn.readNetFromTorch(model)
+		self.size = size
+		self.dim = 128
+
+	def embed(self, face):
+		blob = cv2.dnn.blobFromImage(face, 1.0 / 255, (self.size, self.size), (0, 0, 0), swapRB=True, crop=False)
+		self.net.setInput(blob)
+		vec = self.net.forward()[0].astype(np.float32)
+		return vec / (np.linalg.norm(vec) + 1e-12)
+
+
+class PixelEmbedder:
+	# Model-free fallback: equalised grayscale thumbnail, zero-mean and normalised.
+	# Only good for a handful of people under stable lighting.
+	def __init__(self, size=24):
+		self.size = size
+		self.dim = size * size
+		self.small = np.empty((size, size, 3), dtype=np.uint8)
+		self.gray = np.empty((size, size), dtype=np.uint8)
+
+	def embed(self, face):
+		cv2.resize(face, (self.size, self.size), dst=self.small, interpolation=cv2.INTER_AREA)
+		cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+		vec = cv2.equalizeHist(self.gray).reshape(-1).astype(np.float32)
+		vec -= vec.mean()
+		return vec / (np.linalg.norm(vec) + 1e-12)
+
+
+def load_embedder(model=EMBED_MODEL):
+	if not os.path.exists(model):
+		print(f"Embedding model {model} not found, using pixel descriptors")
+		return PixelEmbedder()
+	return OpenFaceEmbedder(model)
+
+
+class LSHIndex:
+	# Random-hyperplane LSH over normalised rows: each table hashes a row to
+	# the sign pattern of `bits` projections, a query is compared exactly only
+	# against rows sharing a bucket in some table
+	def __init__(self, matrix, bits=12, tables=6, seed=0):
+		rng = np.random.default_rng(seed)
+		self.planes = rng.standard_normal((tables, matrix.shape[1], bits)).astype(np.float32)
+		self.weights = 1 << np.arange(bits, dtype=np.int64)
+		self.buckets = []
+		for t in range(tables):
+			keys = self._keys(matrix, t)
+			order = np.argsort(keys, kind="stable")
+			sorted_keys = keys[order]
+			starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+			ends = np.r_[starts[1:], len(keys)]
+			self.buckets.append({int(sorted_keys[s]): order[s:e] for s, e in zip(starts, ends)})
+
+	def _keys(self, vecs, t):
+		return ((vecs @ self.planes[t]) > 0).astype(np.int64) @ self.weights
+
+	def candidates(self, vec):
+		found = [table.get(int(self._keys(vec[None], t)[0])) for t, table in enumerate(self.buckets)]
+		found = [ids for ids in found if ids is not None]
+		if not found:
+			return None
+		return np.unique(np.concatenate(found))
+
+
+class Gallery:
+	def __init__(self, path=GALLERY_PATH, ann_threshold=ANN_THRESHOLD):
+		self.path = path
+		self.labels_path = os.path.splitext(path)[0] + "_labels.json"
+		self.ann_threshold = ann_threshold
+		self.matrix = None
+		self.labels = []
+		self.codes = None
+		self.names = []
+		self.index = None
+		self.load()
+
+	def __len__(self):
+		return 0 if self.matrix is None else len(self.matrix)
+
+	@property
+	def dim(self):
+		return None if self.matrix is None else self.matrix.shape[1]
+
+	def load(self):
+		if not (os.path.exists(self.path) and os.path.exists(self.labels_path)):
+			return self
+		self.matrix = np.load(self.path, mmap_mode="r")
+		with open(self.labels_path) as f:
+			self.labels = json.load(f)
+		self._build()
+		return self
+
+	def _build(self):
+		self.names = sorted(set(self.labels))
+		lookup = {name: i for i, name in enumerate(self.names)}
+		self.codes = np.array([lookup[label] for label in self.labels], dtype=np.int32)
+		self.index = LSHIndex(np.asarray(self.matrix)) if len(self) >= self.ann_threshold else None
+
+	# vectors is (n, dim); rewrites the gallery files atomically
+	def add(self, label, vectors):
+		vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+		if self.matrix is not None and vectors.shape[1] != self.matrix.shape[1]:
+			raise ValueError(f"Descriptor size {vectors.shape[1]} does not match gallery ({self.matrix.shape[1]})")
+		matrix = vectors if self.matrix is None else np.concatenate([self.matrix, vectors])
+		return self._write(matrix, self.labels + [label] * len(vectors))
+
+	def remove(self, label):
+		keep = [i for i, name in enumerate(self.labels) if name != label]
+		removed = len(self.labels) - len(keep)
+		if removed:
+			self._write(np.asarray(self.matrix)[keep], [self.labels[i] for i in keep])
+		return removed
+
+	def _write(self, matrix, labels):
+		tmp = self.path + ".tmp.npy"
+		np.save(tmp, matrix)
+		with open(self.labels_path + ".tmp", "w") as f:
+			json.dump(labels, f)
+		self.matrix = None
+		os.replace(tmp, self.path)
+		os.replace(self.labels_path + ".tmp", self.labels_path)
+		return self.load()
+
+	# Best cosine score per enrolled person for one descriptor, top k as a dict
+	def scores(self, vec, k=TOP_K):
+		if not len(self):
+			return {}
+		ids = self.index.candidates(vec) if self.index is not None else None
+		if ids is None:
+			sims = self.matrix @ vec
+			codes = self.codes
+		else:
+			sims = self.matrix[ids] @ vec
+			codes = self.codes[ids]
+		best = np.full(len(self.names), -1.0, dtype=np.float32)
+		np.maximum.at(best, codes, sims)
+		top = np.argsort(best)[::-1][:k]
+		return {self.names[i]: float(best[i]) for i in top if best[i] > -1.0}
+
+	def match(self, vec, threshold=MATCH_THRESHOLD):
+		scores = self.scores(vec, k=1)
+		if not scores:
+			return None, 0.0
+		label, score = next(iter(scores.items()))
+		return (label if score >= threshold else None), score
+
+
+class EmbeddingRecognizer:
+	# Stands in for the runner in burst_recognize(..., classify=classify_embedding).
+	# detector (with margin) is for enrollment and the CLI; leave it out when
+	# frames come from a FrameGate that already crops faces.
+	def __init__(self, embedder=None, gallery=None, detector=None, margin=FACE_MARGIN):
+		self.embedder = embedder or load_embedder()
+		self.gallery = gallery if gallery is not None else Gallery()
+		self.detector = detector
+		self.margin = margin
+		self.check()
+
+	# A gallery enrolled with another embedder cannot be matched against
+	def check(self):
+		dim = self.gallery.dim
+		if dim is not None and dim != self.embedder.dim:
+			raise ValueError(f"Gallery {self.gallery.path} has {dim}-d descriptors, "
+				f"{type(self.embedder).__name__} makes {self.embedder.dim}-d; re-enroll with the same model")
+
+	def face(self, frame):
+		if self.detector is None:
+			return frame
+		box = self.detector.detect(frame)
+		if box is None:
+			return None
+		return crop_face(frame, box, self.margin)
+
+	def describe(self, frame):
+		face = self.face(frame)
+		return None if face is None or not face.size else self.embedder.embed(face)
+
+	def scores(self, frame):
+		vec = self.describe(frame)
+		return None if vec is None else self.gallery.scores(vec)
+
+
+def classify_embedding(recognizer, frame):
+	scores = recognizer.scores(frame)
+	if scores is None:
+		return None
+	return {label: max(score, 0.0) for label, score in scores.items()}
+
+
+def read_images(paths):
+	for path in paths:
+		if os.path.isdir(path):
+			for name in sorted(os.listdir(path)):
+				yield from read_images([os.path.join(path, name)])
+			continue
+		image = cv2.imread(path)
+		if image is None:
+			print(f"Skipping {path}: not an image")
+			continue
+		yield path, image
+
+
+def enroll(recognizer, label, paths):
+	t0 = perf_counter()
+	vectors = [vec for _, image in read_images(paths) for vec in [recognizer.describe(image)] if vec is not None]
+	if not vectors:
+		print(f"No usable faces for {label}")
+		return 0
+	recognizer.gallery.add(label, np.stack(vectors))
+	print(f"Enrolled {label}: {len(vectors)} images in {perf_counter() - t0:.2f} s "
+		f"(gallery {len(recognizer.gallery)} rows, {len(recognizer.gallery.names)} people)")
+	return len(vectors)
+
+
+def bench_synthetic(people=5000, per_person=3, dim=128, queries=500, noise=0.35):
+	import tempfile
+	rng = np.random.default_rng(0)
+	centers = rng.standard_normal((people, dim)).astype(np.float32)
+	centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+	def sample(ids):
+		vecs = centers[ids] + rng.standard_normal((len(ids), dim)).astype(np.float32) * noise / np.sqrt(dim)
+		return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+	path = os.path.join(tempfile.mkdtemp(), "gallery.npy")
+	ids = np.repeat(np.arange(people), per_person)
+	np.save(path, sample(ids))
+	with open(os.path.splitext(path)[0] + "_labels.json", "w") as f:
+		json.dump([f"p{i}" for i in ids], f)
+
+	truth = rng.integers(0, people, queries)
+	probes = sample(truth)
+	for name, threshold in (("exact", len(ids) + 1), ("lsh", 0)):
+		t0 = perf_counter()
+		gallery = Gallery(path, ann_threshold=threshold)
+		load = perf_counter() - t0
+		t0 = perf_counter()
+		hits = sum(gallery.match(vec, threshold=0)[0] == f"p{t}" for vec, t in zip(probes, truth))
+		per = (perf_counter() - t0) / queries
+		print(f"{name:>5}: {len(ids)} rows, load+index {load * 1000:.0f} ms, match {per * 1000:.3f} ms, "
+			f"accuracy {hits / queries:.1%}")
+
+
+# Compares the classifier and the gallery on a labelled folder (DIR/<person>/*.jpg):
+# the first image of each person is enrolled, the rest are probes
+def bench_folder(recognizer, root, runner):
+	import tempfile
+	gallery = Gallery(os.path.join(tempfile.mkdtemp(), "gallery.npy"))
+	recognizer.gallery = gallery
+	recognizer.detector = load_face_detector()
+	probes = []
+	for person in sorted(os.listdir(root)):
+		images = list(read_images([os.path.join(root, person)]))
+		if len(images) < 2:
+			continue
+		enroll(recognizer, person, [images[0][0]])
+		probes += [(person, image) for _, image in images[1:]]
+	results = {"embedding": [0, 0.0], "classify": [0, 0.0]}
+	for person, image in probes:
+		t0 = perf_counter()
+		vec = recognizer.describe(image)
+		# No face found counts as a miss
+		label = gallery.match(vec, threshold=0)[0] if vec is not None else None
+		results["embedding"][1] += perf_counter() - t0
+		results["embedding"][0] += label == person
+		t0 = perf_counter()
+		features, _ = runner.get_features_from_image(image)
+		scores = runner.classify(features)["result"]["classification"]
+		results["classify"][1] += perf_counter() - t0
+		results["classify"][0] += max(scores, key=scores.get) == person
+	for name, (hits, elapsed) in results.items():
+		print(f"{name:>9}: accuracy {hits / max(len(probes), 1):.1%}, {elapsed / max(len(probes), 1) * 1000:.2f} ms/frame")
+
+
+def bench(args):
+	bench_synthetic()
+	from hardware import ImageImpulseRunner
+	runner = ImageImpulseRunner(args.model)
+	runner.init()
+	recognizer = EmbeddingRecognizer()
+	frame = np.random.default_rng(1).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+	for name, fn in (("classify", lambda: runner.classify(runner.get_features_from_image(frame)[0])),
+		("embed", lambda: recognizer.describe(frame))):
+		fn()
+		t0 = perf_counter()
+		for _ in range(20):
+			fn()
+		print(f"{name:>9}: {(perf_counter() - t0) / 20 * 1000:.2f} ms/frame")
+	if args.images:
+		bench_folder(recognizer, args.images, runner)
+	runner.stop()
+
+
+def main():
+	import argparse
+	parser = argparse.ArgumentParser(description="Face gallery enrollment and matching")
+	parser.add_argument("--gallery", default=GALLERY_PATH)
+	sub = parser.add_subparsers(dest="command", required=True)
+	p = sub.add_parser("enroll", help="add images (files or folders) for a person")
+	p.add_argument("label")
+	p.add_argument("paths", nargs="+")
+	p = sub.add_parser("remove", help="drop a person from the gallery")
+	p.add_argument("label")
+	p = sub.add_parser("match", help="match images against the gallery")
+	p.add_argument("paths", nargs="+")
+	p.add_argument("--threshold", type=float, default=MATCH_THRESHOLD)
+	sub.add_parser("list", help="show enrolled people")
+	p = sub.add_parser("bench", help="latency/accuracy against the classify path")
+	p.add_argument("--images", help="labelled folder, one subfolder per person")
+	p.add_argument("--model", default="model.eim")
+	args = parser.parse_args()
+
+	if args.command == "bench":
+		return bench(args)
+
+	recognizer = EmbeddingRecognizer(gallery=Gallery(args.gallery), detector=load_face_detector())
+	gallery = recognizer.gallery
+	if args.command == "enroll":
+		enroll(recognizer, args.label, args.paths)
+	elif args.command == "remove":
+		print(f"Removed {gallery.remove(args.label)} rows for {args.label}")
+	elif args.command == "list":
+		for name in gallery.names:
+			print(f"{name}: {gallery.labels.count(name)} images")
+	elif args.command == "match":
+		for path, image in read_images(args.paths):
+			vec = recognizer.describe(image)
+			if vec is None:
+				print(f"{path}: no face")
+				continue
+			t0 = perf_counter()
+			label, score = gallery.match(vec, args.threshold)
+			print(f"{path}: {label} ({score:.3f}) in {(perf_counter() - t0) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+	sys.exit(main())
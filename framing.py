@@ -0,0 +1,287 @@
+import struct
+import random
+import binascii
+from time import sleep, monotonic, perf_counter
+
+from sensors import parse_line
+
+# Compact framed protocol for the Arduino link, as an alternative to one JSON
+# text line per reading:
+#
+#   A5 5A | kind (1) | length (1) | payload (length) | CRC16 (2, big-endian)
+#
+# The CRC is CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF) over kind, length
+# and payload, which is binascii.crc_hqx on this side. A READINGS payload is a
+# sequence number followed by up to 63 readings of (int16 temperature * 100,
+# uint16 humidity * 100), so one frame can carry several readings.
+#
+# FrameDecoder is incremental: feed it whatever the port returned and it
+# hands back the complete readings. A frame that fails its CRC is dropped and
+# the decoder rescans from the next byte for a sync marker, so one flipped bit
+# costs one frame, not the rest of the stream. Plain JSON lines are still
+# accepted, so a board running the old sketch keeps working.
+#
+# Baud negotiation: the host sends BAUD with the new rate (uint32), the board
+# answers BAUD_ACK and switches; the host switches, waits for a valid reading
+# at the new rate and sends BAUD_OK. Without BAUD_OK within 2 s the sketch is
+# expected to drop back to 9600, and so does the host.
+
+SYNC = b"\xa5\x5a"
+READINGS = 0x01
+BAUD = 0x10
+BAUD_ACK = 0x11
+BAUD_OK = 0x12
+HEADER = 4
+TRAILER = 2
+READING = struct.Struct(">hH")
+MAX_BATCH = (255 - 1) // READING.size
+MAX_BUFFER = 4096
+
+
+def encode_frame(kind, payload=b""):
+	body = bytes((kind, len(payload))) + payload
+	return SYNC + body + binascii.crc_hqx(body, 0xFFFF).to_bytes(2, "big")
+
+
+def encode_readings(readings, seq=0):
+	if len(readings) > MAX_BATCH:
+		raise ValueError(f"At most {MAX_BATCH} readings per frame")
+	payload = bytearray((seq & 0xFF,))
+	for temperature, humidity in readings:
+		payload += READING.pack(round(temperature * 100), round(humidity * 100))
+	return encode_frame(READINGS, bytes(payload))
+
+
+class FrameDecoder:
+	# on_control(kind, payload) gets every valid frame that is not READINGS
+	def __init__(self, parser=parse_line, on_control=None):
+		self.parser = parser
+		self.on_control = on_control
+		self.buf = bytearray()
+		self.seq = None
+		self.frames = 0
+		self.lines = 0
+		self.readings = 0
+		self.crc_errors = 0
+		self.bad_frames = 0
+		self.bad_lines = 0
+		self.lost = 0
+		self.skipped = 0
+
+	@property
+	def errors(self):
+		return self.crc_errors + self.bad_frames + self.bad_lines
+
+	# Returns the (temperature, humidity) readings completed by data
+	def feed(self, data):
+		buf = self.buf
+		buf.extend(data)
+		out = []
+		pos = 0
+		n = len(buf)
+		while pos < n:
+			sync = buf.find(SYNC, pos)
+			text_end = n if sync < 0 else sync
+			while True:
+				end = buf.find(b"\n", pos, text_end)
+				if end < 0:
+					break
+				self._line(bytes(buf[pos:end]).strip(), out)
+				pos = end + 1
+			if sync < 0:
+				# Keep an unfinished line, or the first half of a sync marker
+				break
+			if sync > pos:
+				self.skipped += sync - pos
+				pos = sync
+			if n - pos < HEADER + TRAILER:
+				break
+			end = pos + HEADER + buf[pos + 3] + TRAILER
+			if end > n:
+				break
+			if binascii.crc_hqx(buf[pos + 2:end - TRAILER], 0xFFFF) != int.from_bytes(buf[end - TRAILER:end], "big"):
+				# Not a frame (or a damaged one): resync on the next marker
+				self.crc_errors += 1
+				self.skipped += 1
+				pos += 1
+				continue
+			self._frame(buf[pos + 2], bytes(buf[pos + HEADER:end - TRAILER]), out)
+			pos = end
+		del buf[:pos]
+		if len(buf) > MAX_BUFFER:
+			self.skipped += len(buf)
+			buf.clear()
+		return out
+
+	def _line(self, line, out):
+		if not line:
+			return
+		if not line.startswith(b"{"):
+			# Binary noise left over after a resync
+			self.skipped += len(line)
+			return
+		self.lines += 1
+		parsed = self.parser(line)
+		if parsed is None:
+			self.bad_lines += 1
+			return
+		self.readings += 1
+		out.append(parsed)
+
+	def _frame(self, kind, payload, out):
+		self.frames += 1
+		if kind != READINGS:
+			if self.on_control is not None:
+				self.on_control(kind, payload)
+			return
+		if not payload or (len(payload) - 1) % READING.size:
+			self.bad_frames += 1
+			return
+		seq = payload[0]
+		if self.seq is not None:
+			self.lost += (seq - self.seq - 1) & 0xFF
+		self.seq = seq
+		for temperature, humidity in READING.iter_unpack(payload[1:]):
+			out.append((temperature / 100, humidity / 100))
+		self.readings += (len(payload) - 1) // READING.size
+
+	def stats(self):
+		return {
+			"frames": self.frames,
+			"lines": self.lines,
+			"readings": self.readings,
+			"crc_errors": self.crc_errors,
+			"bad_frames": self.bad_frames,
+			"bad_lines": self.bad_lines,
+			"lost_frames": self.lost,
+			"skipped_bytes": self.skipped,
+		}
+
+
+# Ask the board to switch to baud. Call before SerialReader starts, since this
+# reads the port itself. Returns the rate the link ended up at.
+def negotiate_baud(ser, baud, timeout=2.0):
+	current = ser.baudrate
+	if baud == current:
+		return current
+	acks = []
+	decoder = FrameDecoder(on_control=lambda kind, payload: acks.append((kind, payload)))
+	wanted = (BAUD_ACK, baud.to_bytes(4, "big"))
+	old_timeout = ser.timeout
+	ser.timeout = 0.05
+	try:
+		ser.reset_input_buffer()
+		ser.write(encode_frame(BAUD, baud.to_bytes(4, "big")))
+		deadline = monotonic() + timeout
+		while wanted not in acks and monotonic() < deadline:
+			decoder.feed(ser.read(max(1, ser.in_waiting)))
+		if wanted not in acks:
+			print(f"Arduino did not accept {baud} baud, staying at {current}")
+			return current
+		ser.baudrate = baud
+		ser.reset_input_buffer()
+		decoder = FrameDecoder()
+		deadline = monotonic() + timeout
+		while monotonic() < deadline:
+			if decoder.feed(ser.read(max(1, ser.in_waiting))):
+				ser.write(encode_frame(BAUD_OK, baud.to_bytes(4, "big")))
+				print(f"Serial link at {baud} baud")
+				return baud
+		print(f"No readings at {baud} baud, back to {current}")
+		ser.baudrate = current
+		return current
+	finally:
+		ser.timeout = old_timeout
+
+
+def json_stream(readings):
+	return b"".join(json_line(t, h) for t, h in readings)
+
+
+def json_line(temperature, humidity):
+	return b'{"temperature": %.1f, "humidity": %.1f}\n' % (temperature, humidity)
+
+
+def framed_stream(readings, batch):
+	return b"".join(encode_readings(readings[i:i + batch], seq=i // batch) for i in range(0, len(readings), batch))
+
+
+def corrupt(data, rate, seed=0):
+	rng = random.Random(seed)
+	data = bytearray(data)
+	for _ in range(int(len(data) * rate)):
+		data[rng.randrange(len(data))] ^= 1 << rng.randrange(8)
+	return bytes(data)
+
+
+def parse_all(feed, data, chunk=64):
+	count = 0
+	t0 = perf_counter()
+	for i in range(0, len(data), chunk):
+		count += feed(data[i:i + chunk])
+	return count, perf_counter() - t0
+
+
+def main():
+	from sensors import SerialReader
+	n = 20000
+	readings = [(round(20 + (i % 50) * 0.1, 1), round(40 + (i % 30) * 0.5, 1)) for i in range(n)]
+	streams = [("json lines", json_stream(readings), None)]
+	for batch in (1, 8, MAX_BATCH):
+		streams.append((f"framed x{batch}", framed_stream(readings, batch), batch))
+
+	valid = set(readings)
+
+	def via_reader(decoder):
+		got = []
+		reader = SerialReader(None, decoder=decoder, on_reading=lambda r: got.append((r.temperature, r.humidity)))
+
+		def feed(chunk):
+			before = len(got)
+			reader.feed(chunk)
+			return len(got) - before
+		return reader, feed, got
+
+	print(f"{n} readings, fed in 64-byte chunks through SerialReader")
+	for name, stream, batch in streams:
+		reader, feed, _ = via_reader(None if batch is None else FrameDecoder())
+		count, took = parse_all(feed, stream)
+		assert count == n, (name, count)
+		assert reader.latest()[:2] == readings[-1]
+		per = len(stream) / n
+		rates = ", ".join(f"{baud / 10 / per:6.0f}/s at {baud}" for baud in (9600, 115200))
+		print(f"  {name:<12} {per:5.1f} B/reading  parse {count / took / 1000:6.1f} k readings/s  line rate {rates}")
+
+	print("With 0.1% of bytes bit-flipped:")
+	for name, stream, batch in streams:
+		damaged = corrupt(stream, 0.001)
+		decoder = FrameDecoder()
+		reader, feed, got = via_reader(None if batch is None else decoder)
+		count, _ = parse_all(feed, damaged)
+		wrong = sum(1 for reading in got if reading not in valid)
+		detail = f"{decoder.crc_errors} CRC errors, {decoder.lost} frames lost" if batch else f"{reader.errors} bad lines"
+		print(f"  {name:<12} recovered {count / n:6.1%}, {wrong} wrong values accepted  ({detail})")
+
+	# Old sketch on the same port: JSON lines still decode
+	decoder = FrameDecoder()
+	mixed = json_stream(readings[:5]) + framed_stream(readings[5:10], 5) + json_stream(readings[10:15])
+	assert decoder.feed(mixed) == readings[:15]
+
+	from sensors import FakeArduino, open_port
+	arduino = FakeArduino(rate=200, protocol="framed", batch=8).start()
+	ser = open_port(arduino.port, 9600)
+	negotiate_baud(ser, 115200)
+	reader = SerialReader(ser, decoder=FrameDecoder(), history=1000).start()
+	sleep(1)
+	reader.stop()
+	arduino.stop()
+	print(f"FakeArduino framed: sent {arduino.sent} readings, decoded {reader.lines} ({reader.errors} errors)")
+	# Readings of one frame are spread back from its arrival, not stamped together
+	stamps = [r.timestamp for r in reader.recent()]
+	gaps = [b - a for a, b in zip(stamps, stamps[1:])]
+	assert all(gap > 0 for gap in gaps[8:]), "batched readings share a timestamp"
+	print(f"  reading spacing p50 {sorted(gaps)[len(gaps) // 2] * 1000:.1f} ms (sent every {1000 / arduino.rate:.1f} ms)")
+
+
+if __name__ == "__main__":
+	main()
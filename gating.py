@@ -0,0 +1,163 @@
+import os
+from collections import Counter
+import numpy as np
+import cv2
+
+# Cheap checks in front of get_features_from_image/classify: frames that are
+# too blurred, too dark/bright or have no face are rejected and recaptured
+# straight away instead of costing a full classification.
+#
+# Feed the gate capture-resolution frames (CameraEngine capture_size,
+# grab(full=True)), not model-sized ones: the res10 SSD runs at 300x300, and
+# a 96x96 frame upscaled to that has lost the detail it needs, so faces
+# that fill less of the frame are missed. The face crop then comes from the
+# full frame too and the runner resizes it to its input.
+
+FACE_PROTO = "deploy.prototxt"
+FACE_MODEL = "res10_300x300_ssd_iter_140000.caffemodel"
+# Share of the box width/height added on each side of a detected face
+FACE_MARGIN = 0.2
+
+
+class FaceDetector:
+	def __init__(self, proto=FACE_PROTO, model=FACE_MODEL, confidence=0.5, size=300):
+		self.net = cv2.dnn.readNetFromCaffe(proto, model)
+		self.confidence = confidence
+		self.size = size
+
+	# Largest-confidence face box as (x1, y1, x2, y2) in frame coordinates, or None
+	def detect(self, frame):
+		h, w = frame.shape[:2]
+		blob = cv2.dnn.blobFromImage(frame, 1.0, (self.size, self.size), (104.0, 177.0, 123.0))
+		self.net.setInput(blob)
+		detections = self.net.forward()[0, 0]
+		if not len(detections):
+			return None
+		best = detections[np.argmax(detections[:, 2])]
+		if best[2] < self.confidence:
+			return None
+		x1, y1, x2, y2 = (np.clip(best[3:7], 0, 1) * [w, h, w, h]).astype(int)
+		if x2 <= x1 or y2 <= y1:
+			return None
+		return x1, y1, x2, y2
+
+
+# The crop the gate hands to the classifier; gallery enrollment uses it too
+def crop_face(frame, box, margin=FACE_MARGIN):
+	x1, y1, x2, y2 = box
+	h, w = frame.shape[:2]
+	mx = int((x2 - x1) * margin)
+	my = int((y2 - y1) * margin)
+	return frame[max(0, y1 - my):min(h, y2 + my), max(0, x1 - mx):min(w, x2 + mx)]
+
+
+def load_face_detector(proto=FACE_PROTO, model=FACE_MODEL, **kwargs):
+	if not (os.path.exists(proto) and os.path.exists(model)):
+		print(f"Face detector files not found ({proto}, {model}), skipping face gate")
+		return None
+	return FaceDetector(proto, model, **kwargs)
+
+
+class FrameGate:
+	def __init__(self, min_sharpness=60.0, min_brightness=40.0, max_brightness=220.0,
+		detector=None, margin=FACE_MARGIN, analysis_width=160):
+		self.min_sharpness = min_sharpness
+		self.min_brightness = min_brightness
+		self.max_brightness = max_brightness
+		self.detector = detector
+		self.margin = margin
+		self.analysis_width = analysis_width
+		self.small = None
+		self.gray = None
+		self.counts = Counter()
+		self.last_reason = None
+
+	def _gray(self, frame):
+		h, w = frame.shape[:2]
+		sw = min(self.analysis_width, w)
+		sh = max(1, h * sw // w)
+		if self.small is None or self.small.shape[:2] != (sh, sw):
+			self.small = np.empty((sh, sw, 3), dtype=np.uint8)
+			self.gray = np.empty((sh, sw), dtype=np.uint8)
+		cv2.resize(frame, (sw, sh), dst=self.small, interpolation=cv2.INTER_AREA)
+		cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+		return self.gray
+
+	def measure(self, frame):
+		gray = self._gray(frame)
+		brightness = float(gray.mean())
+		sharpness = float(cv2.Laplacian(gray, cv2.CV_16S).var())
+		return sharpness, brightness
+
+	# (accepted, frame_or_face_roi, reason)
+	def check(self, frame):
+		self.counts["checked"] += 1
+		if frame is None:
+			self.counts["no_frame"] += 1
+			return False, None, "no_frame"
+		sharpness, brightness = self.measure(frame)
+		if brightness < self.min_brightness:
+			reason = "dark"
+		elif brightness > self.max_brightness:
+			reason = "bright"
+		elif sharpness < self.min_sharpness:
+			reason = "blurred"
+		else:
+			reason = None
+		if reason is None and self.detector is not None:
+			box = self.detector.detect(frame)
+			if box is None:
+				reason = "no_face"
+			else:
+				frame = self.crop(frame, box)
+		if reason is not None:
+			self.counts[reason] += 1
+			return False, None, reason
+		self.counts["passed"] += 1
+		return True, frame, None
+
+	def crop(self, frame, box):
+		return crop_face(frame, box, self.margin)
+
+	# Capture until a frame passes the gate, up to max_tries. last_reason is
+	# why the last try was rejected when this returns None
+	def capture(self, capture_fn, max_tries=5):
+		for _ in range(max_tries):
+			accepted, frame, self.last_reason = self.check(capture_fn())
+			if accepted:
+				return frame
+		return None
+
+	def stats(self):
+		checked = self.counts["checked"]
+		skipped = checked - self.counts["passed"]
+		return {
+			"checked": checked,
+			"passed": self.counts["passed"],
+			"inference_skipped": skipped,
+			"skip_ratio": skipped / checked if checked else 0.0,
+			"reasons": {k: v for k, v in self.counts.items() if k not in ("checked", "passed")},
+		}
+
+
+def main():
+	from time import perf_counter
+	rng = np.random.default_rng(0)
+	sharp = rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)
+	frames = {
+		"sharp": sharp,
+		"blurred": cv2.GaussianBlur(sharp, (31, 31), 10),
+		"dark": (sharp // 16).astype(np.uint8),
+	}
+	gate = FrameGate(detector=load_face_detector())
+	for name, frame in frames.items():
+		t0 = perf_counter()
+		for _ in range(200):
+			accepted, _, reason = gate.check(frame)
+		elapsed = (perf_counter() - t0) / 200
+		print(f"{name}: accepted={accepted} reason={reason} {elapsed * 1000:.2f} ms/frame")
+	print(gate.stats())
+
+
+if __name__ == "__main__":
+	main()
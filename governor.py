@@ -0,0 +1,230 @@
+import os
+import threading
+from time import sleep, monotonic, process_time
+
+# Duty-cycling for the camera loops: instead of a fixed sleep between
+# iterations, the loop runs at a rate between min_rate and max_rate picked
+# from how close the next dose is and how recently there was activity
+# (motion, a recognition, a command). High CPU load or a hot SoC scales the
+# rate back down. pace() goes at the end of each iteration; it sleeps off the
+# rest of the interval, and note_activity() from any thread cuts a sleep
+# short.
+
+LOADAVG_PATH = "/proc/loadavg"
+THERMAL_PATH = "/sys/class/thermal/thermal_zone0/temp"
+
+
+class SysfsSource:
+	# load() is the 1-minute load average per CPU; temperature() is the SoC
+	# temperature in °C. Either is None where the file does not exist.
+	def __init__(self, loadavg_path=LOADAVG_PATH, thermal_path=THERMAL_PATH):
+		self.loadavg_path = loadavg_path
+		self.thermal_path = thermal_path
+		self.cpus = os.cpu_count() or 1
+
+	def load(self):
+		try:
+			with open(self.loadavg_path) as f:
+				return float(f.read().split()[0]) / self.cpus
+		except (OSError, ValueError, IndexError):
+			return None
+
+	def temperature(self):
+		try:
+			with open(self.thermal_path) as f:
+				return int(f.read().strip()) / 1000
+		except (OSError, ValueError):
+			return None
+
+
+class StaticSource:
+	# Stand-in for SysfsSource with values the caller sets
+	def __init__(self, load=None, temperature=None):
+		self._load = load
+		self._temperature = temperature
+
+	def load(self):
+		return self._load
+
+	def temperature(self):
+		return self._temperature
+
+
+class Governor:
+	# next_event() returns seconds until the next dose (0 while one is due) or
+	# None. Urgency ramps from 0 to 1 over the last `approach` seconds before a
+	# dose and stays at 1 for `hold` seconds after activity, then decays over
+	# another `hold`. baseline is the fixed sleep this replaces, for the CPU
+	# saving estimate.
+	def __init__(self, min_rate=1 / 30, max_rate=1.0, approach=900, hold=60, next_event=None,
+			source=None, load_limit=0.9, temp_soft=70.0, temp_hard=80.0, baseline=3.0):
+		self.min_rate = min_rate
+		self.max_rate = max_rate
+		self.approach = approach
+		self.hold = hold
+		self.next_event = next_event
+		self.source = source or SysfsSource()
+		self.load_limit = load_limit
+		self.temp_soft = temp_soft
+		self.temp_hard = temp_hard
+		self.baseline = baseline
+		self.last_activity = None
+		self.wake = threading.Event()
+		self.started = None
+		self.woke = None
+		self.woke_cpu = None
+		self.ticks = 0
+		self.work = 0.0
+		self.work_cpu = 0.0
+		self.slept = 0.0
+		self.throttled = 0
+		self.reason = None
+		self.current = min_rate
+
+	def note_activity(self, now=None):
+		self.last_activity = monotonic() if now is None else now
+		self.wake.set()
+
+	def urgency(self, now=None):
+		now = monotonic() if now is None else now
+		level = 0.0
+		if self.next_event is not None:
+			try:
+				seconds = self.next_event()
+			except Exception as e:
+				print(f"Governor schedule check failed: {e}")
+				seconds = None
+			if seconds is not None and seconds < self.approach:
+				level = 1 - max(0.0, seconds) / self.approach
+		if self.last_activity is not None:
+			idle = now - self.last_activity
+			if idle <= self.hold:
+				level = 1.0
+			elif idle < 2 * self.hold:
+				level = max(level, 2 - idle / self.hold)
+		return level
+
+	# (factor, reason): how far load and temperature scale the rate down
+	def throttle(self):
+		factor, reason = 1.0, None
+		load = self.source.load()
+		if load is not None and load > self.load_limit:
+			factor, reason = self.load_limit / load, "load"
+		temperature = self.source.temperature()
+		if temperature is not None and temperature > self.temp_soft:
+			heat = max(0.0, (self.temp_hard - temperature) / (self.temp_hard - self.temp_soft))
+			if heat < factor:
+				factor, reason = heat, "temperature"
+		return factor, reason
+
+	# Target iterations per second: geometric between min and max rate
+	def rate(self, now=None):
+		rate = self.min_rate * (self.max_rate / self.min_rate) ** self.urgency(now)
+		factor, self.reason = self.throttle()
+		if factor < 1:
+			rate *= factor
+		self.current = min(self.max_rate, max(self.min_rate, rate))
+		return self.current
+
+	# Call at the end of each loop iteration; returns the time slept
+	def pace(self):
+		now = monotonic()
+		if self.started is None:
+			self.started = now
+		if self.woke is not None:
+			self.work += now - self.woke
+			self.work_cpu += process_time() - self.woke_cpu
+		else:
+			self.woke = now
+		self.ticks += 1
+		rate = self.rate(now)
+		if self.reason:
+			self.throttled += 1
+		delay = max(0.0, 1 / rate - (now - self.woke))
+		self.wake.clear()
+		self.wake.wait(delay)
+		self.woke = monotonic()
+		self.woke_cpu = process_time()
+		slept = self.woke - now
+		self.slept += slept
+		return slept
+
+	def stats(self):
+		elapsed = (self.woke - self.started) if self.started is not None and self.woke is not None else 0.0
+		per_tick = self.work / self.ticks if self.ticks else 0.0
+		cpu_per_tick = self.work_cpu / self.ticks if self.ticks else 0.0
+		# What the fixed `work + sleep(baseline)` loop would have done meanwhile
+		baseline_ticks = elapsed / (per_tick + self.baseline) if elapsed else 0.0
+		return {
+			"ticks": self.ticks,
+			"elapsed_s": round(elapsed, 1),
+			"achieved_hz": round(self.ticks / elapsed, 4) if elapsed else None,
+			"target_hz": round(self.current, 4),
+			"baseline_hz": round(1 / (per_tick + self.baseline), 4),
+			"throttled": self.throttled,
+			"throttle_reason": self.reason,
+			"cpu_per_tick_s": round(cpu_per_tick, 4),
+			"cpu_saved_s": round((baseline_ticks - self.ticks) * cpu_per_tick, 1),
+		}
+
+
+def simulate(hours=24, doses=("08:00", "13:00", "20:00"), work=0.12, source=None, activity=()):
+	# Virtual day: each iteration costs `work` seconds of CPU (roughly one
+	# capture + inference on a Pi 4); activity is a list of (start, end) hours
+	from scheduler import DoseScheduler
+	from datetime import datetime, timedelta
+	day = datetime(2024, 1, 1)
+	schedule = DoseScheduler({f"p{i}": t for i, t in enumerate(doses)}, now=day)
+	clock = [0.0]
+	due_until = [None]
+
+	def now_dt():
+		return day + timedelta(seconds=clock[0])
+
+	def seconds_to_dose():
+		now = now_dt()
+		for dose in schedule.pop_due(now):
+			due_until[0] = dose.deadline + dose.grace
+		if due_until[0] is not None and now < due_until[0]:
+			return 0.0
+		return schedule.seconds_until_next(now)
+
+	governor = Governor(next_event=seconds_to_dose, source=source or StaticSource())
+	phases = {}
+	end = hours * 3600
+	while clock[0] < end:
+		hour = clock[0] / 3600
+		if any(start <= hour < stop for start, stop in activity):
+			governor.last_activity = clock[0]
+		rate = governor.rate(clock[0])
+		level = governor.urgency(clock[0])
+		phase = "active" if level >= 1 else "approach" if level > 0 else "idle"
+		ticks, spent = phases.get(phase, (0, 0.0))
+		step = max(work, 1 / rate)
+		phases[phase] = (ticks + 1, spent + step)
+		clock[0] += step
+	ticks = sum(t for t, _ in phases.values())
+	baseline_ticks = end / (work + governor.baseline)
+	return phases, ticks, baseline_ticks, (baseline_ticks - ticks) * work
+
+
+def main():
+	activity = ((7.9, 8.1), (12.5, 12.6), (18.0, 18.5))
+	for name, source in (("cool, idle", StaticSource(0.2, 50.0)), ("busy CPU", StaticSource(1.8, 55.0)), ("hot SoC", StaticSource(0.3, 77.0))):
+		phases, ticks, baseline, saved = simulate(source=source, activity=activity)
+		print(f"{name}: {ticks} iterations vs {baseline:.0f} at fixed 3 s pacing, {saved:.0f} CPU s/day saved")
+		for phase, (n, spent) in sorted(phases.items()):
+			print(f"  {phase:<8} {spent / 3600:5.2f} h at {n / spent:6.3f} Hz")
+
+	# Real pacing for a few seconds, with activity halfway through
+	governor = Governor(min_rate=2, max_rate=20, hold=1, source=SysfsSource(), baseline=0.2)
+	threading.Timer(1.5, governor.note_activity).start()
+	t0 = monotonic()
+	while monotonic() - t0 < 4:
+		sleep(0.005)
+		governor.pace()
+	print(f"Live: {governor.stats()}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,102 @@
+import os
+import random
+from time import sleep
+
+# Hardware backend selection. With DISPENSER_BACKEND=sim every script runs
+# headless: gpiozero uses mock pins, the Arduino is a pty emitting JSON, the
+# camera reads an image folder (or synthetic frames) and the model runner is
+# a stub with configurable latency and scores.
+
+BACKEND = os.environ.get("DISPENSER_BACKEND", "pi")
+SIMULATED = BACKEND == "sim"
+
+SIM_SERIAL_RATE = float(os.environ.get("SIM_SERIAL_RATE", "1"))
+SIM_SERIAL_PROTOCOL = os.environ.get("SIM_SERIAL_PROTOCOL", "json")
+SIM_IMAGE_DIR = os.environ.get("SIM_IMAGE_DIR")
+SIM_LABELS = os.environ.get("SIM_LABELS", "jayne,areebah,shruthigna,unknown").split(",")
+SIM_LABEL = os.environ.get("SIM_LABEL", SIM_LABELS[0])
+SIM_CONFIDENCE = float(os.environ.get("SIM_CONFIDENCE", "0.92"))
+SIM_INFER_LATENCY = float(os.environ.get("SIM_INFER_LATENCY", "0.05"))
+SIM_INPUT_SIZE = int(os.environ.get("SIM_INPUT_SIZE", "96"))
+
+if SIMULATED:
+	from gpiozero import Device
+	from gpiozero.pins.mock import MockFactory, MockPWMPin
+	Device.pin_factory = MockFactory(pin_class=MockPWMPin)
+
+from gpiozero import LED, Buzzer, OutputDevice
+
+
+def open_serial(port, baud):
+	import serial
+	if SIMULATED:
+		from sensors import FakeArduino
+		arduino = FakeArduino(rate=SIM_SERIAL_RATE, protocol=SIM_SERIAL_PROTOCOL).start()
+		port = arduino.port
+		print(f"Simulated Arduino on {port} at {SIM_SERIAL_RATE} readings/s ({SIM_SERIAL_PROTOCOL})")
+	return serial.Serial(port, baud, timeout=1)
+
+
+def open_camera(name, width, height, **kwargs):
+	from camera import open_camera as open_engine
+	if SIMULATED:
+		return open_engine("file", width, height, path=kwargs.get("path", SIM_IMAGE_DIR), capture_size=kwargs.get("capture_size"))
+	return open_engine(name, width, height, **kwargs)
+
+
+class StubRunner:
+	# Same surface as ImageImpulseRunner for the calls the scripts make
+	def __init__(self, model_path=None, labels=None, label=None, confidence=None, latency=None):
+		self.model_path = model_path
+		self.labels = labels or SIM_LABELS
+		self.label = label or SIM_LABEL
+		self.confidence = SIM_CONFIDENCE if confidence is None else confidence
+		self.latency = SIM_INFER_LATENCY if latency is None else latency
+		self.size = SIM_INPUT_SIZE
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def init(self):
+		return {
+			"project": {"name": "simulated"},
+			"model_parameters": {
+				"labels": self.labels,
+				"image_input_width": self.size,
+				"image_input_height": self.size,
+				"image_channel_count": 3,
+			},
+		}
+
+	def get_features_from_image(self, img):
+		import cv2
+		cropped = cv2.resize(img, (self.size, self.size))
+		return cropped.reshape(-1).astype("float32"), cropped
+
+	def classify(self, features):
+		if self.latency:
+			sleep(self.latency)
+		rest = (1 - self.confidence) / max(1, len(self.labels) - 1)
+		scores = {label: rest * random.uniform(0.5, 1.5) for label in self.labels}
+		scores[self.label] = self.confidence
+		return {"result": {"classification": scores}, "timing": {"classification": int(self.latency * 1000)}}
+
+	def stop(self):
+		pass
+
+
+class LazyRunner:
+	# Defers importing edge_impulse_linux (and the cv2/numpy it pulls in) until
+	# a runner is built, so startup can do it off the main thread
+	def __new__(cls, *args, **kwargs):
+		from edge_impulse_linux.image import ImageImpulseRunner as Runner
+		return Runner(*args, **kwargs)
+
+
+if SIMULATED:
+	ImageImpulseRunner = StubRunner
+else:
+	ImageImpulseRunner = LazyRunner
@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from time import monotonic
+
+# Durable dispense ledger on SQLite in WAL mode. Recent records are mirrored
+# in an in-memory set keyed by (date, person, slot) so already-dispensed
+# checks never touch disk; writes are group-committed.
+
+LEDGER_PATH = "dispense_ledger.db"
+
+
+class DispenseLedger:
+	# batch > 1 groups that many records per commit; sync_interval forces a
+	# commit once the oldest unsynced record is that many seconds old, from a
+	# timer, so a quiet ledger does not hold an open transaction
+	def __init__(self, path=LEDGER_PATH, retention_days=30, batch=1, sync_interval=1.0):
+		self.path = path
+		self.retention = timedelta(days=retention_days)
+		self.batch = batch
+		self.sync_interval = sync_interval
+		self.lock = threading.Lock()
+		self.index = set()
+		self.unsynced = 0
+		self.oldest_unsynced = None
+		self.timer = None
+		self.pruned_on = None
+		self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("PRAGMA synchronous=FULL")
+		self.conn.execute(
+			"CREATE TABLE IF NOT EXISTS dispenses ("
+			"date TEXT NOT NULL, person TEXT NOT NULL, slot TEXT NOT NULL, ts REAL NOT NULL, "
+			"PRIMARY KEY (date, person, slot)) WITHOUT ROWID"
+		)
+		self.recovery_time = self.recover()
+
+	def recover(self, today=None):
+		start = monotonic()
+		cutoff = self._cutoff(today)
+		rows = self.conn.execute("SELECT date, person, slot FROM dispenses WHERE date >= ?", (cutoff,))
+		with self.lock:
+			self.index = set(rows)
+		return monotonic() - start
+
+	def _cutoff(self, today=None):
+		today = today or datetime.now()
+		return (today - self.retention).strftime("%Y-%m-%d")
+
+	def contains(self, date, person, slot):
+		return (date, person, slot) in self.index
+
+	def record(self, date, person, slot, ts=None):
+		key = (date, person, slot)
+		with self.lock:
+			if key in self.index:
+				return False
+			if self.unsynced == 0:
+				self.conn.execute("BEGIN")
+				self.oldest_unsynced = monotonic()
+				if self.batch > 1:
+					self.timer = threading.Timer(self.sync_interval, self.flush)
+					self.timer.daemon = True
+					self.timer.start()
+			self.conn.execute("INSERT OR IGNORE INTO dispenses VALUES (?, ?, ?, ?)",
+				(date, person, slot, ts if ts is not None else datetime.now().timestamp()))
+			self.index.add(key)
+			self.unsynced += 1
+			if self.unsynced >= self.batch or monotonic() - self.oldest_unsynced >= self.sync_interval:
+				self._commit()
+		today = datetime.now().date()
+		if self.pruned_on != today:
+			self.prune()
+			self.pruned_on = today
+		return True
+
+	def _commit(self):
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
+		if self.unsynced:
+			self.conn.execute("COMMIT")
+			self.unsynced = 0
+			self.oldest_unsynced = None
+
+	def flush(self):
+		with self.lock:
+			self._commit()
+
+	def prune(self, today=None):
+		cutoff = self._cutoff(today)
+		with self.lock:
+			self._commit()
+			removed = self.conn.execute("DELETE FROM dispenses WHERE date < ?", (cutoff,)).rowcount
+			self.index = {key for key in self.index if key[0] >= cutoff}
+		return removed
+
+	def compact(self):
+		with self.lock:
+			self._commit()
+			self.conn.execute("VACUUM")
+			self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+	def close(self):
+		with self.lock:
+			self._commit()
+			self.conn.close()
+
+
+def main():
+	import tempfile
+	from time import perf_counter
+
+	tmp = tempfile.mkdtemp()
+	for batch in (1, 10, 100):
+		path = os.path.join(tmp, f"ledger_{batch}.db")
+		ledger = DispenseLedger(path, retention_days=3650, batch=batch, sync_interval=60)
+		n = 2000
+		t0 = perf_counter()
+		for i in range(n):
+			ledger.record(f"2026-01-{i % 28 + 1:02d}", f"patient{i}", "08:00")
+		ledger.flush()
+		elapsed = perf_counter() - t0
+		ledger.close()
+		print(f"batch {batch:>3}: {n / elapsed:,.0f} records/s")
+
+	path = os.path.join(tmp, "ledger_big.db")
+	ledger = DispenseLedger(path, retention_days=3650, batch=1000, sync_interval=60)
+	for day in range(365):
+		date = (datetime(2026, 1, 1) + timedelta(days=day)).strftime("%Y-%m-%d")
+		for p in range(100):
+			ledger.record(date, f"patient{p}", "08:00")
+	ledger.close()
+	ledger = DispenseLedger(path, retention_days=3650)
+	t0 = perf_counter()
+	for _ in range(100000):
+		ledger.contains("2026-06-01", "patient42", "08:00")
+	lookup = (perf_counter() - t0) / 100000
+	print(f"Recovered {len(ledger.index)} records in {ledger.recovery_time * 1000:.1f} ms, lookup {lookup * 1e9:.0f} ns")
+	ledger.retention = timedelta(days=90)
+	removed = ledger.prune(datetime(2027, 1, 1))
+	ledger.compact()
+	print(f"Pruned {removed} records older than retention, {os.path.getsize(path) / 1024:.0f} KiB after compaction")
+	ledger.close()
+
+
+if __name__ == "__main__":
+	main()
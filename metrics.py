@@ -0,0 +1,281 @@
+import json
+import threading
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, sleep, time
+
+# In-process metrics: counters, gauges and fixed-bucket latency histograms in
+# a registry that renders the Prometheus text format. A small HTTP thread
+# serves /metrics and HealthPublisher can push periodic snapshots over MQTT.
+# Recording is a perf_counter pair, a bisect and a locked increment.
+
+PREFIX = "dispenser_"
+METRICS_PORT = 9100
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+	kind = "counter"
+
+	# fn, if given, is read at scrape time instead of counting (e.g. reader.lines)
+	def __init__(self, name, help="", fn=None):
+		self.name = name
+		self.help = help
+		self.fn = fn
+		self.value = 0
+		self.lock = threading.Lock()
+
+	def inc(self, n=1):
+		with self.lock:
+			self.value += n
+
+	def get(self):
+		return self.fn() if self.fn is not None else self.value
+
+	def render(self):
+		return [f"{self.name} {self.get()}"]
+
+
+class Gauge(Counter):
+	kind = "gauge"
+
+	def set(self, value):
+		self.value = value
+
+
+class Histogram:
+	kind = "histogram"
+
+	def __init__(self, name, help="", buckets=BUCKETS):
+		self.name = name
+		self.help = help
+		self.buckets = tuple(buckets)
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+		self.lock = threading.Lock()
+
+	def observe(self, value):
+		i = bisect_left(self.buckets, value)
+		with self.lock:
+			self.counts[i] += 1
+			self.sum += value
+			self.count += 1
+
+	def get(self):
+		return {"count": self.count, "mean_ms": round(self.sum / self.count * 1000, 3) if self.count else None}
+
+	def render(self):
+		with self.lock:
+			counts = list(self.counts)
+			total, count = self.sum, self.count
+		lines = []
+		cumulative = 0
+		for bound, n in zip(self.buckets, counts):
+			cumulative += n
+			lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+		lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+		lines.append(f"{self.name}_sum {total}")
+		lines.append(f"{self.name}_count {count}")
+		return lines
+
+
+class Registry:
+	def __init__(self, prefix=PREFIX):
+		self.prefix = prefix
+		self.metrics = {}
+		self.lock = threading.Lock()
+
+	def _get(self, cls, name, *args, **kw):
+		name = self.prefix + name
+		with self.lock:
+			metric = self.metrics.get(name)
+			if metric is None:
+				metric = self.metrics[name] = cls(name, *args, **kw)
+		return metric
+
+	def counter(self, name, help="", fn=None):
+		return self._get(Counter, name, help, fn)
+
+	def gauge(self, name, help="", fn=None):
+		return self._get(Gauge, name, help, fn)
+
+	def histogram(self, name, help="", buckets=BUCKETS):
+		return self._get(Histogram, name, help, buckets)
+
+	def render(self):
+		lines = []
+		for metric in list(self.metrics.values()):
+			try:
+				body = metric.render()
+			except Exception as e:
+				print(f"Metric {metric.name} failed: {e}")
+				continue
+			if metric.help:
+				lines.append(f"# HELP {metric.name} {metric.help}")
+			lines.append(f"# TYPE {metric.name} {metric.kind}")
+			lines.extend(body)
+		return "\n".join(lines) + "\n"
+
+	def snapshot(self):
+		out = {}
+		for name, metric in list(self.metrics.items()):
+			try:
+				out[name[len(self.prefix):]] = metric.get()
+			except Exception:
+				out[name[len(self.prefix):]] = None
+		return out
+
+
+REGISTRY = Registry()
+
+
+# Decorator (or wrapper: timed("classify")(runner.classify)) recording call
+# latency in <name>_seconds and exceptions in <name>_errors_total
+def timed(name, registry=REGISTRY):
+	histogram = registry.histogram(f"{name}_seconds", f"{name} latency")
+	errors = registry.counter(f"{name}_errors_total", f"{name} exceptions")
+
+	def decorate(fn):
+		@wraps(fn)
+		def wrapper(*args, **kw):
+			t0 = perf_counter()
+			try:
+				return fn(*args, **kw)
+			except Exception:
+				errors.inc()
+				raise
+			finally:
+				histogram.observe(perf_counter() - t0)
+		return wrapper
+	return decorate
+
+
+def counter(name, help="", fn=None):
+	return REGISTRY.counter(name, help, fn)
+
+
+def gauge(name, help="", fn=None):
+	return REGISTRY.gauge(name, help, fn)
+
+
+def histogram(name, help="", buckets=BUCKETS):
+	return REGISTRY.histogram(name, help, buckets)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		if self.path.split("?")[0] not in ("/metrics", "/"):
+			self.send_error(404)
+			return
+		body = self.server.registry.render().encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+class MetricsServer:
+	# Serves GET /metrics on a daemon thread; bind to localhost by default
+	def __init__(self, registry=REGISTRY, port=METRICS_PORT, host="127.0.0.1"):
+		self.registry = registry
+		self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+		self.httpd.registry = registry
+		self.port = self.httpd.server_address[1]
+		self.thread = None
+
+	def start(self):
+		self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics-http", daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+
+def start_server(port=METRICS_PORT, host="127.0.0.1", registry=REGISTRY):
+	try:
+		server = MetricsServer(registry, port, host).start()
+		print(f"Metrics on http://{host}:{server.port}/metrics")
+		return server
+	except OSError as e:
+		print(f"Metrics server unavailable: {e}")
+		return None
+
+
+class HealthPublisher:
+	# Calls publish(payload) with a JSON snapshot every interval seconds
+	def __init__(self, publish, interval=60.0, registry=REGISTRY):
+		self.publish = publish
+		self.interval = interval
+		self.registry = registry
+		self.stopped = threading.Event()
+		self.thread = None
+
+	def start(self):
+		self.thread = threading.Thread(target=self._run, name="health", daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.stopped.set()
+		if self.thread is not None:
+			self.thread.join(timeout=2)
+
+	def payload(self):
+		return json.dumps({"ts": int(time()), "metrics": self.registry.snapshot()})
+
+	def _run(self):
+		while not self.stopped.wait(self.interval):
+			try:
+				self.publish(self.payload())
+			except Exception as e:
+				print(f"Health publish failed: {e}")
+
+
+def main():
+	from urllib.request import urlopen
+
+	registry = Registry()
+
+	@timed("noop", registry)
+	def noop():
+		pass
+
+	def bare():
+		pass
+
+	n = 200000
+	t0 = perf_counter()
+	for _ in range(n):
+		bare()
+	base = (perf_counter() - t0) / n
+	t0 = perf_counter()
+	for _ in range(n):
+		noop()
+	wrapped = (perf_counter() - t0) / n
+	print(f"timed() overhead: {(wrapped - base) * 1e6:.2f} us/call")
+
+	frames = registry.counter("frames_total", "Frames captured")
+	t0 = perf_counter()
+	for _ in range(n):
+		frames.inc()
+	print(f"Counter.inc: {(perf_counter() - t0) / n * 1e6:.2f} us")
+
+	registry.gauge("outbox_depth", "Queued messages", fn=lambda: 3)
+	server = MetricsServer(registry, port=0).start()
+	sleep(0.1)
+	text = urlopen(f"http://127.0.0.1:{server.port}/metrics").read().decode()
+	server.stop()
+	print(text[:600])
+	print(HealthPublisher(print, registry=registry).payload())
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,212 @@
+import queue
+import threading
+from time import sleep, perf_counter
+import numpy as np
+
+# Stepper motion: moves are planned up front as a table of coil phases and
+# absolute timestamps (trapezoidal ramp up to a real target RPM), then played
+# back by a dedicated thread against monotonic deadlines.
+
+# One "step" in stop_angle/step_motor is a pass through the 4-phase sequence,
+# and 510 of those make a revolution of the 28BYJ-48 output shaft.
+STEPS_PER_REV = 510
+PHASES_PER_REV = STEPS_PER_REV * 4
+# The 28BYJ-48 misses steps above this; faster requests are clamped
+MAX_RPM = 15
+
+step_sequence_fast = np.array([
+	[1,1,0,0],
+	[0,1,1,0],
+	[0,0,1,1],
+	[1,0,0,1]
+], dtype=np.uint8)
+
+
+class MovePlan:
+	def __init__(self, phases, times):
+		self.phases = phases
+		self.times = times
+
+	def __len__(self):
+		return len(self.times)
+
+	@property
+	def duration(self):
+		return float(self.times[-1]) if len(self.times) else 0.0
+
+
+def plan_move(steps, direction=1, rpm=10, start_rpm=None, ramp_steps=None):
+	n = int(steps) * 4
+	if n <= 0:
+		return MovePlan(np.zeros((0, 4), dtype=np.uint8), np.zeros(0))
+	if rpm > MAX_RPM:
+		print(f"Stepper speed {rpm} RPM is above the motor's {MAX_RPM} RPM, moving at {MAX_RPM}")
+		rpm = MAX_RPM
+	seq = step_sequence_fast if direction > 0 else step_sequence_fast[::-1]
+	phases = seq[np.arange(n) % 4]
+
+	v_max = rpm * PHASES_PER_REV / 60
+	v0 = min(start_rpm, rpm) * PHASES_PER_REV / 60 if start_rpm else v_max / 3
+	ramp = ramp_steps * 4 if ramp_steps is not None else min(n // 2, PHASES_PER_REV // 12)
+	if ramp > 0 and v_max > v0:
+		# Constant acceleration: v(x)^2 = v0^2 + 2ax, capped at v_max and mirrored for decel
+		accel = (v_max ** 2 - v0 ** 2) / (2 * ramp)
+		x = np.arange(n, dtype=np.float64)
+		v_up = np.sqrt(v0 ** 2 + 2 * accel * x)
+		v_down = np.sqrt(v0 ** 2 + 2 * accel * (n - 1 - x))
+		v = np.minimum(v_max, np.minimum(v_up, v_down))
+	else:
+		v = np.full(n, v_max)
+	times = np.zeros(n)
+	np.cumsum(1 / v[:-1], out=times[1:])
+	return MovePlan(phases, times)
+
+
+def plan_angle(angle_deg, direction=1, rpm=10, **kwargs):
+	return plan_move(int(angle_deg / 360 * STEPS_PER_REV), direction, rpm, **kwargs)
+
+
+class Move:
+	def __init__(self, plan, release):
+		self.plan = plan
+		self.release = release
+		self.errors = np.zeros(len(plan))
+		self.executed = 0
+		self.started = None
+		self.finished = None
+		self.cancelled = False
+		self.done = threading.Event()
+
+	def cancel(self):
+		self.cancelled = True
+
+	def wait(self, timeout=None):
+		return self.done.wait(timeout)
+
+	def report(self):
+		err = np.abs(self.errors[:self.executed]) * 1e6
+		elapsed = (self.finished - self.started) if self.finished and self.started else 0
+		return {
+			"phases": self.executed,
+			"planned_s": self.plan.duration,
+			"elapsed_s": elapsed,
+			"rate_pps": self.executed / elapsed if elapsed else 0.0,
+			"mean_err_us": float(err.mean()) if len(err) else 0.0,
+			"p99_err_us": float(np.percentile(err, 99)) if len(err) else 0.0,
+			"max_err_us": float(err.max()) if len(err) else 0.0,
+			"cancelled": self.cancelled,
+		}
+
+
+class MotionController:
+	# spin is how long before each deadline the thread stops sleeping and busy-waits
+	def __init__(self, pins, spin=0.0015):
+		self.pins = pins
+		self.spin = spin
+		self.queue = queue.Queue()
+		self.current = None
+		self.thread = threading.Thread(target=self._run, name="motion", daemon=True)
+		self.thread.start()
+
+	def set_step(self, w1, w2, w3, w4):
+		for pin, value in zip(self.pins, (w1, w2, w3, w4)):
+			pin.value = value
+
+	def move(self, plan, release=False):
+		move = Move(plan, release)
+		self.queue.put(move)
+		return move
+
+	def cancel_all(self):
+		pending = []
+		while True:
+			try:
+				pending.append(self.queue.get_nowait())
+			except queue.Empty:
+				break
+		for move in pending:
+			move.cancel()
+			move.done.set()
+		if self.current is not None:
+			self.current.cancel()
+
+	def close(self):
+		self.cancel_all()
+		self.queue.put(None)
+		self.thread.join(timeout=2)
+
+	def _run(self):
+		while True:
+			move = self.queue.get()
+			if move is None:
+				return
+			self.current = move
+			try:
+				self._execute(move)
+			finally:
+				self.current = None
+				move.done.set()
+
+	def _execute(self, move):
+		phases = move.plan.phases.tolist()
+		times = move.plan.times
+		spin = self.spin
+		start = perf_counter() + 0.001
+		move.started = start
+		for i, phase in enumerate(phases):
+			if move.cancelled:
+				break
+			deadline = start + times[i]
+			remaining = deadline - perf_counter()
+			if remaining > spin:
+				sleep(remaining - spin)
+			while perf_counter() < deadline:
+				pass
+			self.set_step(*phase)
+			move.errors[i] = perf_counter() - deadline
+			move.executed = i + 1
+		move.finished = perf_counter()
+		if move.release:
+			self.set_step(0, 0, 0, 0)
+
+
+class MockPin:
+	def __init__(self):
+		self.value = 0
+
+
+def main():
+	pins = [MockPin() for _ in range(4)]
+	controller = MotionController(pins)
+	for rpm in (5, 10, 15):
+		plan = plan_angle(60, 1, rpm=rpm)
+		move = controller.move(plan)
+		move.wait()
+		r = move.report()
+		print(f"{rpm:>2} RPM: {r['phases']} phases in {r['elapsed_s']:.3f} s (planned {r['planned_s']:.3f} s), "
+			f"{r['rate_pps']:.0f} phases/s, error mean {r['mean_err_us']:.1f} us, "
+			f"p99 {r['p99_err_us']:.1f} us, max {r['max_err_us']:.1f} us")
+
+	move = controller.move(plan_angle(360, 1, rpm=10))
+	sleep(0.5)
+	move.cancel()
+	move.wait()
+	print(f"Cancelled after {move.report()['phases']} of {len(move.plan)} phases")
+
+	# Old path: sleep(delay) per phase with delay = 60 / (rpm * steps)
+	steps = int(60 / 360 * STEPS_PER_REV)
+	delay = 60 / (50 * steps)
+	t0 = perf_counter()
+	for _ in range(steps):
+		for phase in step_sequence_fast.tolist():
+			for pin, value in zip(pins, phase):
+				pin.value = value
+			sleep(delay)
+	elapsed = perf_counter() - t0
+	print(f"sleep-per-phase baseline: {steps * 4} phases in {elapsed:.3f} s "
+		f"(asked for {steps * 4 * delay:.3f} s, {steps * 4 / elapsed:.0f} phases/s)")
+	controller.close()
+
+
+if __name__ == "__main__":
+	main()
@@ -1,35 +1,102 @@
-import serial 
 import json 
-import cv2 
-import subprocess 
-import numpy as np 
-from gpiozero import LED, OutputDevice 
-from time import sleep
+from hardware import LED, OutputDevice, open_serial, open_camera
+from time import sleep, time
 from datetime import datetime 
-from edge_impulse_linux.image import ImageImpulseRunner 
-import paho.mqtt.client as mqtt 
+from sensors import SerialReader
+from framing import FrameDecoder, negotiate_baud
+from governor import Governor
+from scheduler import DoseScheduler, MEDICATION_SCHEDULE
+from outbox import PublishQueue
+from telemetry import TelemetryBatcher, encode_payload
+from metrics import timed, counter, gauge, start_server, HealthPublisher
+from startup import Startup
 import ssl 
+import threading
 
 led = LED(23) 
 SERIAL_PORT = '/dev/ttyACM0' 
 BAUD_RATE = 9600 
+# Startup waits this long for the first reading / the broker's CONNACK
+SERIAL_READY_TIMEOUT = 5
+# "json" lines, or "framed" (framing.py: CRC-checked binary frames, several
+# readings each) at SERIAL_FAST_BAUD if the sketch accepts it
+SERIAL_PROTOCOL = "json"
+SERIAL_FAST_BAUD = 115200
+MQTT_READY_TIMEOUT = 10
 MODEL_PATH = "/home/Shruthigna/Documents/face_recognition-linux-aarch64-v14.eim" 
+# "eim", "onnx", "dnn" or "stub" (backends.py); None goes by the extension.
+# A backend.json written by `python backends.py bench` overrides these.
+MODEL_FORMAT = None
+MODEL_LABELS = None
+MODEL_INPUT_SIZE = (96, 96)
+INFERENCE_THREADS = None
+# Replace the SDK's per-call resize/crop/pack with preallocated buffers (preprocess.py)
+FAST_PREPROCESS = True
+CAMERA_BACKEND = "picamera"
 auth_labels = ["jayne", "areebah", "shruthigna"] # remove unknown from testing later
 confidence_threshold = 0.8 
+MOTION_SENSITIVITY = 0.02
+MOTION_COOLDOWN = 10
+# Loop pacing (governor.py): near-idle far from a dose, up to LOOP_MAX_RATE
+# iterations/s from DOSE_APPROACH seconds before one (MEDICATION_SCHEDULE in
+# scheduler.py) or for ACTIVITY_HOLD seconds after motion. Between paced
+# iterations the newest camera frame is still checked for motion every
+# MOTION_CHECK_INTERVAL seconds, the old fixed pacing, and motion wakes the
+# loop; without the camera engine the loop only looks at LOOP_MIN_RATE.
+LOOP_MIN_RATE = 1 / 30
+LOOP_MAX_RATE = 1.0
+DOSE_APPROACH = 900
+ACTIVITY_HOLD = 60
+MOTION_CHECK_INTERVAL = 3
 AWS_IOT_ENDPOINT = "a9saj11jrwuqo-ats.iot.us-east-2.amazonaws.com" 
 AWS_IOT_PORT = 8883 
 AWS_IOT_TOPIC = "raspi/data" 
 CA_CERT_PATH = 'certs/AmazonRootCA1.pem' 
 CERT_PATH = 'certs/certificate.pem.crt' 
 KEY_PATH = 'certs/private.pem.key' 
+OUTBOX_PATH = "outbox.db"
+# "json" keeps the original payloads, "binary" packs TELEMETRY_BATCH readings
+# per message, or whatever has arrived TELEMETRY_MAX_AGE seconds after the first
+TELEMETRY_FORMAT = "json"
+TELEMETRY_BATCH = 20
+TELEMETRY_MAX_AGE = 60
+SENSOR_TOPIC = "raspi/data/sensors"
+SENSOR_THRESHOLDS = {"temperature": (None, 30), "humidity": (None, 70)}
+METRICS_PORT = 9100
+HEALTH_TOPIC = "raspi/health"
+# When the outbox is full, lower priority messages are evicted first
+OUTBOX_PRIORITIES = {AWS_IOT_TOPIC: 1, SENSOR_TOPIC: 1, HEALTH_TOPIC: 0}
+# Seconds between health messages, None to disable
+HEALTH_INTERVAL = 60
 IN1 = OutputDevice(17)
 IN2 = OutputDevice(27)
 IN3 = OutputDevice(22)
 IN4 = OutputDevice(5)
+motion = None
 
 current_temperature = None 
 current_humidity = None 
 mqtt_connected = False 
+mqtt_ready = threading.Event()
+camera = None
+outbox = None
+telemetry = TelemetryBatcher(max_readings=TELEMETRY_BATCH, max_age=TELEMETRY_MAX_AGE,
+	on_flush=lambda frame: queue_telemetry(frame))
+aggregator = None
+sensor_reader = None
+trigger = None
+dose_scheduler = None
+dose_due_until = None
+governor = Governor(min_rate=LOOP_MIN_RATE, max_rate=LOOP_MAX_RATE, approach=DOSE_APPROACH, hold=ACTIVITY_HOLD,
+	next_event=lambda: seconds_to_dose())
+
+gauge("outbox_depth", "Messages waiting in the outbox", fn=lambda: outbox.depth if outbox else 0)
+counter("outbox_failures_total", "Outbox publishes not acked", fn=lambda: outbox.failures if outbox else 0)
+counter("serial_lines_total", "Lines read from the Arduino", fn=lambda: sensor_reader.lines if sensor_reader else 0)
+counter("serial_errors_total", "Unparseable serial lines", fn=lambda: sensor_reader.errors if sensor_reader else 0)
+publish_failures = counter("publish_failures_total", "Readings dropped or rejected on publish")
+gauge("loop_rate_hz", "Target camera loop rate", fn=lambda: governor.current)
+gauge("loop_cpu_saved_seconds", "CPU seconds saved against fixed 3 s pacing", fn=lambda: governor.stats()["cpu_saved_s"])
 
 #step_sequence = [
 	#[1,0,0,0],
@@ -44,34 +111,60 @@ mqtt_connected = False
 
 
 
-def set_step(w1, w2, w3, w4):
-	IN1.value = w1
-	IN2.value = w2
-	IN3.value = w3
-	IN4.value = w4
+@timed("step_motor")
+def step_motor(steps, direction=1, rpm=None, delay=0.01, wait=True):
+	from motion import plan_move, PHASES_PER_REV
+	if rpm is None:
+		# Fixed per-phase delay, no ramp
+		plan = plan_move(steps, direction, rpm=60 / (delay * PHASES_PER_REV), ramp_steps=0)
+	else:
+		plan = plan_move(steps, direction, rpm=rpm)
+	move = motion.move(plan)
+	if wait:
+		move.wait()
+	return move
 
-def step_motor(steps, direction=1, delay=0.01):
-	for _ in range(steps):
-		for step in (step_sequence if direction > 0 else reversed(step_sequence)):
-			set_step(*step)
-			sleep(delay)
+# 0 while a dose is inside its grace window, else seconds to the next one
+def seconds_to_dose():
+	global dose_scheduler, dose_due_until
+	now = datetime.now()
+	if dose_scheduler is None:
+		dose_scheduler = DoseScheduler(MEDICATION_SCHEDULE, now=now)
+	for dose in dose_scheduler.pop_due(now):
+		dose_due_until = dose.deadline + dose.grace
+	if dose_due_until is not None and now < dose_due_until:
+		return 0.0
+	return dose_scheduler.seconds_until_next(now)
 
 def on_connect(client, userdata, flags, rc): 
 	global mqtt_connected 
 	if rc == 0: 
 		print("Connected to AWS IoT Successfully") 
 		mqtt_connected = True 
+		mqtt_ready.set()
+		if outbox is not None:
+			outbox.notify()
 	else: 
 		print(f"Failed to connect to AWS IoT: {rc}") 
 		mqtt_connected = False 
+		mqtt_ready.set()
 		
+# Without this the flag stays True after the link drops and the outbox
+# keeps handing paho messages to queue
+def on_disconnect(client, userdata, rc):
+	global mqtt_connected
+	mqtt_connected = False
+	print(f"Disconnected from AWS IoT ({rc}), paho will reconnect")
+	
 def on_publish(client, userdata, mid): 
 	print(f"Data published to AWS IoT: {mid}") 
 	
 def setup_aws_iot(): 
+	import paho.mqtt.client as mqtt
 	try: 
 		client = mqtt.Client() 
 		client.on_connect = on_connect 
+		client.on_disconnect = on_disconnect
 		client.on_publish = on_publish 
 		client.tls_set( ca_certs=CA_CERT_PATH, certfile=CERT_PATH, keyfile=KEY_PATH, tls_version=ssl.PROTOCOL_TLSv1_2 ) 
 		client.connect(AWS_IOT_ENDPOINT, AWS_IOT_PORT, 60) 
@@ -81,11 +174,33 @@ def setup_aws_iot():
 		print(f"Error setting up AWS IoT: {e}") 
 		return None 
 		
+def queue_telemetry(payload):
+	if outbox.put(AWS_IOT_TOPIC, payload):
+		print(f"Queued {len(payload)} bytes (outbox depth {outbox.depth})")
+	else:
+		publish_failures.inc()
+		print("Outbox full, dropped publish")
+		
+@timed("publish_to_aws")
 def publish_to_aws(client, label, temperature, humidity): 
+	if outbox is not None:
+		reading = (time(), label, temperature, humidity)
+		if TELEMETRY_FORMAT == "json":
+			payload = encode_payload([reading], "json")
+		else:
+			payload = telemetry.add(reading)
+			if payload is None:
+				print(f"Buffered reading ({len(telemetry.readings)}/{TELEMETRY_BATCH})")
+				return
+		queue_telemetry(payload)
+		return
+		
 	if not client or not mqtt_connected: 
+		publish_failures.inc()
 		print("MQTT not connected, skipping publish") 
 		return 
 		
+	import paho.mqtt.client as mqtt
 	try: 
 		now = datetime.now() 
 		payload = { 
@@ -99,44 +214,133 @@ def publish_to_aws(client, label, temperature, humidity):
 		if result.rc == mqtt.MQTT_ERR_SUCCESS: 
 			print(f"Published: {payload}") 
 		else: 
+			publish_failures.inc()
 			print(f"Error publishing to AWS: {result.rc}") 
 	except Exception as e: 
+		publish_failures.inc()
 		print(f"Exception during publish: {e}") 
 		
+def on_sensor_reading(reading):
+	# Only window summaries and threshold crossings go upstream
+	for event in aggregator.add(now=reading.timestamp, temperature=reading.temperature, humidity=reading.humidity):
+		if event["type"] == "threshold":
+			print(f"Sensor {event['metric']} is {event['state']}: {event['value']}")
+		if outbox is not None:
+			outbox.put(SENSOR_TOPIC, json.dumps(event))
+			
+@timed("capture_frame")
 def capture_frame(filename="/tmp/frame.jpg"): 
+	if camera is not None:
+		return camera.grab()
+	import subprocess
+	import cv2
 	subprocess.run(["rpicam-jpeg", "-o", filename, "-t", "1000"], check=True) 
 	frame = cv2.imread(filename) 
 	return frame 
 	
+def start_monitoring():
+	server = start_server(METRICS_PORT)
+	health = None
+	if HEALTH_INTERVAL:
+		health = HealthPublisher(lambda payload: outbox.put(HEALTH_TOPIC, payload), HEALTH_INTERVAL).start()
+	return server, health
+	
+# numpy (motion, aggregate) and cv2 (activity, backends, preprocess) load
+# here, on startup threads, instead of when the module is imported
+def start_motion():
+	global motion, aggregator
+	from motion import MotionController
+	from aggregate import SensorAggregator
+	motion = MotionController([IN1, IN2, IN3, IN4])
+	aggregator = SensorAggregator(windows=(60, 300), emit_every=60, thresholds=SENSOR_THRESHOLDS)
+	return motion
+	
+def load_trigger():
+	from activity import MotionTrigger
+	return MotionTrigger(sensitivity=MOTION_SENSITIVITY, cooldown=MOTION_COOLDOWN)
+	
+# Frame differencing only, on a frame the camera engine already has; the
+# loop's trigger is told about motion so the woken iteration infers
+def watch_motion(stop):
+	from activity import MotionTrigger
+	watcher = MotionTrigger(sensitivity=MOTION_SENSITIVITY)
+	while not stop.wait(MOTION_CHECK_INTERVAL):
+		frame = camera.latest() if camera is not None else None
+		if frame is not None and watcher.update(frame) >= MOTION_SENSITIVITY:
+			trigger.note_motion()
+			governor.note_activity()
+	
+def open_arduino():
+	global sensor_reader
+	ser = open_serial(SERIAL_PORT, BAUD_RATE) 
+	print("Connected to Arduino") 
+	decoder = None
+	if SERIAL_PROTOCOL == "framed":
+		negotiate_baud(ser, SERIAL_FAST_BAUD)
+		decoder = FrameDecoder()
+	sensor_reader = SerialReader(ser, on_reading=on_sensor_reading, decoder=decoder).start()
+	if sensor_reader.next_reading(timeout=SERIAL_READY_TIMEOUT) is None:
+		print(f"No Arduino reading within {SERIAL_READY_TIMEOUT} s, continuing")
+	return ser
+	
+def connect_aws_iot():
+	client = setup_aws_iot()
+	if client and not mqtt_ready.wait(MQTT_READY_TIMEOUT):
+		print(f"No CONNACK within {MQTT_READY_TIMEOUT} s, continuing; the outbox drains once connected")
+	return client
+	
+def load_runner():
+	from backends import open_configured
+	from preprocess import install as install_preprocessor
+	runner = open_configured(MODEL_PATH, MODEL_FORMAT, labels=MODEL_LABELS, size=MODEL_INPUT_SIZE, threads=INFERENCE_THREADS)
+	model_info = runner.init() 
+	if FAST_PREPROCESS and getattr(runner, "packed_features", True):
+		install_preprocessor(runner, model_info)
+	runner.get_features_from_image = timed("get_features_from_image")(runner.get_features_from_image)
+	runner.classify = timed("classify")(runner.classify)
+	labels = model_info['model_parameters']['labels'] 
+	width = model_info['model_parameters']['image_input_width'] 
+	height = model_info['model_parameters']['image_input_height'] 
+	print(f"Model loaded, labels: {labels}, width: {width}, height: {height}") 
+	return runner, model_info
+	
+def start_camera(loaded):
+	width = loaded[1]['model_parameters']['image_input_width']
+	height = loaded[1]['model_parameters']['image_input_height']
+	return open_camera(CAMERA_BACKEND, width, height)
+	
 def main(): 
-	global current_temperature, current_humidity 
+	global current_temperature, current_humidity, camera, sensor_reader, outbox, trigger 
 	ser = None
 	detected_label = "unknown" 
+	last_reading = None
 	
-	try: 
-		ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) 
-		print("Connected to Arduino") 
-		sleep(2) 
-		ser.reset_input_buffer() 
-	except serial.SerialException as e: 
-		print(f"Arduino connection error: {e}") 
-		ser = None 
-		
-	mqtt_client = setup_aws_iot() 
-		
-	if mqtt_client: 
-		print("AWS IoT Client Initialized") 
-		sleep(5) 
-	else: 
-		print("Running without AWS IoT") 
+	startup = Startup()
+	startup.add("motion", start_motion, required=True)
+	# Readings go through the aggregator, so the reader starts after it
+	startup.add("serial", lambda _: open_arduino(), after=["motion"])
+	startup.add("mqtt", connect_aws_iot)
+	startup.add("runner", load_runner, required=True)
+	startup.add("camera", start_camera, after=["runner"])
+	startup.add("trigger", load_trigger, required=True)
+	startup.run()
+	startup.report()
+	startup.result("motion")
+	trigger = startup.result("trigger")
+	ser = startup.result("serial")
+	mqtt_client = startup.result("mqtt")
+	camera = startup.result("camera")
+	runner, model_info = startup.result("runner")
+	outbox = PublishQueue(mqtt_client, OUTBOX_PATH, is_connected=lambda: mqtt_connected, priorities=OUTBOX_PRIORITIES).start()
+	metrics_server, health = start_monitoring()
+	print("AWS IoT Client Initialized" if mqtt_client else "Running without AWS IoT")
+	watching = threading.Event()
+	if camera is None:
+		print("Camera engine unavailable, falling back to rpicam-jpeg")
+	else:
+		threading.Thread(target=watch_motion, args=(watching,), name="motion-watch", daemon=True).start()
 			
-	with ImageImpulseRunner(MODEL_PATH) as runner: 
-		model_info = runner.init() 
-		labels = model_info['model_parameters']['labels'] 
-		width = model_info['model_parameters']['image_input_width'] 
-		height = model_info['model_parameters']['image_input_height'] 
-		print(f"Model loaded, labels: {labels}, width: {width}, height: {height}") 
-		
+	with runner: 
 		try: 
 			iteration = 0
 			while True: 
@@ -145,75 +349,84 @@ def main():
 				
 				arduino_data_received = False
 				
-				for _ in range(5):
-					if ser and ser.in_waiting > 0: 
-						line = ser.readline().decode('utf-8').strip() 
-						if line: 
-							try: 
-								data = json.loads(line) 
-								current_temperature = data.get("temperature") 
-								current_humidity = data.get("humidity") 
-								print(f"\nTemperature: {current_temperature}°C, Humidity: {current_humidity}%") 
-								arduino_data_received = True
-								break
-							except json.JSONDecodeError: 
-								print(f"Invalid JSON: {line}") 
-								
-					sleep(0.2)
+				reading = sensor_reader.latest() if sensor_reader else None
+				if reading is not None and reading is not last_reading:
+					last_reading = reading
+					current_temperature = reading.temperature
+					current_humidity = reading.humidity
+					print(f"\nTemperature: {current_temperature}°C, Humidity: {current_humidity}%") 
+					arduino_data_received = True
 					
-					if not arduino_data_received:
-						print("No new Arduino data received this cycle")
-						
-					if iteration % 2 == 0:		
-						print("\nChecking face recognition...") 
-						frame = capture_frame() 
-						if frame is None: 
-							print("Failed to capture frame") 
-							sleep(2) 
-							continue 
-							
-						features, cropped = runner.get_features_from_image(frame) 
-						result = runner.classify(features) 
+				if not arduino_data_received:
+					print("No new Arduino data received this cycle")
+					
+				frame = capture_frame() 
+				if frame is None: 
+					print("Failed to capture frame") 
+					sleep(2) 
+					continue 
+					
+				if trigger.should_infer(frame):
+					print("\nChecking face recognition...") 
+					trigger.record_inference()
+					governor.note_activity()
+					features, cropped = runner.get_features_from_image(frame) 
+					result = runner.classify(features) 
+					
+					if isinstance(result, dict) and "result" in result and "classification" in result["result"]:
+						scores = result["result"]["classification"] 
+						label = max(scores, key=scores.get) 
+						confidence = scores[label] 
+						print(f"Detected: {label} (confidence: {confidence:.2%})") 
 						
-						if isinstance(result, dict) and "result" in result and "classification" in result["result"]:
-							scores = result["result"]["classification"] 
-							label = max(scores, key=scores.get) 
-							confidence = scores[label] 
-							print(f"Detected: {label} (confidence: {confidence:.2%})") 
-							
-							if label in auth_labels and confidence >= confidence_threshold: 
-								print("Authorized User") 
-								led.on()
-								step_motor(512,1) 
-								detected_label = label 
-							else: 
-								print("Unauthorized User") 
-								led.off() 
-								detected_label = "unknown" 
+						if label in auth_labels and confidence >= confidence_threshold: 
+							print("Authorized User") 
+							led.on()
+							step_motor(512,1) 
+							detected_label = label 
 						else: 
-							print("Invalid Model Output", result) 
+							print("Unauthorized User") 
 							led.off() 
-							detected_label = "unknown"
-							
-						if current_temperature is not None and current_humidity is not None: 
-							print("Publishing to AWS")
-							publish_to_aws(mqtt_client, detected_label, current_temperature, current_humidity) 
-						else: 
-							print("No sensor data available yet") 
-							
-					else:
-						print("Skipping facial recognition this cycle")
+							detected_label = "unknown" 
+					else: 
+						print("Invalid Model Output", result) 
+						led.off() 
+						detected_label = "unknown"
+						
+					if current_temperature is not None and current_humidity is not None: 
+						print("Publishing to AWS")
+						publish_to_aws(mqtt_client, detected_label, current_temperature, current_humidity) 
+					else: 
+						print("No sensor data available yet") 
 						
-					now = datetime.now() 
-					print(f"Datetime: {now}") 
-					iteration += 1
-					sleep(3) 
+				else:
+					print("No motion, skipping facial recognition this cycle")
 					
+				now = datetime.now() 
+				print(f"Datetime: {now}, inferences/min: {trigger.inferences_per_minute()}, loop rate: {governor.current:.3f}/s") 
+				iteration += 1
+				governor.pace()
+				
 		except KeyboardInterrupt: 
 			print("\nExiting...") 
+			print(f"Loop pacing: {governor.stats()}")
 			led.off() 
+			watching.set()
+			if camera:
+				camera.stop()
+			if sensor_reader:
+				sensor_reader.stop()
 			if ser: 
 				ser.close() 
+			if health:
+				health.stop()
+			if metrics_server:
+				metrics_server.stop()
+			if outbox:
+				frame = telemetry.flush()
+				if frame:
+					outbox.put(AWS_IOT_TOPIC, frame)
+				outbox.stop()
 			if mqtt_client: 
 				mqtt_client.loop_stop() 
 				mqtt_client.disconnect() 
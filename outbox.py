@@ -0,0 +1,311 @@
+import os
+import sqlite3
+import threading
+from collections import deque
+from time import sleep, monotonic, time
+
+# Store-and-forward publishing: messages are written to a local SQLite queue
+# first and a drain thread publishes them in rate-limited batches whenever
+# the MQTT link is up, deleting each batch only after the broker acks it.
+# Each message has a priority (per topic via priorities, or per put) so that
+# when the queue is full, routine telemetry is evicted before dispense
+# records.
+#
+# paho keeps an unacked qos>=1 publish in its own queue and resends it after a
+# reconnect, so a row whose ack timed out is not published again; the drain
+# waits on the same message instead. Only one still unacked RESEND_AFTER
+# seconds later is handed over again.
+
+OUTBOX_PATH = "outbox.db"
+MQTT_ERR_SUCCESS = 0
+RESEND_AFTER = 300
+
+
+class PublishQueue:
+	# drop_policy when the queue is full: "oldest" evicts the oldest message
+	# of the lowest priority present, as long as that is not above the new
+	# message's (otherwise the new one is rejected), "newest" rejects the new
+	# message, "block" waits for room (backpressure). priorities maps topic to
+	# priority, higher is kept longer; unlisted topics are 0.
+	def __init__(self, client=None, path=OUTBOX_PATH, is_connected=None, max_depth=10000,
+		drop_policy="oldest", batch=20, rate=20.0, ack_timeout=5.0, priorities=None):
+		self.client = client
+		self.is_connected = is_connected or (lambda: client is not None)
+		self.max_depth = max_depth
+		self.drop_policy = drop_policy
+		self.priorities = priorities or {}
+		self.batch = batch
+		self.rate = rate
+		self.ack_timeout = ack_timeout
+		self.lock = threading.Lock()
+		self.space = threading.Condition(self.lock)
+		self.wakeup = threading.Event()
+		self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("PRAGMA synchronous=NORMAL")
+		self.conn.execute(
+			"CREATE TABLE IF NOT EXISTS outbox ("
+			"id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, payload BLOB NOT NULL, "
+			"qos INTEGER NOT NULL, created REAL NOT NULL, priority INTEGER NOT NULL DEFAULT 0)"
+		)
+		columns = [row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")]
+		if "priority" not in columns:
+			self.conn.execute("ALTER TABLE outbox ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+		self.conn.execute("CREATE INDEX IF NOT EXISTS outbox_priority ON outbox (priority, id)")
+		self.depth = self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+		self.enqueued = 0
+		self.published = 0
+		self.dropped = 0
+		self.failures = 0
+		self.sent_times = deque(maxlen=1000)
+		self.last_drain = None
+		# row id -> (message info, when it was handed to the client)
+		self.inflight = {}
+		self.running = False
+		self.thread = None
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.running = False
+		self.wakeup.set()
+		if self.thread is not None:
+			self.thread.join(timeout=self.ack_timeout + 1)
+		with self.lock:
+			self.conn.close()
+
+	# The caller's flag (kept by on_connect/on_disconnect) and, where the
+	# client has one, its own view of the link
+	def online(self):
+		if self.client is None or not self.is_connected():
+			return False
+		check = getattr(self.client, "is_connected", None)
+		return check() if callable(check) else True
+
+	# Call when the link comes back so the drain starts immediately
+	def notify(self):
+		self.wakeup.set()
+
+	# created is wall-clock time, so it still means something after a reboot
+	def put(self, topic, payload, qos=1, timeout=None, priority=None):
+		if isinstance(payload, str):
+			payload = payload.encode()
+		if priority is None:
+			priority = self.priorities.get(topic, 0)
+		with self.space:
+			if self.depth >= self.max_depth:
+				if self.drop_policy == "newest":
+					self.dropped += 1
+					return False
+				if self.drop_policy == "block":
+					if not self.space.wait_for(lambda: self.depth < self.max_depth, timeout):
+						self.dropped += 1
+						return False
+				else:
+					victim = self.conn.execute("SELECT id FROM outbox WHERE priority <= ? ORDER BY priority, id LIMIT 1",
+						(priority,)).fetchone()
+					self.dropped += 1
+					if victim is None:
+						return False
+					self.conn.execute("DELETE FROM outbox WHERE id = ?", victim)
+					self.inflight.pop(victim[0], None)
+					self.depth -= 1
+			self.conn.execute("INSERT INTO outbox (topic, payload, qos, created, priority) VALUES (?, ?, ?, ?, ?)",
+				(topic, payload, qos, time(), priority))
+			self.depth += 1
+			self.enqueued += 1
+		self.wakeup.set()
+		return True
+
+	def _fetch(self):
+		with self.lock:
+			return self.conn.execute("SELECT id, topic, payload, qos FROM outbox ORDER BY id LIMIT ?",
+				(self.batch,)).fetchall()
+
+	def _ack(self, ids):
+		with self.space:
+			# Rows put() evicted while the batch was in flight are already gone
+			deleted = self.conn.execute(f"DELETE FROM outbox WHERE id IN ({','.join('?' * len(ids))})", ids).rowcount
+			for row_id in ids:
+				self.inflight.pop(row_id, None)
+			self.depth -= deleted
+			self.published += len(ids)
+			self.space.notify_all()
+
+	def _publish_batch(self, rows):
+		interval = 1 / self.rate if self.rate else 0
+		pending = []
+		for row_id, topic, payload, qos in rows:
+			if not self.running or not self.online():
+				break
+			sent = self.inflight.get(row_id)
+			if sent is not None and monotonic() - sent[1] < RESEND_AFTER:
+				# Still queued in the client from an earlier attempt
+				pending.append((row_id, sent[0]))
+				continue
+			info = self.client.publish(topic, payload=payload, qos=qos, retain=False)
+			if info.rc != MQTT_ERR_SUCCESS:
+				self.failures += 1
+				break
+			if qos:
+				with self.lock:
+					self.inflight[row_id] = (info, monotonic())
+			pending.append((row_id, info))
+			self.sent_times.append(monotonic())
+			if interval:
+				sleep(interval)
+		acked = []
+		for row_id, info in pending:
+			try:
+				info.wait_for_publish(self.ack_timeout)
+			except (RuntimeError, ValueError):
+				pass
+			if info.is_published():
+				acked.append(row_id)
+			else:
+				self.failures += 1
+		if acked:
+			self._ack(acked)
+		return len(acked) == len(rows)
+
+	def _run(self):
+		while self.running:
+			if not self.online() or self.depth == 0:
+				self.wakeup.wait(1.0)
+				self.wakeup.clear()
+				continue
+			drain_start = monotonic()
+			while self.running and self.depth and self.online():
+				rows = self._fetch()
+				if not rows or not self._publish_batch(rows):
+					sleep(0.5)
+					break
+			if self.depth == 0:
+				self.last_drain = monotonic() - drain_start
+
+	def throughput(self):
+		times = self.sent_times
+		if len(times) < 2 or times[-1] == times[0]:
+			return 0.0
+		return (len(times) - 1) / (times[-1] - times[0])
+
+	def stats(self):
+		return {
+			"depth": self.depth,
+			"enqueued": self.enqueued,
+			"published": self.published,
+			"dropped": self.dropped,
+			"failures": self.failures,
+			"publish_rate": self.throughput(),
+			"last_drain_s": self.last_drain,
+		}
+
+
+class FakeMessageInfo:
+	def __init__(self, rc, published):
+		self.rc = rc
+		self.published = published
+
+	def wait_for_publish(self, timeout=None):
+		return None
+
+	def is_published(self):
+		return self.published
+
+
+class FakeClient:
+	# In-process broker stand-in with a switchable link and per-publish latency
+	def __init__(self, connected=True, latency=0.0):
+		self.connected = connected
+		self.latency = latency
+		self.messages = []
+
+	def publish(self, topic, payload=None, qos=0, retain=False):
+		if not self.connected:
+			return FakeMessageInfo(4, False)
+		if self.latency:
+			sleep(self.latency)
+		self.messages.append((topic, payload))
+		return FakeMessageInfo(MQTT_ERR_SUCCESS, True)
+
+
+def main():
+	import tempfile
+	import json
+
+	path = os.path.join(tempfile.mkdtemp(), "outbox.db")
+	client = FakeClient(connected=False, latency=0.0005)
+	queue = PublishQueue(client, path, is_connected=lambda: client.connected, batch=50, rate=0).start()
+
+	n = 5000
+	t0 = monotonic()
+	for i in range(n):
+		queue.put("raspi/data", json.dumps({"Person": "jayne", "Temperature": 22.5, "Humidity": 41.0, "Seq": i}))
+	enqueue = monotonic() - t0
+	print(f"Offline: queued {queue.depth} messages at {n / enqueue:,.0f} msg/s")
+
+	sleep(1.5)
+	client.connected = True
+	queue.notify()
+	t0 = monotonic()
+	while queue.depth:
+		sleep(0.01)
+	drain = monotonic() - t0
+	print(f"Link up: drained {len(client.messages)} messages in {drain:.2f} s ({len(client.messages) / drain:,.0f} msg/s)")
+	print(queue.stats())
+	queue.stop()
+
+	# Long outage on a small queue: sensor summaries crowd in behind a few
+	# dispense records, and eviction takes the summaries first
+	path = os.path.join(tempfile.mkdtemp(), "outbox.db")
+	queue = PublishQueue(None, path, max_depth=100, priorities={"raspi/data": 2, "raspi/data/sensors": 1})
+	for i in range(1000):
+		if i % 100 == 0:
+			queue.put("raspi/data", json.dumps({"Person": "jayne", "Seq": i}))
+		queue.put("raspi/data/sensors", json.dumps({"type": "window", "Seq": i}))
+	kept = queue.conn.execute("SELECT topic, COUNT(*) FROM outbox GROUP BY topic").fetchall()
+	print(f"Full queue after 1010 puts: {dict(kept)} kept, {queue.dropped} evicted, depth {queue.depth}")
+	queue.stop()
+
+	# Like paho, this client accepts qos=1 publishes while the link is down
+	# and sends them on reconnect. Even with a connected flag that missed the
+	# drop, the drain's retries must not queue extra copies.
+	class QueueingClient(FakeClient):
+		def __init__(self):
+			super().__init__(connected=False)
+			self.held = []
+
+		def publish(self, topic, payload=None, qos=0, retain=False):
+			if self.connected:
+				return super().publish(topic, payload, qos, retain)
+			info = FakeMessageInfo(MQTT_ERR_SUCCESS, False)
+			self.held.append((topic, payload, info))
+			return info
+
+		def reconnect(self):
+			self.connected = True
+			for topic, payload, info in self.held:
+				self.messages.append((topic, payload))
+				info.published = True
+			self.held = []
+
+	client = QueueingClient()
+	path = os.path.join(tempfile.mkdtemp(), "outbox.db")
+	queue = PublishQueue(client, path, is_connected=lambda: True, rate=0, ack_timeout=0.05).start()
+	for i in range(3):
+		queue.put("raspi/data", json.dumps({"Seq": i}))
+	sleep(1.5)
+	client.reconnect()
+	queue.notify()
+	while queue.depth:
+		sleep(0.01)
+	queue.stop()
+	assert len(client.messages) == 3, f"{len(client.messages)} copies of 3 messages delivered"
+
+
+if __name__ == "__main__":
+	main()
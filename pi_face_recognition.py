@@ -1,7 +1,6 @@
 import cv2
 from time import sleep
-from gpiozero import LED
-from edge_impulse_linux.image import ImageImpulseRunner
+from hardware import LED, ImageImpulseRunner
 
 MODEL_PATH = "model.eim"
 
@@ -14,9 +13,6 @@ led = LED(23)
 #GPIO.setup(SERVO_PIN, GPIO.OUT)
 #servo = GPIO.PWM(SERVO_PIN, 50)
 #servo.start(0)
-led.on()
-sleep(1)
-led.off()
 
 
 def unlock_servo():
@@ -35,6 +31,9 @@ def deny_access():
 	led.off()
 
 def main():
+	led.on()
+	sleep(1)
+	led.off()
 	with ImageImpulseRunner(MODEL_PATH) as runner:
 		model_info = runner.init()
 		labels = model_info['model_parameters']['labels']
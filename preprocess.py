@@ -0,0 +1,152 @@
+import sys
+import math
+import numpy as np
+import cv2
+
+# Fast path for runner.get_features_from_image. Produces the same packed
+# features the Edge Impulse SDK does ((r << 16) + (g << 8) + b per pixel
+# after an aspect-preserving resize and crop) but into buffers allocated once
+# per input size: resize writes into a preallocated image, the crop is a
+# view, and packing is one cvtColor into a 4-byte-per-pixel buffer that is
+# read back as uint32 (little-endian). Frames that already arrive at model
+# resolution skip the resize entirely.
+
+LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+# Same resize/crop as edge_impulse_linux.image.ImageImpulseRunner.get_features_from_image
+def reference_features(img, width, height, grayscale=False):
+	features = []
+	factor = max(width / img.shape[1], height / img.shape[0])
+	rw = int(math.ceil(factor * img.shape[1]))
+	rh = int(math.ceil(factor * img.shape[0]))
+	resized = cv2.resize(img, (rw, rh), interpolation=cv2.INTER_AREA)
+	crop_x = int((rw - width) / 2)
+	crop_y = int((rh - rw) / 2) if rh > rw else 0
+	cropped = resized[crop_y:crop_y + height, crop_x:crop_x + width]
+	if grayscale:
+		cropped = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
+		for p in np.array(cropped).flatten().tolist():
+			features.append((p << 16) + (p << 8) + p)
+	else:
+		pixels = np.array(cropped).flatten().tolist()
+		for ix in range(0, len(pixels), 3):
+			features.append((pixels[ix] << 16) + (pixels[ix + 1] << 8) + pixels[ix + 2])
+	return features, cropped
+
+
+class Preprocessor:
+	# swap_rb packs channel 2 as the high byte, for BGR frames into a model
+	# trained on RGB. Returned arrays are views into reused buffers and are
+	# only valid until the next call.
+	def __init__(self, width, height, grayscale=False, swap_rb=False):
+		self.width = width
+		self.height = height
+		self.grayscale = grayscale
+		self.swap_rb = swap_rb
+		self.shape = None
+		self.packed = np.zeros((height, width, 4), dtype=np.uint8)
+		self.words = self.packed.view(np.uint32).reshape(-1)
+		self.gray = np.empty((height, width), dtype=np.uint8)
+		self.norm = np.empty((height, width, 1 if grayscale else 3), dtype=np.float32)
+		self.resized = None
+
+	def _layout(self, shape):
+		h, w = shape[:2]
+		factor = max(self.width / w, self.height / h)
+		rw = int(math.ceil(factor * w))
+		rh = int(math.ceil(factor * h))
+		self.crop_x = int((rw - self.width) / 2)
+		self.crop_y = int((rh - rw) / 2) if rh > rw else 0
+		self.resize_to = None if (rw, rh) == (w, h) else (rw, rh)
+		self.resized = np.empty((rh, rw, 3), dtype=np.uint8) if self.resize_to else None
+		self.shape = shape
+
+	def crop(self, img):
+		if img.shape != self.shape:
+			self._layout(img.shape)
+		if self.resize_to is not None:
+			cv2.resize(img, self.resize_to, dst=self.resized, interpolation=cv2.INTER_AREA)
+			img = self.resized
+		return img[self.crop_y:self.crop_y + self.height, self.crop_x:self.crop_x + self.width]
+
+	def features(self, img):
+		cropped = self.crop(img)
+		if self.grayscale:
+			cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY, dst=self.gray)
+			np.multiply(self.gray, 0x010101, out=self.words.reshape(self.height, self.width), dtype=np.uint32)
+		elif LITTLE_ENDIAN:
+			# Bytes b0..b3 of each uint32 are (low, mid, high, 0)
+			code = cv2.COLOR_BGR2BGRA if self.swap_rb else cv2.COLOR_RGB2BGRA
+			cv2.cvtColor(cropped, code, dst=self.packed)
+			self.packed[..., 3] = 0
+		else:
+			hi, lo = (2, 0) if self.swap_rb else (0, 2)
+			out = self.words.reshape(self.height, self.width)
+			np.left_shift(cropped[..., hi], 16, out=out, dtype=np.uint32)
+			out |= cropped[..., 1].astype(np.uint32) << 8
+			out |= cropped[..., lo]
+		return self.words, cropped
+
+	# Float input in [0, 1] for OpenCV DNN / ONNX style models (HWC)
+	def normalized(self, img, scale=1 / 255.0):
+		return self.normalize_cropped(self.crop(img), scale)
+
+	def normalize_cropped(self, cropped, scale=1 / 255.0):
+		if self.grayscale:
+			cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY, dst=self.gray)
+			cropped = self.gray[..., None]
+		elif self.swap_rb:
+			cropped = cropped[..., ::-1]
+		np.multiply(cropped, scale, out=self.norm, dtype=np.float32)
+		return self.norm
+
+	# Drop-in for runner.get_features_from_image; the .eim socket protocol
+	# needs a JSON list, so as_list converts once at the end
+	def get_features_from_image(self, img, as_list=True):
+		words, cropped = self.features(img)
+		return (words.tolist() if as_list else words), cropped
+
+
+def install(runner, model_info, **kwargs):
+	params = model_info["model_parameters"]
+	pre = Preprocessor(params["image_input_width"], params["image_input_height"],
+		grayscale=params.get("image_channel_count", 3) == 1, **kwargs)
+	runner.get_features_from_image = pre.get_features_from_image
+	return pre
+
+
+def measure(fn, frame, n):
+	import tracemalloc
+	from time import perf_counter
+	fn(frame)
+	tracemalloc.start()
+	fn(frame)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	t0 = perf_counter()
+	for _ in range(n):
+		fn(frame)
+	return (perf_counter() - t0) / n, peak
+
+
+def main():
+	rng = np.random.default_rng(0)
+	width = height = 96
+	for shape in ((480, 640, 3), (120, 160, 3), (96, 96, 3)):
+		frame = rng.integers(0, 256, shape, dtype=np.uint8)
+		pre = Preprocessor(width, height)
+		expected, _ = reference_features(frame, width, height)
+		assert pre.get_features_from_image(frame)[0] == expected
+		print(f"{shape[1]}x{shape[0]} -> {width}x{height}")
+		for name, fn, n in (
+			("sdk path", lambda f: reference_features(f, width, height), 20),
+			("fast, list", pre.get_features_from_image, 200),
+			("fast, array", lambda f: pre.features(f), 2000),
+		):
+			per, peak = measure(fn, frame, n)
+			print(f"  {name:<12} {per * 1000:7.3f} ms/frame, {peak / 1024:8.1f} KiB allocated per frame")
+
+
+if __name__ == "__main__":
+	main()
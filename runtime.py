@@ -0,0 +1,315 @@
+import asyncio
+import heapq
+import concurrent.futures
+import itertools
+from datetime import datetime, timedelta
+from time import monotonic, perf_counter
+
+# Cooperative runtime for the dispenser: schedule checks, serial ingestion,
+# recognition, MQTT publishing and actuator control run as asyncio tasks so a
+# wait in one never blocks the others. Blocking hardware and inference calls
+# go to the default executor. An exception inside one iteration is logged and
+# counted, and that task carries on with the next one.
+
+
+class RealClock:
+	fake = False
+
+	def now(self):
+		return monotonic()
+
+	def wall(self):
+		return datetime.now()
+
+	async def sleep(self, seconds):
+		await asyncio.sleep(max(0, seconds))
+
+
+class FakeClock:
+	# Virtual time only moves forward once every task is parked on sleep(),
+	# so a simulated day runs in a few seconds of wall time.
+	fake = True
+
+	def __init__(self, start=None):
+		self.t = 0.0
+		self.start = start or datetime(2026, 1, 1)
+		self.sleepers = []
+		self.seq = itertools.count()
+
+	def now(self):
+		return self.t
+
+	def wall(self):
+		return self.start + timedelta(seconds=self.t)
+
+	async def sleep(self, seconds):
+		future = asyncio.get_running_loop().create_future()
+		heapq.heappush(self.sleepers, (self.t + max(0, seconds), next(self.seq), future))
+		await future
+
+	# until=None keeps driving, like the real clock does
+	async def drive(self, until=None):
+		while until is None or self.t < until:
+			for _ in range(10):
+				await asyncio.sleep(0)
+			if not self.sleepers:
+				continue
+			self.t = max(self.t, self.sleepers[0][0])
+			while self.sleepers and self.sleepers[0][0] <= self.t:
+				_, _, future = heapq.heappop(self.sleepers)
+				if not future.done():
+					future.set_result(None)
+
+
+class DispenserRuntime:
+	# alert(date, person, slot) runs at the start of every recognition round
+	# of a dose, so it decides itself whether to sound again
+	def __init__(self, clock, check_due, read_sensor, recognize, publish, dispense,
+		alert=None, already_dispensed=None, record_dispense=None, next_check=None,
+		check_interval=1.0, sensor_interval=5.0, max_attempts=5, retry_delay=1.0):
+		self.clock = clock
+		self.check_due = check_due
+		self.read_sensor = read_sensor
+		self.recognize = recognize
+		self.publish = publish
+		self.dispense = dispense
+		self.alert = alert
+		self.already_dispensed = already_dispensed or (lambda person, slot, date: False)
+		self.record_dispense = record_dispense or (lambda date, person, slot: None)
+		self.check_interval = check_interval
+		self.next_check = next_check
+		self.sensor_interval = sensor_interval
+		self.max_attempts = max_attempts
+		self.retry_delay = retry_delay
+		self.temperature = None
+		self.humidity = None
+		self.pending = set()
+		self.latencies = []
+		self.errors = 0
+		self.tasks = []
+
+	def failed(self, what, e):
+		self.errors += 1
+		print(f"{what} failed: {e!r}")
+
+	async def offload(self, func, *args):
+		# Under the fake clock everything runs inline so time stays deterministic
+		if self.clock.fake:
+			return func(*args)
+		return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+	# Safe to call from paho's network thread. The future resolves once the
+	# command has run, for a dispense when the motor has stopped.
+	def submit_command(self, loop, action):
+		done = concurrent.futures.Future()
+		loop.call_soon_threadsafe(self.commands.put_nowait, (action, done))
+		return done
+
+	async def schedule_task(self):
+		while True:
+			wait = self.check_interval
+			try:
+				due = self.check_due(self.clock.wall())
+				if due and due[0]:
+					person, slot, date = due
+					key = (date, person, slot)
+					if key not in self.pending and not self.already_dispensed(person, slot, date):
+						self.pending.add(key)
+						await self.doses.put((key, self.clock.now()))
+				# Sleep until the next deadline when the schedule can tell us
+				if self.next_check:
+					wait = self.next_check(self.clock.wall())
+			except Exception as e:
+				self.failed("Schedule check", e)
+			await self.clock.sleep(wait)
+
+	async def serial_task(self):
+		while True:
+			try:
+				temperature, humidity = await self.offload(self.read_sensor)
+				if temperature is not None and humidity is not None:
+					self.temperature, self.humidity = temperature, humidity
+			except Exception as e:
+				self.failed("Sensor read", e)
+			await self.clock.sleep(self.sensor_interval)
+
+	async def recognition_task(self):
+		while True:
+			key, due_at = await self.doses.get()
+			date, person, slot = key
+			print(f"Medication Time for {person}")
+			if self.alert:
+				await self.actions.put(("alert", key, None))
+			recognized = False
+			for attempt in range(self.max_attempts):
+				try:
+					label, confidence = await self.offload(self.recognize, person)
+				except Exception as e:
+					# A failed capture or classify costs one attempt
+					self.failed("Recognition", e)
+					label = None
+				if label == person:
+					recognized = True
+					break
+				await self.clock.sleep(self.retry_delay)
+			if recognized:
+				await self.actions.put(("dispense", (key, due_at), None))
+				temperature = self.temperature if self.temperature is not None else 25.0
+				humidity = self.humidity if self.humidity is not None else 25.0
+				await self.outbox.put((person, temperature, humidity))
+			else:
+				print(f"Failed to recognize {person} after {self.max_attempts} attempts")
+				self.pending.discard(key)
+
+	async def command_task(self):
+		while True:
+			action, done = await self.commands.get()
+			if action == "dispense":
+				print("Dispense Command Received")
+				await self.actions.put(("dispense", None, done))
+			else:
+				print("No Dispense. Medication may not be in good condition.")
+				done.set_result(None)
+
+	async def actuator_task(self):
+		while True:
+			kind, info, done = await self.actions.get()
+			try:
+				if kind == "alert":
+					await self.offload(self.alert, *info)
+				elif kind == "dispense":
+					await self.offload(self.dispense)
+					if info is not None:
+						(date, person, slot), due_at = info
+						self.record_dispense(date, person, slot)
+						self.pending.discard((date, person, slot))
+						self.latencies.append(self.clock.now() - due_at)
+			except Exception as e:
+				self.failed(f"Actuator {kind}", e)
+				if kind == "dispense" and info is not None:
+					# Not recorded, so the schedule can offer the dose again
+					self.pending.discard(info[0])
+				if done is not None:
+					done.set_exception(e)
+				continue
+			if done is not None:
+				done.set_result(None)
+
+	async def mqtt_task(self):
+		while True:
+			person, temperature, humidity = await self.outbox.get()
+			try:
+				await self.offload(self.publish, person, temperature, humidity)
+			except Exception as e:
+				self.failed("Publish", e)
+
+	def start(self):
+		self.doses = asyncio.Queue()
+		self.actions = asyncio.Queue()
+		self.outbox = asyncio.Queue()
+		self.commands = asyncio.Queue()
+		workers = [self.schedule_task, self.serial_task, self.recognition_task,
+			self.command_task, self.actuator_task, self.mqtt_task]
+		self.tasks = [asyncio.create_task(w()) for w in workers]
+
+	async def stop(self):
+		for task in self.tasks:
+			task.cancel()
+		await asyncio.gather(*self.tasks, return_exceptions=True)
+
+	async def run(self, duration=None):
+		self.start()
+		try:
+			if self.clock.fake:
+				await self.clock.drive(duration)
+			elif duration is None:
+				await asyncio.gather(*self.tasks)
+			else:
+				await asyncio.sleep(duration)
+		finally:
+			await self.stop()
+
+
+def simulate(days=1, doses_per_day=48, check_interval=1.0):
+	# Benchmarks the loop under a fake clock with no hardware attached
+	clock = FakeClock()
+	times = [(i * 86400 // doses_per_day) + 17.5 for i in range(doses_per_day)]
+	dispensed = set()
+	latencies = []
+
+	def record_dispense(date, person, slot):
+		dispensed.add((date, person, slot))
+		latencies.append(clock.now() - (date * 86400 + slot))
+
+	def check_due(now):
+		t = (now - clock.start).total_seconds()
+		day = int(t // 86400)
+		for due in times:
+			if 0 <= t - (day * 86400 + due) < 60:
+				return "patient", due, day
+		return None
+
+	runtime = DispenserRuntime(
+		clock,
+		check_due=check_due,
+		read_sensor=lambda: (22.0, 40.0),
+		recognize=lambda person: (person, 0.95),
+		publish=lambda *args: None,
+		dispense=lambda: None,
+		already_dispensed=lambda person, slot, date: (date, person, slot) in dispensed,
+		record_dispense=record_dispense,
+		check_interval=check_interval,
+	)
+	start = perf_counter()
+	asyncio.run(runtime.run(days * 86400))
+	elapsed = perf_counter() - start
+	return latencies, elapsed
+
+
+# A command's future must not resolve before its dispense has finished
+def check_command_done():
+	import threading
+	from time import sleep
+	finished = []
+
+	def dispense():
+		sleep(0.2)
+		finished.append(monotonic())
+
+	runtime = DispenserRuntime(RealClock(), check_due=lambda now: None, read_sensor=lambda: (None, None),
+		recognize=lambda person: (None, 0.0), publish=lambda *args: None, dispense=dispense,
+		already_dispensed=lambda *args: False, record_dispense=lambda *args: None)
+	loop = asyncio.new_event_loop()
+	thread = threading.Thread(target=loop.run_until_complete, args=(runtime.run(1.0),), daemon=True)
+	thread.start()
+	while not runtime.tasks:
+		sleep(0.01)
+	done = runtime.submit_command(loop, "dispense")
+	done.result(5)
+	assert finished, "command acked before the dispense ran"
+	thread.join()
+	loop.close()
+
+
+# drive() without an end must run like the real clock instead of raising
+def check_open_ended():
+	async def go():
+		clock = FakeClock()
+		driver = asyncio.ensure_future(clock.drive())
+		await clock.sleep(5)
+		driver.cancel()
+		return clock.t
+	assert asyncio.run(go()) >= 5
+
+
+def main():
+	check_command_done()
+	check_open_ended()
+	latencies, elapsed = simulate()
+	worst = max(latencies) if latencies else None
+	print(f"Dispensed {len(latencies)} doses in {elapsed:.2f} s wall time")
+	print(f"Scheduled-time-to-dispense latency (virtual): mean {sum(latencies) / len(latencies):.2f} s, worst {worst:.2f} s")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,277 @@
+import os
+import json
+import threading
+from collections import deque, namedtuple
+from time import sleep, monotonic
+
+# Background serial ingestion: a reader thread frames lines from the Arduino,
+# parses them and keeps the latest reading (plus optional history) so callers
+# get the current temperature/humidity immediately instead of polling. With a
+# decoder (framing.FrameDecoder) raw chunks go to the decoder instead of the
+# line splitter, for the binary framed protocol. The readings of one frame
+# arrive together, so they are timestamped back from the frame's arrival at
+# the sampling interval rather than all at once.
+
+Reading = namedtuple("Reading", ["temperature", "humidity", "timestamp"])
+
+
+def parse_line(line):
+	try:
+		data = json.loads(line)
+	except (json.JSONDecodeError, UnicodeDecodeError):
+		return None
+	if not isinstance(data, dict):
+		return None
+	temperature = data.get("temperature")
+	humidity = data.get("humidity")
+	if temperature is None or humidity is None:
+		return None
+	return temperature, humidity
+
+
+class SerialReader:
+	# on_reading, if given, is called on the reader thread with every new Reading.
+	# interval is the board's seconds between readings; None estimates it from
+	# how often decoded readings arrive.
+	def __init__(self, ser, history=0, parser=parse_line, on_reading=None, decoder=None, interval=None):
+		self.ser = ser
+		self.interval = interval
+		self.spacing = None
+		self.arrived = None
+		self.on_reading = on_reading
+		self.parser = parser
+		self.decoder = decoder
+		self.buf = bytearray()
+		self.history = deque(maxlen=history) if history else None
+		self.reading = None
+		self.lines = 0
+		self.errors = 0
+		self.cond = threading.Condition()
+		self.running = False
+		self.thread = None
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self._run, name="serial-reader", daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join(timeout=2)
+
+	def _read_chunk(self):
+		waiting = getattr(self.ser, "in_waiting", 0)
+		return self.ser.read(max(1, waiting))
+
+	def _run(self):
+		while self.running:
+			try:
+				chunk = self._read_chunk()
+			except Exception as e:
+				print(f"Serial read error: {e}")
+				sleep(0.5)
+				continue
+			if chunk:
+				self.feed(chunk)
+
+	def feed(self, chunk):
+		if self.decoder is not None:
+			readings = self.decoder.feed(chunk)
+			self.lines += len(readings)
+			self.errors = self.decoder.errors
+			if readings:
+				now = monotonic()
+				step = self._spacing(now, len(readings))
+				if self.reading is not None:
+					# Never back past the previous reading
+					step = min(step, (now - self.reading.timestamp) / len(readings))
+				last = len(readings) - 1
+				for i, (temperature, humidity) in enumerate(readings):
+					self.publish(temperature, humidity, now - (last - i) * step)
+			return
+		buf = self.buf
+		buf.extend(chunk)
+		while True:
+			end = buf.find(b"\n")
+			if end < 0:
+				break
+			line = bytes(buf[:end]).strip()
+			del buf[:end + 1]
+			if line:
+				self._handle(line)
+		# A line this long is noise, not a reading
+		if len(buf) > 4096:
+			buf.clear()
+			self.errors += 1
+
+	# Seconds between the readings of one batch: the configured interval, or
+	# the arrival gap per reading smoothed over recent batches
+	def _spacing(self, now, n):
+		if self.arrived is not None:
+			gap = (now - self.arrived) / n
+			self.spacing = gap if self.spacing is None else 0.8 * self.spacing + 0.2 * gap
+		self.arrived = now
+		if self.interval is not None:
+			return self.interval
+		return self.spacing or 0.0
+
+	def _handle(self, line):
+		self.lines += 1
+		parsed = self.parser(line)
+		if parsed is None:
+			self.errors += 1
+			return
+		self.publish(*parsed)
+
+	def publish(self, temperature, humidity, timestamp=None):
+		reading = Reading(temperature, humidity, monotonic() if timestamp is None else timestamp)
+		with self.cond:
+			self.reading = reading
+			if self.history is not None:
+				self.history.append(reading)
+			self.cond.notify_all()
+		if self.on_reading is not None:
+			try:
+				self.on_reading(reading)
+			except Exception as e:
+				print(f"Reading handler error: {e}")
+
+	def latest(self):
+		return self.reading
+
+	def age(self):
+		reading = self.reading
+		return None if reading is None else monotonic() - reading.timestamp
+
+	def is_stale(self, max_age):
+		age = self.age()
+		return age is None or age > max_age
+
+	# (temperature, humidity), or (None, None) when nothing fresh is cached
+	def current(self, max_age=None):
+		reading = self.reading
+		if reading is None or (max_age is not None and monotonic() - reading.timestamp > max_age):
+			return None, None
+		return reading.temperature, reading.humidity
+
+	# Block until a reading newer than the cached one arrives
+	def next_reading(self, timeout=None):
+		with self.cond:
+			seen = self.reading
+			if not self.cond.wait_for(lambda: self.reading is not seen, timeout):
+				return None
+			return self.reading
+
+	def recent(self):
+		with self.cond:
+			return list(self.history) if self.history is not None else []
+
+
+class FakeArduino:
+	# pty stand-in for the Arduino: writes JSON lines to a pseudo-terminal
+	# whose slave side can be opened like /dev/ttyACM0. protocol="framed"
+	# sends framing.py frames of `batch` readings instead and answers baud
+	# requests (the pty itself ignores the rate).
+	def __init__(self, rate=1.0, temperature=22.0, humidity=45.0, protocol="json", batch=1):
+		import tty
+		self.master, self.slave = os.openpty()
+		tty.setraw(self.slave)
+		self.port = os.ttyname(self.slave)
+		self.rate = rate
+		self.temperature = temperature
+		self.humidity = humidity
+		self.protocol = protocol
+		self.batch = batch
+		self.pending = []
+		self.frames = 0
+		self.decoder = None
+		self.sent = 0
+		self.running = False
+		self.thread = None
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self._run, name="fake-arduino", daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join(timeout=2)
+		os.close(self.master)
+		os.close(self.slave)
+
+	def values(self):
+		t = self.temperature + (self.sent % 10) * 0.1
+		h = self.humidity + (self.sent % 7) * 0.5
+		return round(t, 1), round(h, 1)
+
+	def line(self):
+		t, h = self.values()
+		return json.dumps({"temperature": t, "humidity": h}).encode() + b"\n"
+
+	# Framed output: a frame once `batch` readings have been taken
+	def frame(self):
+		from framing import encode_readings
+		self.pending.append(self.values())
+		if len(self.pending) < self.batch:
+			return b""
+		data = encode_readings(self.pending, seq=self.frames)
+		self.pending = []
+		self.frames += 1
+		return data
+
+	def _control(self):
+		import select
+		from framing import FrameDecoder, encode_frame, BAUD, BAUD_ACK
+		if self.decoder is None:
+			self.decoder = FrameDecoder(on_control=lambda kind, payload: kind == BAUD and os.write(self.master, encode_frame(BAUD_ACK, payload)))
+		while select.select([self.master], [], [], 0)[0]:
+			self.decoder.feed(os.read(self.master, 256))
+
+	def _run(self):
+		interval = 1 / self.rate if self.rate else 0
+		while self.running:
+			try:
+				if self.protocol == "framed":
+					self._control()
+					os.write(self.master, self.frame())
+				else:
+					os.write(self.master, self.line())
+			except OSError:
+				break
+			self.sent += 1
+			if interval:
+				sleep(interval)
+
+
+def open_port(port, baud):
+	try:
+		import serial
+		return serial.Serial(port, baud, timeout=1)
+	except ImportError:
+		return os.fdopen(os.open(port, os.O_RDONLY | os.O_NOCTTY), "rb", buffering=0)
+
+
+def main():
+	arduino = FakeArduino(rate=500).start()
+	ser = open_port(arduino.port, 9600)
+	reader = SerialReader(ser, history=100).start()
+	reader.next_reading(timeout=2)
+	t0 = monotonic()
+	for _ in range(100000):
+		reader.current()
+	lookup = (monotonic() - t0) / 100000
+	sleep(2)
+	reader.stop()
+	arduino.stop()
+	print(f"Sent {arduino.sent} lines, parsed {reader.lines} ({reader.errors} errors)")
+	print(f"Latest: {reader.latest()}, history: {len(reader.recent())}")
+	print(f"current() lookup: {lookup * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+	main()
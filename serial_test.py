@@ -3,33 +3,42 @@ import json
 import cv2  
 import subprocess  
 import numpy as np  
-from gpiozero import LED  
+from hardware import LED, ImageImpulseRunner, open_serial, open_camera
 from time import sleep  
 from datetime import datetime
-from edge_impulse_linux.image import ImageImpulseRunner  
+from sensors import SerialReader
+from activity import MotionTrigger
 
 led = LED(23)  
 SERIAL_PORT = '/dev/ttyACM0'  
 BAUD_RATE = 9600  
 MODEL_PATH = "/home/Shruthigna/Documents/face_recognition-linux-aarch64-v13.eim"  
+CAMERA_BACKEND = "picamera"
 auth_labels = ["jayne", "areebah", "shruthigna"]  
 confidence_threshold = 0.8  
+MOTION_SENSITIVITY = 0.02
+MOTION_COOLDOWN = 10
+camera = None
+trigger = MotionTrigger(sensitivity=MOTION_SENSITIVITY, cooldown=MOTION_COOLDOWN)
 
 def capture_frame(filename="/tmp/frame.jpg"):  
+	if camera is not None:
+		return camera.grab()
 	subprocess.run(["rpicam-jpeg", "-o", filename, "-t", "1000"], check=True) 
 	frame = cv2.imread(filename)  
 	return frame  
 
  
 def main():  
+	global camera
 	try: 
-		ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) 
+		ser = open_serial(SERIAL_PORT, BAUD_RATE) 
 		print("Connected to Arduino") 
-		sleep(2) 
-		ser.reset_input_buffer() 
+		sensor_reader = SerialReader(ser).start()
 	except serial.SerialException as e: 
 		print(f"Arduino connection error: {e}") 
 		ser = None 
+		sensor_reader = None
 		
 	
 	with ImageImpulseRunner(MODEL_PATH) as runner:
@@ -38,27 +47,31 @@ def main():
 		width = model_info['model_parameters']['image_input_width'] 
 		height = model_info['model_parameters']['image_input_height'] 
 		print(f"Model loaded, labels: {labels}, width: {width}, height: {height}") 
+		try:
+			camera = open_camera(CAMERA_BACKEND, width, height)
+		except Exception as e:
+			print(f"Camera engine unavailable, falling back to rpicam-jpeg: {e}")
 		
+		last_reading = None
 		try: 
 			while True:
-				if ser and ser.in_waiting > 0: 
-					line = ser.readline().decode('utf-8').strip() 
-					if line: 
-						try: 
-							data = json.loads(line) 
-							temperature = data.get("temperature") 
-							humidity = data.get("humidity") 
-							print(f"\n Temperature: {temperature}°C, Humidity: {humidity}%") 
-						except json.JSONDecodeError: 
-							print(f"Invalid JSON: {line}") 
+				reading = sensor_reader.latest() if sensor_reader else None
+				if reading is not None and reading is not last_reading: 
+					last_reading = reading
+					print(f"\n Temperature: {reading.temperature}°C, Humidity: {reading.humidity}%") 
 							
-				print("\n Checking face recognition...") 
 				frame = capture_frame() 
 				if frame is None: 
 					print("Failed to capture frame") 
 					sleep(2) 
 					continue 
+					
+				if not trigger.should_infer(frame):
+					sleep(1)
+					continue
 				
+				print("\n Checking face recognition...") 
+				trigger.record_inference()
 				features, cropped = runner.get_features_from_image(frame) 
 				result = runner.classify(features) 
 				
@@ -81,12 +94,16 @@ def main():
 				sleep(5)
 				date = datetime.now().date()
 				time = datetime.now().time()
-				print(f"DateTime: {date} {time}")
+				print(f"DateTime: {date} {time}, inferences/min: {trigger.inferences_per_minute()}")
 				
 					
 		except KeyboardInterrupt: 
 			print("\n\nExiting...") 
 			led.off() 
+			if camera:
+				camera.stop()
+			if sensor_reader:
+				sensor_reader.stop()
 			if ser: 
 				ser.close() 
 				
@@ -0,0 +1,127 @@
+import threading
+from time import sleep, monotonic
+
+# Startup orchestrator: init steps (serial, MQTT, model runner, camera, ...)
+# run on their own threads as soon as the steps they depend on are done, so
+# the TLS handshake, model load and first serial line overlap instead of
+# running one after another behind fixed sleeps. report() prints when each
+# step started and how long it took.
+
+
+class Step:
+	def __init__(self, name, fn, after, required):
+		self.name = name
+		self.fn = fn
+		self.after = tuple(after)
+		self.required = required
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+		self.status = "pending"
+		self.started = None
+		self.finished = None
+
+	@property
+	def duration(self):
+		return self.finished - self.started if self.started and self.finished else 0.0
+
+
+class Startup:
+	def __init__(self):
+		self.steps = {}
+		self.t0 = None
+		self.threads = []
+
+	# fn is called with the results of the `after` steps, in order. A step
+	# whose dependency failed is skipped. result() re-raises failures of
+	# required steps.
+	def add(self, name, fn, after=(), required=False):
+		for dep in after:
+			if dep not in self.steps:
+				raise ValueError(f"Step {name} depends on unknown step {dep}")
+		self.steps[name] = Step(name, fn, after, required)
+		return self
+
+	def _run(self, step):
+		deps = [self.steps[dep] for dep in step.after]
+		for dep in deps:
+			dep.done.wait()
+		failed = [dep.name for dep in deps if dep.status != "ok"]
+		if failed:
+			step.status = "skipped"
+			step.error = RuntimeError(f"{step.name} skipped, {', '.join(failed)} not ready")
+			step.done.set()
+			return
+		step.started = monotonic()
+		try:
+			step.result = step.fn(*[dep.result for dep in deps])
+			step.status = "ok"
+		except Exception as e:
+			step.error = e
+			step.status = "failed"
+			print(f"Startup step {step.name} failed: {e}")
+		step.finished = monotonic()
+		step.done.set()
+
+	def start(self):
+		self.t0 = monotonic()
+		for step in self.steps.values():
+			thread = threading.Thread(target=self._run, args=(step,), name=f"startup-{step.name}", daemon=True)
+			thread.start()
+			self.threads.append(thread)
+		return self
+
+	# Wait for one step, or all of them
+	def wait(self, name=None, timeout=None):
+		steps = [self.steps[name]] if name else list(self.steps.values())
+		deadline = None if timeout is None else monotonic() + timeout
+		for step in steps:
+			left = None if deadline is None else max(0, deadline - monotonic())
+			if not step.done.wait(left):
+				return False
+		return True
+
+	def run(self, timeout=None):
+		self.start()
+		self.wait(timeout=timeout)
+		return self
+
+	def result(self, name):
+		step = self.steps[name]
+		step.done.wait()
+		if step.error is not None and step.required:
+			raise step.error
+		return step.result
+
+	def elapsed(self):
+		finished = [s.finished for s in self.steps.values() if s.finished]
+		return (max(finished) - self.t0) if finished and self.t0 else 0.0
+
+	def timings(self):
+		return {name: step.duration for name, step in self.steps.items()}
+
+	def report(self):
+		print("Startup:")
+		for step in sorted(self.steps.values(), key=lambda s: s.started or float("inf")):
+			offset = step.started - self.t0 if step.started else 0.0
+			print(f"  {step.name:<10} at {offset:5.2f} s  took {step.duration:5.2f} s  {step.status}")
+		total = sum(self.timings().values())
+		wall = self.elapsed()
+		print(f"  ready in {wall:.2f} s (steps sum to {total:.2f} s)")
+
+
+def main():
+	# Stand-in durations for a Pi cold start
+	startup = Startup()
+	startup.add("ledger", lambda: sleep(0.05))
+	startup.add("serial", lambda: sleep(0.8) or "ser")
+	startup.add("mqtt", lambda: sleep(1.5) or "client")
+	startup.add("outbox", lambda client: sleep(0.05), after=["mqtt"])
+	startup.add("runner", lambda: sleep(2.0) or {"w": 96}, required=True)
+	startup.add("camera", lambda info: sleep(0.6), after=["runner"])
+	startup.run()
+	startup.report()
+
+
+if __name__ == "__main__":
+	main()
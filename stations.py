@@ -0,0 +1,418 @@
+import os
+import sys
+import json
+import ssl
+import queue
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from datetime import datetime
+from time import sleep, monotonic
+import numpy as np
+
+# Multi-station supervisor: each dispenser station runs in its own process
+# with its own camera and model runner, so recognition for several units
+# uses all cores. The parent owns the shared pieces (dose schedule, ledger,
+# MQTT outbox), sends jobs down a per-station queue and gets small result
+# tuples back on one shared queue. Each station also mirrors its latest
+# frame into a shared-memory block the parent can read without pickling.
+
+MODEL_PATH = "/home/Shruthigna/Documents/face_recognition-linux-aarch64-v14.eim"
+CONFIDENCE_THRESHOLD = 0.8
+BURST_FRAMES = 5
+DISPENSE_ANGLE = 60
+CAPTURE_SIZE = (640, 480)
+PREVIEW_SHAPE = (480, 640, 3)
+HEADER = 16
+# Seconds between recognition attempts for a dose still pending
+RETRY_DELAY = 10
+# Restarts of a station that dies before it is ready back off up to this long
+RESTART_BACKOFF = (1, 60)
+
+# name -> camera backend (+ camera_args, capture_size), the people it doses and optionally
+# its own stepper pins (IN1..IN4) and model (+ format, labels, size, threads
+# as in backends.py)
+STATIONS = {
+	"station1": {"camera": "picamera", "schedule": {"jayne": "20:52"}, "motor": [17, 27, 22, 5]},
+	"station2": {"camera": "opencv", "camera_args": {"device": 1}, "schedule": {"areebah": "13:00"}},
+}
+
+AWS_IOT_ENDPOINT = "a9saj11jrwuqo-ats.iot.us-east-2.amazonaws.com"
+AWS_IOT_PORT = 8883
+AWS_IOT_TOPIC = "raspi/data"
+CA_CERT_PATH = 'certs/AmazonRootCA1.pem'
+CERT_PATH = 'certs/certificate.pem.crt'
+KEY_PATH = 'certs/private.pem.key'
+OUTBOX_PATH = "outbox.db"
+LEDGER_PATH = "dispense_ledger.db"
+
+
+def station_worker(name, config, jobs, results, preview_name):
+	started = monotonic()
+	from hardware import OutputDevice, open_camera
+	from backends import open_backend
+	from burst import burst_recognize
+	from gating import FrameGate, load_face_detector
+	from motion import MotionController, plan_angle
+
+	shm = shared_memory.SharedMemory(name=preview_name)
+	header = np.ndarray(4, dtype=np.int32, buffer=shm.buf)
+	threshold = config.get("threshold", CONFIDENCE_THRESHOLD)
+	motion = None
+	if config.get("motor"):
+		motion = MotionController([OutputDevice(pin) for pin in config["motor"]])
+
+	runner = open_backend(config.get("model", MODEL_PATH), config.get("format"), labels=config.get("labels"),
+		size=config.get("size"), threads=config.get("threads"))
+	with runner:
+		info = runner.init()
+		width = info['model_parameters']['image_input_width']
+		height = info['model_parameters']['image_input_height']
+		camera = open_camera(config.get("camera", "picamera"), width, height,
+			capture_size=config.get("capture_size", CAPTURE_SIZE), **config.get("camera_args", {}))
+		gate = FrameGate(detector=load_face_detector())
+		size = height * width * 3
+		preview = np.ndarray((height, width, 3), dtype=np.uint8, buffer=shm.buf, offset=HEADER) \
+			if HEADER + size <= shm.size else None
+
+		# The gate gets capture-resolution frames for its face detector; the
+		# preview shows the model's view of the same frame
+		def capture():
+			frame = camera.grab(full=True)
+			if frame is not None and preview is not None and camera.latest(out=preview) is not None:
+				header[1:3] = preview.shape[:2]
+				header[0] += 1
+			return frame
+
+		results.put(("ready", name, monotonic() - started))
+		try:
+			while True:
+				job = jobs.get()
+				if job is None:
+					break
+				job_id, person = job
+				t0 = monotonic()
+				result = burst_recognize(lambda: gate.capture(capture), runner, frames=BURST_FRAMES, threshold=threshold)
+				recognize_s = monotonic() - t0
+				dispensed = False
+				if person is not None and result.label == person and result.confidence >= threshold and motion:
+					motion.move(plan_angle(config.get("angle", DISPENSE_ANGLE), 1)).wait()
+					dispensed = True
+				results.put(("result", name, job_id, person, result.label, result.confidence, result.frames,
+					recognize_s, dispensed, monotonic()))
+		finally:
+			camera.stop()
+			if motion:
+				motion.close()
+			shm.close()
+
+
+class Station:
+	def __init__(self, name, config):
+		self.name = name
+		self.config = config
+		self.process = None
+		self.jobs = None
+		self.preview = None
+		self.ready = threading.Event()
+		self.startup = None
+		self.latencies = []
+		self.recognize = []
+		self.completed = 0
+		self.restarts = 0
+		self.failures = 0
+		self.retry_at = None
+
+
+class StationSupervisor:
+	# on_result(station, job_id, person, label, confidence, dispensed) runs on the collector thread
+	def __init__(self, stations, on_result=None, preview_shape=PREVIEW_SHAPE, context="spawn"):
+		self.ctx = mp.get_context(context)
+		self.stations = {name: Station(name, config) for name, config in stations.items()}
+		self.on_result = on_result
+		self.preview_size = HEADER + int(np.prod(preview_shape))
+		self.results = self.ctx.Queue()
+		self.pending = {}
+		self.lock = threading.Lock()
+		self.next_id = 0
+		self.started = None
+		self.running = False
+		self.collector = None
+
+	def start(self):
+		self.started = monotonic()
+		self.running = True
+		for station in self.stations.values():
+			station.preview = shared_memory.SharedMemory(create=True, size=self.preview_size)
+			station.preview.buf[:HEADER] = bytes(HEADER)
+			self._spawn(station)
+		self.collector = threading.Thread(target=self._collect, name="station-results", daemon=True)
+		self.collector.start()
+		return self
+
+	def _spawn(self, station):
+		station.ready.clear()
+		station.jobs = self.ctx.Queue()
+		station.process = self.ctx.Process(target=station_worker, name=station.name, daemon=True,
+			args=(station.name, station.config, station.jobs, self.results, station.preview.name))
+		station.process.start()
+
+	def wait_ready(self, timeout=None):
+		deadline = None if timeout is None else monotonic() + timeout
+		for station in self.stations.values():
+			left = None if deadline is None else max(0, deadline - monotonic())
+			if not station.ready.wait(left):
+				return False
+		return True
+
+	# Restart stations whose process died and return the ids of their dropped
+	# in-flight jobs. One that dies before reporting ready (bad camera, missing
+	# model) is restarted with exponential backoff rather than on every check
+	def check(self):
+		now = monotonic()
+		dropped = []
+		for station in self.stations.values():
+			if not self.running or station.process.is_alive():
+				continue
+			if station.retry_at is None:
+				station.failures = 0 if station.ready.is_set() else station.failures + 1
+				delay = min(RESTART_BACKOFF[0] * 2 ** (station.failures - 1), RESTART_BACKOFF[1]) if station.failures else 0
+				station.retry_at = now + delay
+				print(f"Station {station.name} exited ({station.process.exitcode}), restarting in {delay} s")
+			if now < station.retry_at:
+				continue
+			with self.lock:
+				for job_id in [j for j, (name, _) in self.pending.items() if name == station.name]:
+					del self.pending[job_id]
+					dropped.append(job_id)
+			station.retry_at = None
+			station.restarts += 1
+			self._spawn(station)
+		return dropped
+
+	def submit(self, name, person=None):
+		with self.lock:
+			job_id = self.next_id
+			self.next_id += 1
+			self.pending[job_id] = (name, monotonic())
+		self.stations[name].jobs.put((job_id, person))
+		return job_id
+
+	def idle(self):
+		return not self.pending
+
+	def _collect(self):
+		while self.running:
+			try:
+				msg = self.results.get(timeout=0.5)
+			except queue.Empty:
+				continue
+			station = self.stations[msg[1]]
+			if msg[0] == "ready":
+				station.startup = msg[2]
+				station.ready.set()
+				continue
+			_, name, job_id, person, label, confidence, frames, recognize_s, dispensed, done = msg
+			with self.lock:
+				job = self.pending.pop(job_id, None)
+			if job is None:
+				continue
+			station.latencies.append(done - job[1])
+			station.recognize.append(recognize_s)
+			station.completed += 1
+			if self.on_result is not None:
+				try:
+					self.on_result(name, job_id, person, label, confidence, dispensed)
+				except Exception as e:
+					print(f"Result handler error: {e}")
+
+	# Copy of the station's most recent frame, or None before the first capture
+	def frame(self, name):
+		buf = self.stations[name].preview.buf
+		seq, h, w, _ = np.ndarray(4, dtype=np.int32, buffer=buf)
+		if not seq:
+			return None
+		return np.ndarray((h, w, 3), dtype=np.uint8, buffer=buf, offset=HEADER).copy()
+
+	def stats(self):
+		elapsed = monotonic() - self.started if self.started else 0
+		out = {"jobs": sum(s.completed for s in self.stations.values()), "elapsed_s": round(elapsed, 2), "stations": {}}
+		out["throughput_per_s"] = round(out["jobs"] / elapsed, 2) if elapsed else 0.0
+		for name, s in self.stations.items():
+			lat = np.asarray(s.latencies) * 1000
+			out["stations"][name] = {
+				"jobs": s.completed,
+				"startup_s": round(s.startup, 2) if s.startup is not None else None,
+				"p50_ms": round(float(np.percentile(lat, 50)), 1) if len(lat) else None,
+				"p95_ms": round(float(np.percentile(lat, 95)), 1) if len(lat) else None,
+				"recognize_ms": round(float(np.mean(s.recognize)) * 1000, 1) if s.recognize else None,
+				"restarts": s.restarts,
+			}
+		return out
+
+	def stop(self):
+		for station in self.stations.values():
+			if station.process is not None and station.process.is_alive():
+				station.jobs.put(None)
+		for station in self.stations.values():
+			if station.process is not None:
+				station.process.join(timeout=5)
+				if station.process.is_alive():
+					station.process.terminate()
+		self.running = False
+		if self.collector is not None:
+			self.collector.join(timeout=2)
+		for station in self.stations.values():
+			if station.preview is not None:
+				station.preview.close()
+				station.preview.unlink()
+
+
+def setup_mqtt():
+	import paho.mqtt.client as mqtt
+	state = {"connected": False}
+
+	def on_connect(client, userdata, flags, rc):
+		state["connected"] = rc == 0
+		print("Connected to AWS IoT Successfully" if rc == 0 else f"Failed to connect to AWS IoT: {rc}")
+
+	def on_disconnect(client, userdata, rc):
+		state["connected"] = False
+		print(f"Disconnected from AWS IoT ({rc})")
+
+	try:
+		client = mqtt.Client()
+		client.on_connect = on_connect
+		client.on_disconnect = on_disconnect
+		client.tls_set(ca_certs=CA_CERT_PATH, certfile=CERT_PATH, keyfile=KEY_PATH, tls_version=ssl.PROTOCOL_TLSv1_2)
+		client.connect(AWS_IOT_ENDPOINT, AWS_IOT_PORT, 60)
+		client.loop_start()
+		return client, lambda: state["connected"]
+	except Exception as e:
+		print(f"Error setting up AWS IoT: {e}")
+		return None, lambda: False
+
+
+def run(stations=STATIONS):
+	from scheduler import DoseScheduler
+	from ledger import DispenseLedger
+	from outbox import PublishQueue
+
+	home = {person: name for name, config in stations.items() for person in config.get("schedule", {})}
+	schedule = {person: spec for config in stations.values() for person, spec in config.get("schedule", {}).items()}
+	scheduler = DoseScheduler(schedule)
+	ledger = DispenseLedger(LEDGER_PATH)
+	client, connected = setup_mqtt()
+	# Dispense results outrank anything else queued during an outage
+	outbox = PublishQueue(client, OUTBOX_PATH, is_connected=connected, priorities={AWS_IOT_TOPIC: 2}).start()
+	# pending, doses, retry_at and last are shared with on_result on the
+	# collector thread
+	lock = threading.Lock()
+	pending = {}
+	doses = {}
+	retry_at = {}
+	last = {}
+
+	def publish(name, person, confidence):
+		now = datetime.now()
+		outbox.put(AWS_IOT_TOPIC, json.dumps({"Person": person, "Station": name, "Confidence": round(confidence, 3),
+			"Date": now.strftime("%Y-%m-%d"), "Time": now.strftime("%H-%M-%S")}))
+
+	# Only final outcomes are published: the dose given, or (from the main
+	# loop) its grace window running out. A station without a motor cannot
+	# dispense, so there recognition is the outcome.
+	def on_result(name, job_id, person, label, confidence, dispensed):
+		print(f"[{name}] {person}: detected {label} ({confidence:.2f}){' -> dispensed' if dispensed else ''}")
+		config = stations[name]
+		recognized = label == person and confidence >= config.get("threshold", CONFIDENCE_THRESHOLD)
+		with lock:
+			dose = doses.pop(job_id, None)
+			if dose is None:
+				return
+			key = (dose.date, dose.person, dose.slot)
+			if not (dispensed or (recognized and not config.get("motor"))):
+				if key in pending:
+					last[key] = (name, confidence)
+					retry_at[key] = monotonic() + RETRY_DELAY
+				return
+			ledger.record(*key)
+			pending.pop(key, None)
+			retry_at.pop(key, None)
+			last.pop(key, None)
+		publish(name, label, confidence)
+
+	supervisor = StationSupervisor(stations, on_result=on_result).start()
+	supervisor.wait_ready(60)
+	print(f"Stations ready: {supervisor.stats()['stations']}")
+	try:
+		while True:
+			now = datetime.now()
+			missed = []
+			with lock:
+				for dose in scheduler.pop_due(now):
+					if not ledger.contains(dose.date, dose.person, dose.slot):
+						pending[(dose.date, dose.person, dose.slot)] = dose
+				in_flight = set(doses.values())
+				for key, dose in list(pending.items()):
+					if dose.expired(now):
+						del pending[key]
+						retry_at.pop(key, None)
+						missed.append(last.pop(key, (home[dose.person], 0.0)))
+					elif dose not in in_flight and monotonic() >= retry_at.get(key, 0):
+						# One recognition attempt per dose in flight, RETRY_DELAY apart
+						# until the grace window ends. The lock is held across submit
+						# so a result arriving at once still finds its dose registered
+						doses[supervisor.submit(home[dose.person], dose.person)] = dose
+			for name, confidence in missed:
+				publish(name, "unknown", confidence)
+			dropped = supervisor.check()
+			with lock:
+				for job_id in dropped:
+					doses.pop(job_id, None)
+			sleep(1)
+	except KeyboardInterrupt:
+		print("Stopping")
+	finally:
+		print(json.dumps(supervisor.stats(), indent=2))
+		supervisor.stop()
+		ledger.close()
+		outbox.stop()
+		if client:
+			client.loop_stop()
+			client.disconnect()
+
+
+def bench(n_stations=4, jobs=40):
+	os.environ.setdefault("DISPENSER_BACKEND", "sim")
+	stations = {f"sim{i}": {"camera": "file"} for i in range(n_stations)}
+	supervisor = StationSupervisor(stations).start()
+	t0 = monotonic()
+	if not supervisor.wait_ready(60):
+		print("Stations did not start")
+	print(f"{n_stations} stations ready in {monotonic() - t0:.2f} s")
+	supervisor.started = monotonic()
+	names = list(stations)
+	for i in range(jobs):
+		supervisor.submit(names[i % n_stations])
+	while not supervisor.idle():
+		sleep(0.01)
+	stats = supervisor.stats()
+	supervisor.stop()
+	print(f"{stats['jobs']} recognitions in {stats['elapsed_s']} s: {stats['throughput_per_s']} /s on {os.cpu_count()} cores")
+	for name, s in stats["stations"].items():
+		print(f"  {name}: {s['jobs']} jobs, p50 {s['p50_ms']} ms, p95 {s['p95_ms']} ms, "
+			f"recognize {s['recognize_ms']} ms, startup {s['startup_s']} s")
+	return stats
+
+
+def main():
+	if len(sys.argv) > 1 and sys.argv[1] == "bench":
+		n = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+		jobs = int(sys.argv[3]) if len(sys.argv) > 3 else 10 * n
+		bench(n, jobs)
+	else:
+		run()
+
+
+if __name__ == "__main__":
+	main()
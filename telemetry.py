@@ -0,0 +1,225 @@
+import json
+import struct
+import threading
+from datetime import datetime
+from time import time
+
+# Compact telemetry frames for the raspi/data topic. A frame packs several
+# readings: timestamps and sensor values are delta-encoded as zigzag varints
+# and person names go through a per-frame string table.
+#
+#   u8 version | u32 base timestamp | varint label count | labels (varint len + utf-8)
+#   varint reading count | per reading:
+#     u8 presence bits | varint dt | varint label index | zigzag temp delta | zigzag humidity delta
+#
+# Temperature and humidity are carried in tenths. decode_payload() also
+# accepts the JSON payloads publish_to_aws has always sent.
+
+VERSION = 1
+SCALE = 10
+HAS_TEMPERATURE = 1
+HAS_HUMIDITY = 2
+
+
+def write_varint(out, value):
+	while value >= 0x80:
+		out.append((value & 0x7F) | 0x80)
+		value >>= 7
+	out.append(value)
+
+
+def read_varint(data, pos):
+	result = shift = 0
+	while True:
+		byte = data[pos]
+		pos += 1
+		result |= (byte & 0x7F) << shift
+		if byte < 0x80:
+			return result, pos
+		shift += 7
+
+
+def zigzag(n):
+	return (n << 1) ^ (n >> 63)
+
+
+def unzigzag(n):
+	return (n >> 1) ^ -(n & 1)
+
+
+# readings are (timestamp, person, temperature, humidity) tuples
+def encode_frame(readings):
+	readings = sorted(readings, key=lambda r: r[0])
+	base = int(readings[0][0]) if readings else int(time())
+	labels = {}
+	for _, person, _, _ in readings:
+		labels.setdefault(person or "", len(labels))
+
+	out = bytearray(struct.pack("<BI", VERSION, base))
+	write_varint(out, len(labels))
+	for label in labels:
+		raw = label.encode()
+		write_varint(out, len(raw))
+		out += raw
+	write_varint(out, len(readings))
+
+	prev_ts, prev_t, prev_h = base, 0, 0
+	for ts, person, temperature, humidity in readings:
+		ts = int(ts)
+		bits = (HAS_TEMPERATURE if temperature is not None else 0) | (HAS_HUMIDITY if humidity is not None else 0)
+		out.append(bits)
+		write_varint(out, ts - prev_ts)
+		write_varint(out, labels[person or ""])
+		if temperature is not None:
+			t = round(temperature * SCALE)
+			write_varint(out, zigzag(t - prev_t))
+			prev_t = t
+		if humidity is not None:
+			h = round(humidity * SCALE)
+			write_varint(out, zigzag(h - prev_h))
+			prev_h = h
+		prev_ts = ts
+	return bytes(out)
+
+
+def decode_frame(data):
+	version, base = struct.unpack_from("<BI", data)
+	if version != VERSION:
+		raise ValueError(f"Unsupported telemetry version {version}")
+	pos = 5
+	n_labels, pos = read_varint(data, pos)
+	labels = []
+	for _ in range(n_labels):
+		length, pos = read_varint(data, pos)
+		labels.append(bytes(data[pos:pos + length]).decode())
+		pos += length
+	count, pos = read_varint(data, pos)
+
+	readings = []
+	ts, t, h = base, 0, 0
+	for _ in range(count):
+		bits = data[pos]
+		pos += 1
+		dt, pos = read_varint(data, pos)
+		index, pos = read_varint(data, pos)
+		ts += dt
+		temperature = humidity = None
+		if bits & HAS_TEMPERATURE:
+			delta, pos = read_varint(data, pos)
+			t += unzigzag(delta)
+			temperature = t / SCALE
+		if bits & HAS_HUMIDITY:
+			delta, pos = read_varint(data, pos)
+			h += unzigzag(delta)
+			humidity = h / SCALE
+		readings.append((ts, labels[index] or None, temperature, humidity))
+	return readings
+
+
+def to_json_payload(reading):
+	ts, person, temperature, humidity = reading
+	now = datetime.fromtimestamp(ts)
+	return { "Person": person, "Temperature": temperature, "Humidity": humidity, "Date": now.strftime("%Y-%m-%d"), "Time": now.strftime("%H-%M-%S") }
+
+
+def from_json_payload(payload):
+	ts = datetime.strptime(f"{payload['Date']} {payload['Time']}", "%Y-%m-%d %H-%M-%S").timestamp()
+	return ts, payload.get("Person"), payload.get("Temperature"), payload.get("Humidity")
+
+
+# Decode either format into reading tuples
+def decode_payload(payload):
+	if isinstance(payload, str):
+		payload = payload.encode()
+	if payload[:1] in (b"{", b"["):
+		data = json.loads(payload)
+		return [from_json_payload(p) for p in (data if isinstance(data, list) else [data])]
+	return decode_frame(payload)
+
+
+def encode_payload(readings, fmt="binary"):
+	if fmt == "json":
+		if len(readings) == 1:
+			return json.dumps(to_json_payload(readings[0]))
+		return json.dumps([to_json_payload(r) for r in readings])
+	return encode_frame(readings)
+
+
+class TelemetryBatcher:
+	# Collects readings and returns an encoded frame once max_readings are
+	# buffered or the oldest one is max_age seconds old. With on_flush, a
+	# timer also hands over a partial batch max_age seconds after its first
+	# reading, so a quiet feed is not held back until the next reading.
+	# Buffered readings are only in memory until then.
+	def __init__(self, max_readings=20, max_age=60.0, fmt="binary", on_flush=None):
+		self.max_readings = max_readings
+		self.max_age = max_age
+		self.fmt = fmt
+		self.on_flush = on_flush
+		self.lock = threading.Lock()
+		self.timer = None
+		self.readings = []
+
+	def add(self, reading):
+		with self.lock:
+			self.readings.append(reading)
+			if len(self.readings) >= self.max_readings or reading[0] - self.readings[0][0] >= self.max_age:
+				return self._take()
+			if self.on_flush is not None and self.timer is None:
+				self.timer = threading.Timer(self.max_age, self._expire)
+				self.timer.daemon = True
+				self.timer.start()
+		return None
+
+	def _expire(self):
+		with self.lock:
+			self.timer = None
+			frame = self._take()
+		if frame is not None:
+			self.on_flush(frame)
+
+	def _take(self):
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
+		if not self.readings:
+			return None
+		frame = encode_payload(self.readings, self.fmt)
+		self.readings = []
+		return frame
+
+	def flush(self):
+		with self.lock:
+			return self._take()
+
+
+def main():
+	import random
+	from time import perf_counter
+
+	random.seed(0)
+	start = datetime(2026, 1, 1).timestamp()
+	readings = []
+	t, h = 22.0, 45.0
+	for i in range(1000):
+		t += random.uniform(-0.2, 0.2)
+		h += random.uniform(-0.5, 0.5)
+		readings.append((start + i * 5, random.choice(["jayne", "areebah", "unknown"]), round(t, 1), round(h, 1)))
+
+	t0 = perf_counter()
+	sizes = [len(json.dumps(to_json_payload(r))) for r in readings]
+	per = (perf_counter() - t0) / len(readings)
+	print(f"json.dumps per reading: {sum(sizes) / len(sizes):.1f} bytes, {per * 1e6:.1f} us/reading")
+
+	for batch in (1, 10, 50):
+		t0 = perf_counter()
+		frames = [encode_frame(readings[i:i + batch]) for i in range(0, len(readings), batch)]
+		per = (perf_counter() - t0) / len(readings)
+		total = sum(len(f) for f in frames)
+		decoded = [r for f in frames for r in decode_frame(f)]
+		assert [(int(a[0]), a[1], a[2], a[3]) for a in readings] == decoded
+		print(f"binary batch {batch:>2}: {total / len(readings):.1f} bytes/reading, {per * 1e6:.1f} us/reading")
+
+
+if __name__ == "__main__":
+	main()
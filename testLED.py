@@ -1,9 +1,8 @@
 import cv2
 import subprocess
 import numpy as np
-from gpiozero import LED
+from hardware import LED, ImageImpulseRunner
 from time import sleep
-from edge_impulse_linux.image import ImageImpulseRunner
 
 MODEL_PATH = "/home/Shruthigna/Documents/face_recognition-linux-aarch64-v13.eim"
 auth_labels = ["jayne", "areebah", "shruthigna"]